@@ -0,0 +1,171 @@
+"""03 security_nonces partitions
+
+Revision ID: 7d3f2a9c41b8
+Revises: 582c95e7871b
+Create Date: 2026-10-18 10:12:41.204518
+
+Particiona `security_nonces` por rango de `received_at` (particiones diarias
+creadas acá; luego las mantiene NoncePartitionManager con el intervalo
+configurado). Un índice único en una tabla particionada debe incluir la clave de
+partición, así que la detección de replay pasa a `register_nonces(...)`:
+lock advisory por (client_id, nonce) + INSERT ... WHERE NOT EXISTS dentro de la
+ventana de replay (con poda de particiones).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d3f2a9c41b8'
+down_revision: Union[str, Sequence[str], None] = '582c95e7871b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+S = "bootstrap_app"
+
+_COLUMNS = (
+    "cod_security_nonce, integration_client_cod, create_date, update_date, delete_date, "
+    "create_user, user_at, active, client_id, nonce, request_ts, received_at"
+)
+
+_UTC_TODAY = "(date_trunc('day', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC')"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(f"ALTER TABLE {S}.security_nonces RENAME TO security_nonces_legacy")
+    op.execute(f"ALTER TABLE {S}.security_nonces_legacy RENAME CONSTRAINT pk_security_nonces TO pk_security_nonces_legacy")
+    op.execute(f"ALTER TABLE {S}.security_nonces_legacy RENAME CONSTRAINT uq_nonce_per_client TO uq_nonce_per_client_legacy")
+    op.execute(
+        f"ALTER TABLE {S}.security_nonces_legacy RENAME CONSTRAINT "
+        "fk_security_nonces_integration_client_cod_integration_clients TO fk_security_nonces_legacy_integration_client_cod"
+    )
+    op.execute(f"DROP INDEX IF EXISTS {S}.ix_bootstrap_app_security_nonces_client_id")
+    op.execute(f"ALTER SEQUENCE {S}.security_nonces_cod_security_nonce_seq OWNED BY NONE")
+
+    op.execute(f"""
+        CREATE TABLE {S}.security_nonces (
+            cod_security_nonce integer NOT NULL DEFAULT nextval('{S}.security_nonces_cod_security_nonce_seq'),
+            integration_client_cod integer NOT NULL,
+            create_date timestamptz NOT NULL DEFAULT now(),
+            update_date timestamptz,
+            delete_date timestamptz,
+            create_user integer NOT NULL,
+            user_at integer NOT NULL,
+            active boolean NOT NULL DEFAULT true,
+            client_id varchar(64) NOT NULL,
+            nonce varchar(64) NOT NULL,
+            request_ts timestamptz NOT NULL,
+            received_at timestamptz NOT NULL DEFAULT now(),
+            CONSTRAINT pk_security_nonces PRIMARY KEY (cod_security_nonce, received_at),
+            CONSTRAINT fk_security_nonces_integration_client_cod_integration_clients
+                FOREIGN KEY (integration_client_cod)
+                REFERENCES {S}.integration_clients (cod_integration_client) ON DELETE CASCADE
+        ) PARTITION BY RANGE (received_at)
+    """)
+    op.execute(f"CREATE INDEX ix_security_nonces_client_nonce ON {S}.security_nonces (client_id, nonce, received_at)")
+    op.execute(f"CREATE TABLE {S}.security_nonces_default PARTITION OF {S}.security_nonces DEFAULT")
+    op.execute(f"""
+        DO $$
+        DECLARE d timestamptz;
+        BEGIN
+            FOR d IN SELECT generate_series({_UTC_TODAY} - interval '1 day', {_UTC_TODAY} + interval '2 day', interval '1 day')
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS {S}.%I PARTITION OF {S}.security_nonces FOR VALUES FROM (%L) TO (%L)',
+                    'security_nonces_p' || to_char(d AT TIME ZONE 'UTC', 'YYYYMMDD'), d, d + interval '1 day'
+                );
+            END LOOP;
+        END $$
+    """)
+
+    # solo sirven los nonces recientes (fuera de la ventana el timestamp ya se rechaza)
+    op.execute(f"""
+        INSERT INTO {S}.security_nonces ({_COLUMNS})
+        SELECT {_COLUMNS} FROM {S}.security_nonces_legacy
+        WHERE received_at >= {_UTC_TODAY} - interval '1 day'
+    """)
+    op.execute(f"DROP TABLE {S}.security_nonces_legacy")
+    op.execute(f"ALTER SEQUENCE {S}.security_nonces_cod_security_nonce_seq OWNED BY {S}.security_nonces.cod_security_nonce")
+
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION {S}.register_nonces(
+            p_ic integer[],
+            p_client_id text[],
+            p_nonce text[],
+            p_request_ts bigint[],
+            p_window_seconds integer
+        )
+        RETURNS TABLE (out_client_id varchar, out_nonce varchar)
+        LANGUAGE plpgsql
+        AS $fn$
+        BEGIN
+            -- serializa por (client_id, nonce), en orden fijo para no generar deadlocks
+            PERFORM pg_advisory_xact_lock(hashtextextended(k.cid || ':' || k.n, 0))
+            FROM (
+                SELECT DISTINCT u.cid, u.n FROM unnest(p_client_id, p_nonce) AS u(cid, n) ORDER BY 1, 2
+            ) AS k;
+
+            -- sentencia nueva => snapshot nuevo: ve lo commiteado por quien tenía el lock
+            RETURN QUERY
+            WITH ins AS (
+                INSERT INTO {S}.security_nonces
+                    (integration_client_cod, create_user, user_at, active, client_id, nonce, request_ts, received_at)
+                SELECT DISTINCT ON (v.cid, v.n) v.ic, 0, 0, TRUE, v.cid, v.n, to_timestamp(v.ts), now()
+                FROM unnest(p_ic, p_client_id, p_nonce, p_request_ts) AS v(ic, cid, n, ts)
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {S}.security_nonces s
+                    WHERE s.client_id = v.cid
+                      AND s.nonce = v.n
+                      AND s.received_at >= now() - make_interval(secs => p_window_seconds)
+                )
+                ORDER BY v.cid, v.n
+                RETURNING client_id, nonce
+            )
+            SELECT ins.client_id, ins.nonce FROM ins;
+        END;
+        $fn$
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(f"DROP FUNCTION IF EXISTS {S}.register_nonces(integer[], text[], text[], bigint[], integer)")
+    op.execute(f"ALTER TABLE {S}.security_nonces RENAME TO security_nonces_partitioned")
+    op.execute(f"ALTER TABLE {S}.security_nonces_partitioned RENAME CONSTRAINT pk_security_nonces TO pk_security_nonces_partitioned")
+    op.execute(
+        f"ALTER TABLE {S}.security_nonces_partitioned RENAME CONSTRAINT "
+        "fk_security_nonces_integration_client_cod_integration_clients TO fk_security_nonces_partitioned_integration_client_cod"
+    )
+    op.execute(f"ALTER SEQUENCE {S}.security_nonces_cod_security_nonce_seq OWNED BY NONE")
+    op.execute(f"""
+        CREATE TABLE {S}.security_nonces (
+            cod_security_nonce integer NOT NULL DEFAULT nextval('{S}.security_nonces_cod_security_nonce_seq'),
+            integration_client_cod integer NOT NULL,
+            create_date timestamptz NOT NULL DEFAULT now(),
+            update_date timestamptz,
+            delete_date timestamptz,
+            create_user integer NOT NULL,
+            user_at integer NOT NULL,
+            active boolean NOT NULL DEFAULT true,
+            client_id varchar(64) NOT NULL,
+            nonce varchar(64) NOT NULL,
+            request_ts timestamptz NOT NULL,
+            received_at timestamptz NOT NULL DEFAULT now(),
+            CONSTRAINT pk_security_nonces PRIMARY KEY (cod_security_nonce),
+            CONSTRAINT uq_nonce_per_client UNIQUE (client_id, nonce),
+            CONSTRAINT fk_security_nonces_integration_client_cod_integration_clients
+                FOREIGN KEY (integration_client_cod)
+                REFERENCES {S}.integration_clients (cod_integration_client) ON DELETE CASCADE
+        )
+    """)
+    op.execute(f"""
+        INSERT INTO {S}.security_nonces ({_COLUMNS})
+        SELECT DISTINCT ON (client_id, nonce) {_COLUMNS} FROM {S}.security_nonces_partitioned
+        ORDER BY client_id, nonce, received_at
+    """)
+    op.execute(f"DROP TABLE {S}.security_nonces_partitioned CASCADE")
+    op.execute(f"ALTER SEQUENCE {S}.security_nonces_cod_security_nonce_seq OWNED BY {S}.security_nonces.cod_security_nonce")
+    op.create_index(op.f('ix_bootstrap_app_security_nonces_client_id'), 'security_nonces', ['client_id'], unique=False, schema=S)
@@ -0,0 +1,31 @@
+"""04 integration_clients rate limits
+
+Revision ID: 2b91c6e4f0a7
+Revises: 7d3f2a9c41b8
+Create Date: 2026-10-18 11:02:17.530914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2b91c6e4f0a7'
+down_revision: Union[str, Sequence[str], None] = '7d3f2a9c41b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL = usar los valores por defecto de settings (RATE_LIMIT_CLIENT_PER_MINUTE / RATE_LIMIT_CLIENT_BURST)
+    op.add_column('integration_clients', sa.Column('rate_limit_per_minute', sa.Integer(), nullable=True), schema='bootstrap_app')
+    op.add_column('integration_clients', sa.Column('rate_limit_burst', sa.Integer(), nullable=True), schema='bootstrap_app')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('integration_clients', 'rate_limit_burst', schema='bootstrap_app')
+    op.drop_column('integration_clients', 'rate_limit_per_minute', schema='bootstrap_app')
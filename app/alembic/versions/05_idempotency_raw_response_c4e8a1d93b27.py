@@ -0,0 +1,33 @@
+"""05 idempotency raw response
+
+Revision ID: c4e8a1d93b27
+Revises: 2b91c6e4f0a7
+Create Date: 2026-10-18 11:48:05.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a1d93b27'
+down_revision: Union[str, Sequence[str], None] = '2b91c6e4f0a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('idempotency_keys', sa.Column('response_body', postgresql.BYTEA(), nullable=True), schema='bootstrap_app')
+    op.add_column('idempotency_keys', sa.Column('response_media_type', sa.String(length=128), nullable=True), schema='bootstrap_app')
+    op.add_column('idempotency_keys', sa.Column('response_headers', postgresql.JSONB(astext_type=sa.Text()), nullable=True), schema='bootstrap_app')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('idempotency_keys', 'response_headers', schema='bootstrap_app')
+    op.drop_column('idempotency_keys', 'response_media_type', schema='bootstrap_app')
+    op.drop_column('idempotency_keys', 'response_body', schema='bootstrap_app')
@@ -0,0 +1,29 @@
+"""06 idempotency response codec
+
+Revision ID: 9a5d2e7c1f46
+Revises: c4e8a1d93b27
+Create Date: 2026-10-18 12:31:44.602117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a5d2e7c1f46'
+down_revision: Union[str, Sequence[str], None] = 'c4e8a1d93b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # codec de response_body (NULL = identity); ver app.core.compression
+    op.add_column('idempotency_keys', sa.Column('response_codec', sa.String(length=16), nullable=True), schema='bootstrap_app')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('idempotency_keys', 'response_codec', schema='bootstrap_app')
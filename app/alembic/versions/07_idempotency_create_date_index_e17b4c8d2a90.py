@@ -0,0 +1,43 @@
+"""07 idempotency create_date index
+
+Revision ID: e17b4c8d2a90
+Revises: 9a5d2e7c1f46
+Create Date: 2026-10-18 13:20:09.447215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e17b4c8d2a90'
+down_revision: Union[str, Sequence[str], None] = '9a5d2e7c1f46'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # orden del barrido de retención (create_date, cod); CONCURRENTLY para no bloquear escrituras
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_bootstrap_app_idempotency_keys_create_date'),
+            'idempotency_keys',
+            ['create_date', 'cod_idempotency_keys'],
+            unique=False,
+            schema='bootstrap_app',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f('ix_bootstrap_app_idempotency_keys_create_date'),
+            table_name='idempotency_keys',
+            schema='bootstrap_app',
+            postgresql_concurrently=True,
+        )
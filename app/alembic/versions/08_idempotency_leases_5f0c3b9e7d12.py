@@ -0,0 +1,49 @@
+"""08 idempotency leases
+
+Revision ID: 5f0c3b9e7d12
+Revises: e17b4c8d2a90
+Create Date: 2026-10-18 14:05:52.381907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f0c3b9e7d12'
+down_revision: Union[str, Sequence[str], None] = 'e17b4c8d2a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('idempotency_keys', sa.Column('lease_owner', sa.String(length=64), nullable=True), schema='bootstrap_app')
+    op.add_column('idempotency_keys', sa.Column('lease_expires_at', postgresql.TIMESTAMP(timezone=True), nullable=True), schema='bootstrap_app')
+    # el sweeper de claims abandonados solo mira las filas 'processing'; CONCURRENTLY como en 07
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_bootstrap_app_idempotency_keys_processing_lease',
+            'idempotency_keys',
+            ['lease_expires_at'],
+            unique=False,
+            schema='bootstrap_app',
+            postgresql_where=sa.text("status = 'processing'"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_bootstrap_app_idempotency_keys_processing_lease',
+            table_name='idempotency_keys',
+            schema='bootstrap_app',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('idempotency_keys', 'lease_expires_at', schema='bootstrap_app')
+    op.drop_column('idempotency_keys', 'lease_owner', schema='bootstrap_app')
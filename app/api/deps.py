@@ -1,19 +1,20 @@
 from __future__ import annotations
 
-from typing import Annotated, AsyncGenerator
+from typing import Annotated
 from uuid import UUID
 
 import jwt
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core import security
 from app.core.config import settings
-from app.core.database.db_async import AsyncSessionLocal
+from app.core.database.unit_of_work import get_session
+from app.core.security.rate_limit import enforce_rate_limit
 from app.core.database.mcs_scheme.models import User
 from app.core.database.mcs_scheme.pydantic import TokenPayload
 
@@ -22,15 +23,11 @@ reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.app.API_V1_STR}/login/access-token"
 )
 
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with AsyncSessionLocal() as session:
-        yield session
-
 SessionDep = Annotated[AsyncSession, Depends(get_session)]
 TokenDep   = Annotated[str, Depends(reusable_oauth2)]
 
 
-async def get_current_user(session: SessionDep, token: TokenDep) -> User:
+async def get_current_user(request: Request, session: SessionDep, token: TokenDep) -> User:
     try:
         payload = jwt.decode(
             token,
@@ -59,6 +56,13 @@ async def get_current_user(session: SessionDep, token: TokenDep) -> User:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
+    enforce_rate_limit(
+        request,
+        "user",
+        str(user.id),
+        settings.security.RATE_LIMIT_USER_PER_MINUTE,
+        settings.security.RATE_LIMIT_USER_BURST,
+    )
     return user
 
 
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.routes import items, login, private, users, utils, invoices
+from app.api.routes import items, login, private, users, utils, invoices, metrics
 from app.core.config import settings
 
 api_router = APIRouter()
@@ -10,6 +10,10 @@ api_router.include_router(users.router)
 api_router.include_router(utils.router)
 api_router.include_router(items.router)
 
+# /metrics: con token en cualquier entorno; sin token solo en local
+if settings.monitoring.METRICS_TOKEN or settings.app.ENVIRONMENT == "local":
+    api_router.include_router(metrics.router)
+
 
 if settings.app.ENVIRONMENT == "local":
     api_router.include_router(private.router)
\ No newline at end of file
@@ -1 +1,5 @@
-from .idempotent_route import IdempotentRoute
\ No newline at end of file
+from .body_buffer import BodyBufferMiddleware
+from .idempotent_route import IdempotentRoute
+from .auth_precheck import AuthPrecheckMiddleware
+from .response_headers import ResponseHeadersMiddleware
+from .hmac_auth import HmacAuthMiddleware
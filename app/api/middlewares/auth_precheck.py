@@ -0,0 +1,50 @@
+"""
+Rechazo temprano (antes de routing, parseo de headers de FastAPI y checkout del
+pool) de requests firmadas cuyo `X-Client-Id` / `X-Key-Id` ya sabemos que no
+existen (cache negativo), o de IPs que superaron `AUTH_FAILURE_MAX_PER_IP`.
+"""
+from __future__ import annotations
+
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core import errors
+from app.core.security.auth_failures import auth_failures
+from app.core.security.credential_cache import credential_cache
+from app.core.security.hmac_auth import client_ip
+
+
+class AuthPrecheckMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client_id = kid = None
+        for name, value in scope["headers"]:
+            if name == b"x-client-id":
+                client_id = value.decode("latin-1")
+            elif name == b"x-key-id":
+                kid = value.decode("latin-1")
+        if client_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope, receive)
+        ip = client_ip(request)
+        exc = None
+        if auth_failures.is_blocked(ip):
+            exc = StarletteHTTPException(status_code=429, detail="too many failed authentication attempts")
+        elif credential_cache.is_known_unknown(client_id, kid):
+            auth_failures.record(ip)
+            exc = StarletteHTTPException(status_code=401, detail="unknown client or key")
+        if exc is None:
+            await self.app(scope, receive, send)
+            return
+
+        response = await errors.starlette_http_exception_handler(request, exc)
+        await response(scope, receive, send)
@@ -0,0 +1,65 @@
+"""
+Etapa ASGI que lee el body UNA vez, lo hashea a medida que llegan los chunks y
+lo deja en `scope["state"]` para que HMAC e idempotencia no lo vuelvan a leer,
+copiar ni hashear:
+
+    request.state.raw_body     -> bytes
+    request.state.body_sha256  -> hex del SHA-256 del body
+
+Los consumidores lo leen con `app.core.security.request_body.buffered_body`.
+
+Solo actúa en métodos de escritura que traen `X-Signature` o `Idempotency-Key`.
+"""
+from __future__ import annotations
+
+import hashlib
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+_TRIGGER_HEADERS = {b"x-signature", b"idempotency-key"}
+
+
+class BodyBufferMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in _METHODS
+            or not any(name in _TRIGGER_HEADERS for name, _ in scope["headers"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        buf = bytearray()
+        digest = hashlib.sha256()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            if chunk:
+                buf += chunk
+                digest.update(chunk)
+            if not message.get("more_body", False):
+                break
+
+        body = bytes(buf)
+        state = scope.setdefault("state", {})
+        state["raw_body"] = body
+        state["body_sha256"] = digest.hexdigest()
+
+        replayed = False
+
+        async def _receive() -> Message:
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # después del body solo quedan eventos como http.disconnect
+            return await receive()
+
+        await self.app(scope, _receive, send)
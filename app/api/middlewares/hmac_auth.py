@@ -0,0 +1,46 @@
+"""
+Autenticación HMAC como middleware ASGI puro (`HMAC_AUTH_MODE=middleware`).
+
+Lee los headers del scope crudo, autentica contra el cache de credenciales y
+rechaza antes del routing. El principal verificado viaja en
+`scope["state"]["hmac_principal"]`; la dependencia `hmac_auth` lo reutiliza si
+la ruta la sigue declarando.
+
+Debe quedar por dentro de BodyBufferMiddleware (se agrega antes).
+"""
+from __future__ import annotations
+
+from typing import Sequence
+
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core import errors
+from app.core.security.hmac_auth import authenticate_request
+
+
+class HmacAuthMiddleware:
+    def __init__(self, app: ASGIApp, path_prefixes: Sequence[str]) -> None:
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "OPTIONS"
+            or not scope["path"].startswith(self.path_prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope, receive)
+        try:
+            principal = await authenticate_request(request)
+        except HTTPException as exc:
+            response = await errors.fastapi_http_exception_handler(request, exc)
+            await response(scope, receive, send)
+            return
+
+        request.state.hmac_principal = principal
+        await self.app(scope, receive, send)
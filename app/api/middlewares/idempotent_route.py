@@ -2,34 +2,38 @@ from __future__ import annotations
 
 import json
 import hashlib
-from typing import Optional
+import asyncio
+import logging
+import functools
+import tempfile
+from typing import Any, AsyncIterator, Dict, Optional, Set
 
 from fastapi.routing import APIRoute
 from fastapi import Request, Response, HTTPException
 from fastapi.responses import JSONResponse
 
+from app.core.config import settings
 from app.core.database.db_async import AsyncSessionLocal
-from app.core.security.idempotency import begin_idempotency, finalize_idempotency
+from app.core.database.unit_of_work import begin_unit_of_work
+from app.core.security.idempotency import (
+    begin_idempotency,
+    finalize_idempotency,
+    mark_handled,
+    publish_finalized,
+)
+from app.core.security.idempotency_cache import idempotency_cache
+from app.core.security.idempotency_finalizer import finalize_queue
+from app.core.security.idempotency_lease import LeaseHeartbeat
+from app.core.security.idempotency_waiters import completion_waiters, poll_seconds, wait_seconds
+from app.core.security.request_body import buffered_body
 
+logger = logging.getLogger(__name__)
 
 _METHODS = {"POST", "PUT", "PATCH", "DELETE"}
 
 
-def _buffer_request_body(request: Request) -> None:
-    """
-    Lee el body y lo reinyecta para que el endpoint pueda volver a leerlo.
-    """
-    async def _injector(body: bytes):
-        async def _receive():
-            return {"type": "http.request", "body": body, "more_body": False}
-        return _receive
-
-    # Nota: llamante debe hacer await request.body() y luego asignar _receive
-    # acá solo configuramos util por claridad.
-    return None
-
-
-def _fingerprint(method: str, path: str, query: str, body: bytes) -> str:
+def _fingerprint(method: str, path: str, query: str, body_sha256: str) -> str:
+    # usa el digest del body ya calculado por BodyBufferMiddleware (no re-hashea el body)
     h = hashlib.sha256()
     h.update(method.encode())
     h.update(b"|")
@@ -37,7 +41,7 @@ def _fingerprint(method: str, path: str, query: str, body: bytes) -> str:
     h.update(b"|")
     h.update((query or "").encode())
     h.update(b"|")
-    h.update(body or b"")
+    h.update(body_sha256.encode())
     return h.hexdigest()
 
 
@@ -47,8 +51,31 @@ class IdempotentRoute(APIRoute):
       - Requiere:  Idempotency-Key y X-Client-Id.
       - Aplica solo a métodos de escritura (POST/PUT/PATCH/DELETE).
       - Cachea respuestas JSON; las no-JSON se marcan como success pero sin cuerpo guardado.
+        Con IDEMPOTENCY_STORE_RAW guarda los bytes, media type y headers seleccionados
+        (IDEMPOTENCY_REPLAY_HEADERS) y los reenvía tal cual, sea cual sea el tipo.
+
+    Usa las helpers async: begin_idempotency / finalize_queue (finalize_idempotency).
+
+    Todo corre en la unidad de trabajo del request (misma sesión que hmac_auth y
+    el handler): claim + escrituras del handler + respuesta guardada salen en un
+    solo commit durable (el nonce se confirma aparte, al autenticar). Si el handler
+    falla antes de confirmar nada, el claim se descarta y el cliente puede
+    reintentar; el registro del fallo va a `finalize_queue` (lote en segundo plano,
+    con synchronous_commit=off): si se pierde, el claim se reclama y el reintento
+    vuelve a correr un handler que no dejó nada confirmado.
+
+    Con IDEMPOTENCY_WAIT_SECONDS > 0, un reintento sobre una clave en curso espera
+    la respuesta del original (hasta ese timeout) en vez de recibir 409.
 
-    Usa las helpers async: begin_idempotency / finalize_idempotency.
+    Un StreamingResponse se transmite al cliente a medida que llega y se copia a un
+    buffer acotado (o archivo temporal) para el registro. Con el commit del handler
+    queda su status (`mark_handled`); el cuerpo se guarda por la cola al terminar
+    el stream. Cuerpos mayores a IDEMPOTENCY_CAPTURE_MAX_BYTES, o streams
+    cortados, no se guardan: el replay responde 409 "response not stored" (con el
+    status original) en vez de un éxito vacío.
+
+    Mientras el handler o el stream siguen en curso, `LeaseHeartbeat` renueva el
+    lease del claim para que el sweeper no lo libere a mitad de camino.
     """
 
     def get_route_handler(self):
@@ -64,92 +91,287 @@ class IdempotentRoute(APIRoute):
             if not idem_key or not client_id:
                 return await original_handler(request)
 
-            # Buffer del body y reinyectar
-            body = await request.body()
-            async def _receive():
-                return {"type": "http.request", "body": body, "more_body": False}
-            request._receive = _receive
+            # Reintento de una respuesta ya completada: directo de memoria, sin DB
+            if getattr(settings.security, "ENABLE_IDEMPOTENCY", True):
+                hit = idempotency_cache.get(client_id, idem_key)
+                if hit is not None:
+                    return Response(
+                        content=hit.body,
+                        status_code=hit.status_code,
+                        headers=hit.headers,
+                        media_type=hit.media_type,
+                    )
+
+            # Body y su hash (compartidos con hmac_auth vía request.state)
+            _, body_hash = await buffered_body(request)
 
             # Huella del request (estable)
-            fp = _fingerprint(request.method.upper(), request.url.path, request.url.query or "", body)
-
-            # Intento de "begin" idempotente
-            record_id: Optional[int] = None
-            async with AsyncSessionLocal() as session:  # type: ignore
-                idem = await begin_idempotency(
-                    session,
-                    client_id=client_id,
-                    key=idem_key,
-                    request_fingerprint=fp,
-                )
-                if idem.get("cached"):
-                    data = idem.get("cached_body") or {}
-                    status_code = int(idem.get("cached_status") or 200)
-                    return JSONResponse(content=data, status_code=status_code)
-
-                if idem.get("in_progress"):
-                    raise HTTPException(status_code=409, detail="request in progress")
-
-                record_id = idem.get("record_id")
-
-            # Ejecuta el endpoint (incluye dependencias como HMAC)
+            fp = _fingerprint(request.method.upper(), request.url.path, request.url.query or "", body_hash)
+
+            uow = begin_unit_of_work(request)
             try:
-                response: Response = await original_handler(request)
-
-                # Capturar el body de la respuesta para guardarlo (si es JSON)
-                content_bytes = b""
-                # Para la mayoría de Responses (JSONResponse, Response):
-                if hasattr(response, "body") and isinstance(response.body, (bytes, bytearray)):
-                    content_bytes = bytes(response.body)
-                else:
-                    # StreamingResponse u otros: consumir iterator y reconstruir
-                    if hasattr(response, "body_iterator") and response.body_iterator is not None:
-                        async for chunk in response.body_iterator:
-                            content_bytes += chunk
-
-                # Reconstruir la respuesta (si consumimos el iterator)
-                new_resp = Response(
-                    content=content_bytes,
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
-                    media_type=response.media_type,
-                )
-
-                # Intentar serializar JSON para almacenar
-                payload = None
-                if new_resp.media_type and "json" in new_resp.media_type.lower():
-                    try:
-                        payload = json.loads((content_bytes or b"").decode() or "null")
-                    except Exception:
-                        payload = None
-
-                async with AsyncSessionLocal() as session:  # type: ignore
-                    await finalize_idempotency(
-                        session,
-                        record_id=record_id,
-                        http_status=new_resp.status_code,
-                        response_obj=payload,
-                    )
+                return await _run_idempotent(request, original_handler, uow, client_id, idem_key, fp)
+            finally:
+                await uow.close()
 
-                return new_resp
+        return custom_handler
 
-            except HTTPException as he:
-                async with AsyncSessionLocal() as session:  # type: ignore
-                    await finalize_idempotency(
-                        session,
-                        record_id=record_id,
-                        http_status=he.status_code,
-                        response_obj={"detail": he.detail},
-                    )
-                raise
-            except Exception:
-                async with AsyncSessionLocal() as session:  # type: ignore
-                    await finalize_idempotency(
-                        session,
-                        record_id=record_id,
-                        http_status=500,
-                        response_obj={"detail": "internal error"},
-                    )
-                raise
 
-        return custom_handler
+async def _wait_for_completion(uow, client_id: str, idem_key: str, fp: str, timeout: float):
+    """
+    Espera a que el request original haga finalize y devuelve el resultado de
+    un nuevo begin (cached, o created si el original se descartó). Si vence el
+    timeout devuelve el último resultado (in_progress => 409).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        with completion_waiters.subscribe(client_id, idem_key) as done:
+            # suelta el lock advisory y el de fila del DO UPDATE: si no, el original esperaría
+            await uow.rollback()
+            # suscripto ANTES de volver a mirar => no se pierde la señal
+            idem = await begin_idempotency(
+                uow.session,
+                client_id=client_id,
+                key=idem_key,
+                request_fingerprint=fp,
+                commit=False,
+            )
+            if not idem.get("in_progress"):
+                return idem
+            await uow.rollback()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return idem
+            try:
+                await asyncio.wait_for(done.wait(), min(remaining, poll_seconds()))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def _run_idempotent(request: Request, original_handler, uow, client_id: str, idem_key: str, fp: str) -> Response:
+    session = uow.session
+
+    # Intento de "begin" idempotente (sin commit: viaja con el handler)
+    idem = await begin_idempotency(
+        session,
+        client_id=client_id,
+        key=idem_key,
+        request_fingerprint=fp,
+        commit=False,
+    )
+    if idem.get("in_progress") and wait_seconds() > 0:
+        idem = await _wait_for_completion(uow, client_id, idem_key, fp, wait_seconds())
+
+    if idem.get("cached"):
+        if idem.get("cached_raw") is not None:
+            # respuesta original byte a byte, sin re-serializar
+            return Response(
+                content=idem["cached_raw"],
+                status_code=int(idem.get("cached_status") or 200),
+                headers=idem.get("cached_headers") or None,
+                media_type=idem.get("cached_media_type"),
+            )
+        data = idem.get("cached_body") or {}
+        status_code = int(idem.get("cached_status") or 200)
+        return JSONResponse(content=data, status_code=status_code)
+
+    if idem.get("in_progress"):
+        raise HTTPException(status_code=409, detail="request in progress")
+
+    record_id: Optional[int] = idem.get("record_id")
+    lease_owner: Optional[str] = idem.get("lease_owner")
+    uow.defer()
+    heartbeat = LeaseHeartbeat(record_id, lease_owner).start()
+    streaming = False
+
+    # Ejecuta el endpoint (incluye dependencias como HMAC)
+    try:
+        response: Response = await original_handler(request)
+
+        # claim + lo que el handler no haya confirmado + su resultado, con el lease
+        # al día, en un solo commit durable: una caída después no deja un claim
+        # reclamable cuyo handler ya corrió
+        await heartbeat.renew_if_due(session)
+        common = dict(record_id=record_id, client_id=client_id, idem_key=idem_key, lease_owner=lease_owner)
+
+        # Para la mayoría de Responses (JSONResponse, Response) el body ya está en memoria
+        body = getattr(response, "body", None)
+        if isinstance(body, (bytes, bytearray)):
+            captured: Optional[bytes] = bytes(body) if len(body) <= _capture_max_bytes() else None
+        elif getattr(response, "body_iterator", None) is not None:
+            # StreamingResponse u otros: el cuerpo llega después; queda constancia
+            # de que el handler corrió y el finalize del stream lo completa
+            await mark_handled(session, record_id=record_id, http_status=response.status_code, lease_owner=lease_owner)
+            await uow.commit()
+            finalize = functools.partial(_finalize_response, response=response, **common)
+            # el lease se sigue renovando hasta que termine el stream
+            response.body_iterator = _tee(response, finalize, heartbeat)
+            streaming = True
+            return response
+        else:
+            captured = b""
+
+        result = _finalize_kwargs(response, captured, **common)
+        written = await finalize_idempotency(session, commit=False, **result)
+        await uow.commit()
+        if written:
+            publish_finalized(result)
+        return response
+
+    except HTTPException as he:
+        # lo no confirmado se descarta; si el claim ya se confirmó, se registra el fallo
+        await uow.rollback()
+        # la clave vuelve a estar libre: los reintentos que esperan en este worker la reclaman
+        completion_waiters.signal(client_id, idem_key)
+        await finalize_queue.submit(
+            session,
+            record_id=record_id,
+            http_status=he.status_code,
+            response_obj={"detail": he.detail},
+            client_id=client_id,
+            key=idem_key,
+            lease_owner=lease_owner,
+        )
+        raise
+    except Exception:
+        await uow.rollback()
+        completion_waiters.signal(client_id, idem_key)
+        await finalize_queue.submit(
+            session,
+            record_id=record_id,
+            http_status=500,
+            response_obj={"detail": "internal error"},
+            client_id=client_id,
+            key=idem_key,
+            lease_owner=lease_owner,
+        )
+        raise
+    finally:
+        if not streaming:
+            heartbeat.stop()
+
+
+def _capture_max_bytes() -> int:
+    return int(getattr(settings.security, "IDEMPOTENCY_CAPTURE_MAX_BYTES", 8 * 1024 * 1024))
+
+
+class _BodyCapture:
+    """
+    Copia acotada de un body que se está transmitiendo: en memoria hasta
+    IDEMPOTENCY_CAPTURE_MEMORY_BYTES y luego en un archivo temporal. Si supera
+    IDEMPOTENCY_CAPTURE_MAX_BYTES deja de capturar (overflow) y libera lo juntado.
+    """
+
+    def __init__(self) -> None:
+        self._limit = _capture_max_bytes()
+        self._spool = tempfile.SpooledTemporaryFile(
+            max_size=int(getattr(settings.security, "IDEMPOTENCY_CAPTURE_MEMORY_BYTES", 256 * 1024))
+        )
+        self.size = 0
+        self.overflow = False
+
+    def write(self, chunk: bytes) -> None:
+        if self.overflow:
+            return
+        self.size += len(chunk)
+        if self.size > self._limit:
+            self.overflow = True
+            self._spool.close()
+            return
+        self._spool.write(chunk)
+
+    def getvalue(self) -> Optional[bytes]:
+        if self.overflow:
+            return None
+        self._spool.seek(0)
+        return self._spool.read()
+
+    def close(self) -> None:
+        self._spool.close()
+
+
+# finalizaciones de respuestas transmitidas (referencia fuerte hasta que terminen)
+_stream_finalizers: Set[asyncio.Task] = set()
+
+
+def _tee(response: Response, finalize, heartbeat: LeaseHeartbeat) -> AsyncIterator[bytes]:
+    iterator = response.body_iterator
+    charset = getattr(response, "charset", "utf-8")
+
+    async def _stream() -> AsyncIterator[bytes]:
+        capture = _BodyCapture()
+        complete = False
+        try:
+            async for chunk in iterator:
+                if not isinstance(chunk, (bytes, memoryview)):
+                    chunk = chunk.encode(charset)
+                capture.write(chunk)
+                yield chunk
+            complete = True
+        finally:
+            # un stream cortado ya envió status y parte del cuerpo: se registra como no guardado
+            body = capture.getvalue() if complete else None
+            capture.close()
+            heartbeat.stop()
+            task = asyncio.create_task(_finalize_detached(finalize, body))
+            _stream_finalizers.add(task)
+            task.add_done_callback(_stream_finalizers.discard)
+
+    return _stream()
+
+
+async def _finalize_detached(finalize, body: Optional[bytes]) -> None:
+    # la unidad de trabajo del request ya se cerró: sesión propia
+    try:
+        async with AsyncSessionLocal() as session:
+            await finalize(session, body=body)
+    except Exception:
+        logger.exception("No se pudo finalizar la clave idempotente de una respuesta transmitida")
+
+
+def _finalize_kwargs(
+    response: Response,
+    body: Optional[bytes],
+    *,
+    record_id: Optional[int],
+    client_id: str,
+    idem_key: str,
+    lease_owner: Optional[str],
+) -> Dict[str, Any]:
+    """
+    Argumentos de finalize_idempotency para `response`.
+    body=None: no se capturó (muy grande o stream cortado); el replay no la devuelve.
+    """
+    common: Dict[str, Any] = dict(
+        record_id=record_id,
+        http_status=response.status_code,
+        client_id=client_id,
+        key=idem_key,
+        lease_owner=lease_owner,
+    )
+    media_type = response.headers.get("content-type") or response.media_type
+    keep = {h.lower() for h in settings.security.IDEMPOTENCY_REPLAY_HEADERS}
+    headers = {k: v for k, v in response.headers.items() if k.lower() in keep}
+
+    if body is None:
+        return dict(common, response_obj=None, omitted=True, media_type=media_type, headers=headers)
+
+    if getattr(settings.security, "IDEMPOTENCY_STORE_RAW", False):
+        # bytes exactos + media type + headers seleccionados (Location, ETag...)
+        return dict(common, response_obj=None, response_body=body, media_type=media_type, headers=headers)
+
+    # Intentar serializar JSON para almacenar
+    payload = None
+    if response.media_type and "json" in response.media_type.lower():
+        try:
+            payload = json.loads(body.decode() or "null")
+        except Exception:
+            payload = None
+    return dict(common, response_obj=payload)
+
+
+async def _finalize_response(session, *, response: Response, body: Optional[bytes], **common: Any) -> None:
+    # cuerpo de un stream: el handler ya quedó registrado (mark_handled), así que
+    # perder esta escritura solo cambia el replay a "response not stored"
+    await finalize_queue.submit(session, **_finalize_kwargs(response, body, **common))
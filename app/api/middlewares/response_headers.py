@@ -0,0 +1,42 @@
+"""
+Agrega a la respuesta los headers que las etapas internas dejan en `scope["state"]`:
+
+    state["server_timing"]    -> [(nombre, segundos), ...]  => `Server-Timing`
+    state["response_headers"] -> {nombre: valor}            => tal cual (p.ej. RateLimit-*)
+
+Se aplican también a las respuestas de error (429 incluido).
+"""
+from __future__ import annotations
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class ResponseHeadersMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+
+        async def _send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                extra = state.get("response_headers")
+                if extra:
+                    headers = MutableHeaders(scope=message)
+                    for name, value in extra.items():
+                        headers[name] = value
+                timings = state.get("server_timing")
+                if timings:
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "Server-Timing",
+                        ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings),
+                    )
+            await send(message)
+
+        await self.app(scope, receive, _send)
@@ -0,0 +1,32 @@
+import hmac
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import settings
+from app.core.metrics import registry
+
+
+def require_metrics_token(authorization: str | None = Header(default=None)) -> None:
+    """Con MONITORING__METRICS_TOKEN, exige `Authorization: Bearer <token>`."""
+    token = getattr(settings.monitoring, "METRICS_TOKEN", None)
+    if token is None:
+        return
+    scheme, _, value = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(value.encode(), token.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+router = APIRouter(tags=["metrics"], include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    """
+    Métricas del worker que atiende el request (formato texto de Prometheus).
+    """
+    return registry.render()
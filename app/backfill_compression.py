@@ -0,0 +1,129 @@
+"""
+Recomprime filas existentes con el codec actual (`PAYLOAD_COMPRESSION`).
+
+Las respuestas de idempotencia se recomprimen en `response_body` + `response_codec`;
+`response_json` solo se lee (sobres de filas viejas) y expira con IDEMPOTENCY_TTL_DAYS.
+
+    python -m app.backfill_compression [--table monitor|idempotency|all] [--batch-size N] [--dry-run]
+
+Recorre por keyset (id ascendente) en lotes cortos, una transacción por lote,
+y solo reescribe las filas cuyo valor almacenado cambia. Se puede cortar y
+volver a correr: lo ya comprimido con el codec actual queda igual.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import JSON, bindparam, select, type_coerce, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.compression import IDENTITY, OMITTED, compress, decompress, pack_json, unpack_json
+from app.core.database.bootstrap_app_scheme.models import IdempotencyKeys
+from app.core.database.db_async import AsyncSessionLocal, engine
+from app.core.database.mcs_scheme.models.monitor import Monitor
+
+log = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def _repack(value: Any) -> Any:
+    return pack_json(unpack_json(value))
+
+
+async def _backfill_json(
+    session: AsyncSession,
+    table,
+    pk,
+    columns: Sequence[str],
+    batch_size: int,
+    dry_run: bool,
+) -> int:
+    # type_coerce(JSON): se lee y escribe el valor almacenado, sin pasar por CompressedJSON
+    raw_cols = [type_coerce(table.c[name], JSON).label(name) for name in columns]
+    stmt_upd = (
+        update(table)
+        .where(pk == bindparam("_pk"))
+        .values({name: bindparam(f"_{name}", type_=JSON) for name in columns})
+    )
+    last, changed = 0, 0
+    while True:
+        rows = (await session.execute(
+            select(pk, *raw_cols).where(pk > last).order_by(pk).limit(batch_size)
+        )).all()
+        if not rows:
+            break
+        last = rows[-1][0]
+        params: List[Dict[str, Any]] = []
+        for row in rows:
+            new = {name: _repack(row._mapping[name]) for name in columns}
+            if any(new[name] != row._mapping[name] for name in columns):
+                params.append({"_pk": row[0], **{f"_{k}": v for k, v in new.items()}})
+        if params and not dry_run:
+            await session.execute(stmt_upd, params)
+        await session.commit()
+        changed += len(params)
+        log.info("%s: hasta id=%s, %s filas reescritas", table.name, last, changed)
+    return changed
+
+
+async def _backfill_idempotency_bodies(session: AsyncSession, batch_size: int, dry_run: bool) -> int:
+    t = IdempotencyKeys.__table__
+    pk = t.c.cod_idempotency_keys
+    stmt_upd = (
+        update(t)
+        .where(pk == bindparam("_pk"))
+        .values(response_body=bindparam("_body"), response_codec=bindparam("_codec"))
+    )
+    last, changed = 0, 0
+    while True:
+        rows = (await session.execute(
+            select(pk, t.c.response_body, t.c.response_codec)
+            .where(pk > last, t.c.response_body.is_not(None))
+            .order_by(pk)
+            .limit(batch_size)
+        )).all()
+        if not rows:
+            break
+        last = rows[-1][0]
+        params: List[Dict[str, Any]] = []
+        for cod, body, codec in rows:
+            if codec == OMITTED:
+                continue
+            new_codec, new_body = compress(decompress(codec, bytes(body)))
+            new_codec = None if new_codec == IDENTITY else new_codec
+            if new_codec != codec:
+                params.append({"_pk": cod, "_body": new_body, "_codec": new_codec})
+        if params and not dry_run:
+            await session.execute(stmt_upd, params)
+        await session.commit()
+        changed += len(params)
+        log.info("idempotency_keys.response_body: hasta id=%s, %s filas reescritas", last, changed)
+    return changed
+
+
+async def _run(table: str, batch_size: int, dry_run: bool) -> None:
+    async with AsyncSessionLocal() as session:
+        if table in ("monitor", "all"):
+            m = Monitor.__table__
+            await _backfill_json(
+                session, m, m.c.id, ("payload_client", "payload_sap", "error_details"), batch_size, dry_run
+            )
+        if table in ("idempotency", "all"):
+            await _backfill_idempotency_bodies(session, batch_size, dry_run)
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recomprime payloads grandes con el codec configurado.")
+    parser.add_argument("--table", choices=("monitor", "idempotency", "all"), default="all")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(_run(args.table, args.batch_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
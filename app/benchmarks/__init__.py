@@ -0,0 +1 @@
+"""Benchmarks reproducibles de capas internas (`python -m app.benchmarks.<capa>`)."""
@@ -0,0 +1,657 @@
+"""
+Microbenchmark y prueba de contención de la capa idempotente.
+
+    python -m app.benchmarks.idempotency --backend memory
+    python -m app.benchmarks.idempotency --backend postgres --requests 2000 --json out.json
+    python -m app.benchmarks.idempotency --baseline out.json
+
+Escenarios (cada uno con `--requests` operaciones y `--concurrency` en vuelo):
+- claim:        begin (clave nueva) + finalize, directo contra el repositorio;
+- replay:       begin sobre claves ya finalizadas (respuesta desde la DB);
+- in_progress:  begin sobre claves tomadas por otro dueño y sin finalizar;
+- route_miss:   POST por IdempotentRoute con clave nueva;
+- route_mix:    POST por IdempotentRoute con mezcla hit/miss/in_progress (`--mix`);
+- contention:   `--retries` POST simultáneos con la MISMA clave.
+
+Reporta p50/p95/p99/max en ms, idas y vueltas a la DB por operación
+(execute + BEGIN/COMMIT/ROLLBACK) y la distribución de status HTTP. Con `--seed`
+fijo la secuencia de claves y la mezcla se repiten; `--json` guarda el resultado
+y `--baseline` lo compara contra una corrida anterior.
+
+Backends:
+- memory: sesión falsa en memoria que interpreta las sentencias de la capa
+  (claim/finalize/lote, register_nonces, sweeper de leases) con `--rtt-ms` de
+  latencia simulada por ida y vuelta. Un rollback (o cerrar la sesión sin
+  commit) deshace lo escrito en la transacción. Modela el lock advisory del claim
+  (un duplicado concurrente recibe in_progress sin esperar); los demás locks de
+  Postgres no, y otras sesiones ven escrituras aún sin confirmar.
+- postgres: la DB configurada en settings (local y descartable, con migraciones
+  aplicadas). Usa client_id `bench-<run>` y borra sus filas al terminar. El ping
+  del pool (`pool_pre_ping`) no se cuenta como ida y vuelta.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import math
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import httpx
+from fastapi import APIRouter, FastAPI
+from sqlalchemy import event, text
+
+from app.api.middlewares import BodyBufferMiddleware, IdempotentRoute
+from app.core.config import settings
+from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
+from app.core.security.idempotency import begin_idempotency, finalize_idempotency
+from app.core.security.idempotency_cache import idempotency_cache
+from app.core.security.idempotency_finalizer import finalize_queue
+
+log = logging.getLogger("app.benchmarks.idempotency")
+
+SCENARIOS = ("claim", "replay", "in_progress", "route_miss", "route_mix", "contention")
+
+_BODY = b'{"amount": 100, "currency": "GTQ"}'
+
+
+class RoundTrips:
+    """Contador global de idas y vueltas (los escenarios corren de a uno)."""
+
+    n = 0
+
+    @classmethod
+    def hit(cls, *_: Any, **__: Any) -> None:
+        cls.n += 1
+
+
+# ---------------------------------------------------------------------------
+# Backend en memoria
+# ---------------------------------------------------------------------------
+
+
+class _Result:
+    def __init__(self, rows: Sequence[Tuple] = (), rowcount: int = 0) -> None:
+        self._rows = list(rows)
+        self.rowcount = rowcount
+
+    def one(self) -> Tuple:
+        return self._rows[0]
+
+    def first(self) -> Optional[Tuple]:
+        return self._rows[0] if self._rows else None
+
+    def all(self) -> List[Tuple]:
+        return self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+def _loads(value: Optional[str]) -> Any:
+    return json.loads(value) if isinstance(value, str) else value
+
+
+Undo = List[Callable[[], None]]
+
+
+def _restore(row: Dict[str, Any]) -> Callable[[], None]:
+    snapshot = dict(row)
+
+    def _undo() -> None:
+        row.clear()
+        row.update(snapshot)
+    return _undo
+
+
+class MemoryStore:
+    def __init__(self) -> None:
+        self.rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.by_id: Dict[int, Dict[str, Any]] = {}
+        self.nonces: Set[Tuple[str, str]] = set()
+        # lock advisory del claim: clave -> sesión que lo tiene hasta fin de transacción
+        self.locks: Dict[Tuple[str, str], Any] = {}
+        self._seq = 0
+
+    def row(self, client_id: str, key: str) -> Optional[Dict[str, Any]]:
+        return self.rows.get((client_id, key))
+
+    def _reclaimable(self, row: Dict[str, Any]) -> bool:
+        if row["status"] == "processing":
+            return row["http_status"] is None and row["lease_expires_at"] < time.monotonic()
+        return row["status"] == "fail" and row["http_status"] is None
+
+    def claim(self, p: Dict[str, Any], session: "MemorySession") -> Optional[Tuple]:
+        ident = (p["cid"], p["k"])
+        if not session.try_lock(ident):
+            return None
+        undo = session.undo
+        lease_until = time.monotonic() + float(p["lease"])
+        row = self.rows.get(ident)
+        created = owned = False
+        if row is None:
+            self._seq += 1
+            row = {
+                "id": self._seq, "status": "processing", "http_status": None, "json": None,
+                "body": None, "codec": None, "mt": None, "hdr": None,
+            }
+            self.rows[ident] = self.by_id[self._seq] = row
+            undo.append(functools.partial(self._drop, ident, self._seq))
+            created = True
+        if created or self._reclaimable(row):
+            if not created:
+                undo.append(_restore(row))
+            row.update(status="processing", owner=p["owner"], lease_expires_at=lease_until, fp=p["fp"])
+            owned = True
+        return (
+            row["id"], row["status"], row["http_status"], row["json"], row["body"],
+            row["codec"], row["mt"], row["hdr"], created, owned,
+        )
+
+    def peek(self, p: Dict[str, Any]) -> Optional[Tuple]:
+        row = self.rows.get((p["cid"], p["k"]))
+        if row is None:
+            return None
+        return (
+            row["id"], row["status"], row["http_status"], row["json"], row["body"],
+            row["codec"], row["mt"], row["hdr"], False, False,
+        )
+
+    def _drop(self, ident: Tuple[str, str], record_id: int) -> None:
+        self.rows.pop(ident, None)
+        self.by_id.pop(record_id, None)
+
+    def finalize(self, p: Dict[str, Any], undo: Undo) -> bool:
+        row = self.by_id.get(int(p["id"]))
+        owner = p["owner"]
+        if row is None or (owner is not None and row.get("owner") != owner):
+            return False
+        st = int(p["st"])
+        undo.append(_restore(row))
+        row.update(
+            json=_loads(p["data"]),
+            body=p["body"],
+            codec=p["codec"],
+            mt=p["mt"],
+            hdr=_loads(p["hdr"]),
+            http_status=st,
+            status="success" if 200 <= st <= 299 else "fail",
+            lease_expires_at=None,
+        )
+        return True
+
+    def mark_handled(self, p: Dict[str, Any], undo: Undo) -> bool:
+        row = self.by_id.get(int(p["id"]))
+        if row is None or (p["owner"] is not None and row.get("owner") != p["owner"]):
+            return False
+        undo.append(_restore(row))
+        row.update(http_status=int(p["st"]), codec=p["codec"])
+        return True
+
+    def expire_leases(self, undo: Undo) -> List[Tuple[str, str]]:
+        """Lo que hace AbandonedClaimSweeper con los leases vencidos."""
+        now = time.monotonic()
+        expired = []
+        for ident, row in self.rows.items():
+            if row["status"] != "processing" or row["lease_expires_at"] >= now:
+                continue
+            undo.append(_restore(row))
+            st = row["http_status"]
+            row.update(
+                status="success" if st is not None and 200 <= st <= 299 else "fail",
+                owner=None,
+                lease_expires_at=None,
+            )
+            expired.append(ident)
+        return expired
+
+    def register_nonces(self, p: Dict[str, Any], undo: Undo) -> List[Tuple[str, str]]:
+        accepted = []
+        for ident in zip(p["cid"], p["nonce"]):
+            if ident not in self.nonces:
+                self.nonces.add(ident)
+                undo.append(functools.partial(self.nonces.discard, ident))
+                accepted.append(ident)
+        return accepted
+
+
+class MemorySession:
+    """
+    Lo justo de AsyncSession para la capa idempotente: reconoce claim, finalize
+    (simple y en lote) y register_nonces, y trata el resto (SET LOCAL, pg_notify)
+    como no-op. Cada execute/commit/rollback cuenta como una ida y vuelta de `rtt`
+    segundos; rollback y close sin commit deshacen las escrituras de la transacción.
+    """
+
+    def __init__(self, store: MemoryStore, rtt: float) -> None:
+        self._store = store
+        self._rtt = rtt
+        self._tx = False
+        self.undo: Undo = []
+        self._locks: List[Tuple[str, str]] = []
+
+    def try_lock(self, ident: Tuple[str, str]) -> bool:
+        holder = self._store.locks.get(ident)
+        if holder is not None and holder is not self:
+            return False
+        if holder is None:
+            self._store.locks[ident] = self
+            self._locks.append(ident)
+        return True
+
+    def _end(self) -> None:
+        for ident in self._locks:
+            if self._store.locks.get(ident) is self:
+                del self._store.locks[ident]
+        self._locks.clear()
+        self.undo.clear()
+        self._tx = False
+
+    def _discard(self) -> None:
+        while self.undo:
+            self.undo.pop()()
+        self._end()
+
+    async def __aenter__(self) -> "MemorySession":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    async def _round_trip(self) -> None:
+        RoundTrips.hit()
+        if self._rtt:
+            await asyncio.sleep(self._rtt)
+
+    def in_transaction(self) -> bool:
+        return self._tx
+
+    async def execute(self, stmt: Any, params: Optional[Dict[str, Any]] = None) -> _Result:
+        await self._round_trip()
+        self._tx = True
+        sql = getattr(stmt, "text", str(stmt))
+        params = params or {}
+        if "register_nonces(" in sql:
+            accepted = self._store.register_nonces(params, self.undo)
+            return _Result(accepted, len(accepted))
+        if "idempotency_keys" in sql and "INSERT INTO" in sql:
+            row = self._store.claim(params, self)
+            return _Result([row], 1) if row is not None else _Result()
+        if "pg_try_advisory_xact_lock" in sql:
+            return _Result([(True,)], 1)
+        if "idempotency_keys" not in sql:
+            return _Result()
+        if "WITH stale AS" in sql:
+            expired = self._store.expire_leases(self.undo)
+            return _Result(expired, len(expired))
+        if sql.lstrip().startswith("SELECT"):
+            row = self._store.peek(params)
+            return _Result([row], 1) if row is not None else _Result()
+        if "FROM unnest(" in sql:
+            ids = []
+            for i in range(len(params["id"])):
+                row = {name: values[i] for name, values in params.items()}
+                if self._store.finalize(row, self.undo):
+                    ids.append((int(row["id"]),))
+            return _Result(ids, len(ids))
+        if sql.lstrip().startswith("UPDATE"):
+            write = self._store.finalize if "data" in params else self._store.mark_handled
+            return _Result(rowcount=1 if write(params, self.undo) else 0)
+        return _Result()
+
+    async def scalar(self, stmt: Any, params: Optional[Dict[str, Any]] = None) -> Any:
+        row = (await self.execute(stmt, params)).first()
+        return row[0] if row else None
+
+    async def commit(self) -> None:
+        if self._tx:
+            await self._round_trip()
+        self._end()
+
+    async def rollback(self) -> None:
+        if self._tx:
+            await self._round_trip()
+        self._discard()
+
+    async def close(self) -> None:
+        self._discard()
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+SessionFactory = Callable[[], Any]
+
+
+def use_memory(store: MemoryStore, rtt_ms: float = 0.0, patch: Callable[[Any, str, Any], None] = setattr) -> SessionFactory:
+    """
+    Apunta a `store` todo lo que abre sesiones propias. `patch` permite usar
+    `monkeypatch.setattr` en los tests.
+    """
+    from app.api.middlewares import idempotent_route
+    from app.core.database import unit_of_work
+    from app.core.database.bootstrap_app_scheme import retention
+    from app.core.security import idempotency_finalizer, idempotency_lease
+
+    factory = lambda: MemorySession(store, rtt_ms / 1000.0)  # noqa: E731
+    for module in (unit_of_work, idempotent_route, idempotency_finalizer, idempotency_lease, retention):
+        patch(module, "AsyncSessionLocal", factory)
+    return factory
+
+
+def _use_postgres() -> SessionFactory:
+    from app.core.database.db_async import AsyncSessionLocal, engine
+
+    for name in ("before_cursor_execute", "begin", "commit", "rollback"):
+        event.listen(engine.sync_engine, name, RoundTrips.hit)
+    return AsyncSessionLocal
+
+
+async def _cleanup_postgres(factory: SessionFactory, client_prefix: str) -> None:
+    from app.core.database.db_async import engine
+
+    async with factory() as session:
+        await session.execute(
+            text(f"DELETE FROM {BOOTSTRAP_SCHEMA}.idempotency_keys WHERE client_id LIKE :p"),
+            {"p": f"{client_prefix}%"},
+        )
+        await session.commit()
+    await engine.dispose()
+
+
+# ---------------------------------------------------------------------------
+# Medición
+# ---------------------------------------------------------------------------
+
+
+def percentile(samples: Sequence[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))]
+
+
+async def _measure(
+    name: str,
+    ops: Sequence[Callable[[], Awaitable[Optional[int]]]],
+    concurrency: int,
+) -> Dict[str, Any]:
+    """Corre `ops` con a lo sumo `concurrency` en vuelo; cada op puede devolver un status."""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(op: Callable[[], Awaitable[Optional[int]]]) -> None:
+        async with sem:
+            t0 = time.perf_counter()
+            status = await op()
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            if status is not None:
+                statuses[str(status)] += 1
+
+    await _drain_finalizers()
+    rt0, t0 = RoundTrips.n, time.perf_counter()
+    await asyncio.gather(*(_one(op) for op in ops))
+    await _drain_finalizers()
+    elapsed = time.perf_counter() - t0
+    n = len(ops)
+    return {
+        "scenario": name,
+        "requests": n,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else 0.0,
+        "round_trips_per_op": (RoundTrips.n - rt0) / n if n else 0.0,
+        "ops_per_s": n / elapsed if elapsed > 0 else 0.0,
+        "statuses": dict(statuses),
+    }
+
+
+async def _drain_finalizers() -> None:
+    # el finalize en cola también es parte del costo en DB del escenario
+    if finalize_queue.running:
+        await finalize_queue.flush()
+
+
+# ---------------------------------------------------------------------------
+# Escenarios
+# ---------------------------------------------------------------------------
+
+
+class Bench:
+    def __init__(self, factory: SessionFactory, args: argparse.Namespace) -> None:
+        self.factory = factory
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.client_id = f"bench-{args.run_id}"
+        self._seq = 0
+        self.app = self._build_app()
+        self.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://bench")
+
+    def new_key(self, prefix: str) -> str:
+        self._seq += 1
+        return f"{prefix}-{self._seq}"
+
+    def _build_app(self) -> FastAPI:
+        handler_delay = self.args.handler_ms / 1000.0
+        router = APIRouter(route_class=IdempotentRoute)
+
+        @router.post("/bench", status_code=201)
+        async def bench_endpoint(payload: dict) -> Dict[str, Any]:
+            if handler_delay:
+                await asyncio.sleep(handler_delay)
+            return {"ok": True, "echo": payload}
+
+        app = FastAPI()
+        app.add_middleware(BodyBufferMiddleware)
+        app.include_router(router)
+        return app
+
+    # -- repositorio directo -------------------------------------------------
+
+    async def _claim(self, key: str, finalize: bool, owner: Optional[str] = None) -> Dict[str, Any]:
+        async with self.factory() as session:
+            idem = await begin_idempotency(
+                session, client_id=self.client_id, key=key, request_fingerprint="fp", lease_owner=owner
+            )
+            if finalize and not idem.get("cached") and not idem.get("in_progress"):
+                await finalize_idempotency(
+                    session,
+                    record_id=idem.get("record_id"),
+                    http_status=201,
+                    response_obj={"ok": True},
+                    relaxed=True,
+                    client_id=self.client_id,
+                    key=key,
+                    lease_owner=idem.get("lease_owner"),
+                )
+            return idem
+
+    async def _prepare(self, prefix: str, n: int, finalize: bool) -> List[str]:
+        keys = [self.new_key(prefix) for _ in range(n)]
+        for key in keys:
+            await self._claim(key, finalize=finalize, owner=None if finalize else "bench-foreign-owner")
+        return keys
+
+    async def scenario_claim(self) -> Dict[str, Any]:
+        keys = [self.new_key("claim") for _ in range(self.args.requests)]
+
+        def op(key: str):
+            async def _run() -> None:
+                await self._claim(key, finalize=True)
+            return _run
+
+        return await _measure("claim", [op(k) for k in keys], self.args.concurrency)
+
+    async def scenario_replay(self) -> Dict[str, Any]:
+        keys = await self._prepare("replay", self.args.requests, finalize=True)
+
+        def op(key: str):
+            async def _run() -> None:
+                idem = await self._claim(key, finalize=False)
+                assert idem.get("cached"), idem
+            return _run
+
+        return await _measure("replay", [op(k) for k in keys], self.args.concurrency)
+
+    async def scenario_in_progress(self) -> Dict[str, Any]:
+        keys = await self._prepare("busy", self.args.requests, finalize=False)
+
+        def op(key: str):
+            async def _run() -> None:
+                idem = await self._claim(key, finalize=False)
+                assert idem.get("in_progress"), idem
+            return _run
+
+        return await _measure("in_progress", [op(k) for k in keys], self.args.concurrency)
+
+    # -- IdempotentRoute -----------------------------------------------------
+
+    def _post(self, key: str):
+        headers = {"Idempotency-Key": key, "X-Client-Id": self.client_id, "content-type": "application/json"}
+
+        async def _run() -> int:
+            resp = await self.http.post("/bench", content=_BODY, headers=headers)
+            return resp.status_code
+        return _run
+
+    async def scenario_route_miss(self) -> Dict[str, Any]:
+        ops = [self._post(self.new_key("miss")) for _ in range(self.args.requests)]
+        return await _measure("route_miss", ops, self.args.concurrency)
+
+    async def scenario_route_mix(self) -> Dict[str, Any]:
+        weights = self.args.mix
+        kinds = self.rng.choices(list(weights), weights=list(weights.values()), k=self.args.requests)
+        pool = max(1, self.args.requests // 10)
+        # las hits se reparten sobre un pool chico: primero DB, después cache en memoria
+        hit_keys = await self._prepare("hit", pool, finalize=True) if "hit" in kinds else []
+        busy_keys = await self._prepare("busy", pool, finalize=False) if "in_progress" in kinds else []
+        ops = []
+        for kind in kinds:
+            if kind == "hit":
+                ops.append(self._post(self.rng.choice(hit_keys)))
+            elif kind == "in_progress":
+                ops.append(self._post(self.rng.choice(busy_keys)))
+            else:
+                ops.append(self._post(self.new_key("miss")))
+        return await _measure("route_mix", ops, self.args.concurrency)
+
+    async def scenario_contention(self) -> Dict[str, Any]:
+        key = self.new_key("contended")
+        ops = [self._post(key) for _ in range(self.args.retries)]
+        # todos a la vez: la concurrencia es la cantidad de reintentos
+        return await _measure("contention", ops, self.args.retries)
+
+    async def run(self, scenarios: Sequence[str]) -> List[Dict[str, Any]]:
+        results = []
+        for name in scenarios:
+            if self.args.warmup:
+                # warmup con el mismo escenario en chico (claves propias, no se reportan)
+                requests, self.args.requests = self.args.requests, self.args.warmup
+                await getattr(self, f"scenario_{name}")()
+                self.args.requests = requests
+            result = await getattr(self, f"scenario_{name}")()
+            log.info("%s listo", name)
+            results.append(result)
+        await self.http.aclose()
+        return results
+
+
+# ---------------------------------------------------------------------------
+# Reporte
+# ---------------------------------------------------------------------------
+
+_COLUMNS = ("p50_ms", "p95_ms", "p99_ms", "max_ms", "round_trips_per_op", "ops_per_s")
+
+
+def render(results: Sequence[Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    header = f"{'scenario':<12} {'n':>6} " + " ".join(f"{c:>18}" for c in _COLUMNS) + "  statuses"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        cells = []
+        base = (baseline or {}).get(r["scenario"])
+        for c in _COLUMNS:
+            cell = f"{r[c]:.3f}"
+            if base and base.get(c):
+                cell += f" ({(r[c] - base[c]) / base[c] * 100:+.0f}%)"
+            cells.append(f"{cell:>18}")
+        statuses = ",".join(f"{k}:{v}" for k, v in sorted(r["statuses"].items()))
+        lines.append(f"{r['scenario']:<12} {r['requests']:>6} " + " ".join(cells) + f"  {statuses}")
+    return "\n".join(lines)
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("hit", "miss", "in_progress"):
+            raise argparse.ArgumentTypeError(f"tipo de request desconocido en --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def _run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    # la capa completa, sin depender del .env del entorno
+    settings.security.ENABLE_IDEMPOTENCY = True
+    settings.security.IDEMPOTENCY_WAIT_SECONDS = args.wait_seconds
+    if args.no_cache:
+        settings.security.IDEMPOTENCY_CACHE_MAX_BYTES = 0
+    idempotency_cache.clear()
+
+    factory = use_memory(MemoryStore(), args.rtt_ms) if args.backend == "memory" else _use_postgres()
+    if args.finalize_queue:
+        await finalize_queue.start()
+    bench = Bench(factory, args)
+    try:
+        return await bench.run(args.scenario or SCENARIOS)
+    finally:
+        await finalize_queue.stop()
+        if args.backend == "postgres":
+            await _cleanup_postgres(factory, bench.client_id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de la capa idempotente (latencias e idas y vueltas a la DB).")
+    parser.add_argument("--backend", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="repetible; por defecto todos")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--retries", type=int, default=50, help="reintentos simultáneos en 'contention'")
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("hit=0.6,miss=0.3,in_progress=0.1"))
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rtt-ms", type=float, default=0.5, help="latencia simulada por ida y vuelta (memory)")
+    parser.add_argument("--handler-ms", type=float, default=0.0, help="duración simulada del endpoint")
+    parser.add_argument("--wait-seconds", type=float, default=0.0, help="IDEMPOTENCY_WAIT_SECONDS para la corrida")
+    parser.add_argument("--no-cache", action="store_true", help="sin cache de respuestas en memoria")
+    parser.add_argument("--finalize-queue", action="store_true", help="finalize por la cola en lote, como en el servidor")
+    parser.add_argument("--json", dest="json_out", help="guarda los resultados en este archivo")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+    args.run_id = uuid.uuid4().hex[:8]
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(_run(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = {r["scenario"]: r for r in json.load(fh)["results"]}
+    print(render(results, baseline))
+    if args.json_out:
+        with open(args.json_out, "w") as fh:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "run_id"}, "results": results}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
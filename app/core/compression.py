@@ -0,0 +1,123 @@
+"""
+Compresión de payloads grandes guardados en la DB (opt-in).
+
+- Codecs: `gzip` (stdlib) y `zstd` (extra opcional `zstandard`). `identity` = sin
+  comprimir. El codec se elige con `PAYLOAD_COMPRESSION`; por defecto `none`:
+  un valor comprimido deja de verse con los operadores JSON de Postgres.
+- Solo se comprime por encima de `PAYLOAD_COMPRESSION_MIN_BYTES` y si el
+  resultado es más chico.
+- Columnas bytea: el codec va en una columna aparte (p.ej. `response_codec`); es
+  lo preferido (sin base64). `omitted` marca un cuerpo que no se guardó (superó el
+  límite de captura o el stream se cortó): el replay responde "response not
+  stored", no un éxito vacío.
+- Columnas JSON sin columna de codec (`CompressedJSON`): el valor comprimido va en
+  un sobre `{"__compressed__": "<codec>", "data": "<base64>"}`. Todo objeto con la
+  clave `__compressed__` es un sobre: si el valor del usuario ya la trae se guarda
+  escapado (`{"__compressed__": "identity", "data": <valor>}`), así que leer no
+  depende de adivinar la forma. Cualquier otro valor se lee tal cual.
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+from typing import Any, Optional, Tuple
+
+from app.core.config import settings
+
+IDENTITY = "identity"
+GZIP = "gzip"
+ZSTD = "zstd"
+OMITTED = "omitted"
+
+_MARKER = "__compressed__"
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:  # dependencia opcional
+        raise RuntimeError("PAYLOAD_COMPRESSION=zstd requiere el paquete 'zstandard' (extra [zstd])") from e
+    return zstandard
+
+
+def configured_codec() -> str:
+    codec = str(getattr(settings.db, "PAYLOAD_COMPRESSION", "none")).lower()
+    return IDENTITY if codec in ("none", "", IDENTITY) else codec
+
+
+def _min_bytes() -> int:
+    return int(getattr(settings.db, "PAYLOAD_COMPRESSION_MIN_BYTES", 2048))
+
+
+def _level(codec: str) -> int:
+    level = getattr(settings.db, "PAYLOAD_COMPRESSION_LEVEL", None)
+    if level is not None:
+        return int(level)
+    return 3 if codec == ZSTD else 6
+
+
+def compress(data: bytes, codec: Optional[str] = None) -> Tuple[str, bytes]:
+    """Devuelve (codec usado, bytes); `identity` si no conviene comprimir."""
+    codec = codec or configured_codec()
+    if codec == IDENTITY or len(data) < _min_bytes():
+        return IDENTITY, data
+    if codec == GZIP:
+        out = gzip.compress(data, compresslevel=_level(codec), mtime=0)
+    elif codec == ZSTD:
+        out = _zstd().ZstdCompressor(level=_level(codec)).compress(data)
+    else:
+        raise ValueError(f"codec de compresión desconocido: {codec}")
+    if len(out) >= len(data):
+        return IDENTITY, data
+    return codec, out
+
+
+def decompress(codec: Optional[str], data: bytes) -> bytes:
+    if not codec or codec == IDENTITY:
+        return data
+    if codec == OMITTED:
+        return b""
+    if codec == GZIP:
+        return gzip.decompress(data)
+    if codec == ZSTD:
+        return _zstd().ZstdDecompressor().decompress(data)
+    raise ValueError(f"codec de compresión desconocido: {codec}")
+
+
+def is_packed(value: Any) -> bool:
+    return isinstance(value, dict) and _MARKER in value
+
+
+def dumps_json(value: Any) -> bytes:
+    # misma serialización que JSONResponse: replay byte a byte
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, allow_nan=False).encode("utf-8")
+
+
+def pack_json(value: Any, codec: Optional[str] = None) -> Any:
+    """Valor JSON -> mismo valor, sobre comprimido o sobre de escape (para columnas JSON/JSONB)."""
+    if value is None:
+        return value
+    used, out = compress(dumps_json(value), codec)
+    if used != IDENTITY:
+        return {_MARKER: used, "data": base64.b64encode(out).decode("ascii")}
+    if is_packed(value):
+        # el valor del usuario ya trae el marcador: se escapa para no confundirlo con un sobre
+        return {_MARKER: IDENTITY, "data": value}
+    return value
+
+
+def unpack_json(value: Any) -> Any:
+    if isinstance(value, str):
+        # jsonb leído como texto (sin codec registrado en el driver)
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return value
+        return unpack_json(parsed) if is_packed(parsed) else value
+    if not is_packed(value):
+        return value
+    if value[_MARKER] == IDENTITY:
+        return value["data"]
+    raw = decompress(value[_MARKER], base64.b64decode(value["data"]))
+    return json.loads(raw)
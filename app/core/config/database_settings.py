@@ -9,6 +9,16 @@ class DatabaseSettings(BaseModel):
     POSTGRES_DB: str = ""
     ECHO_SQL:bool = False
     ASYNC_MODE:bool = True
+    PAYLOAD_COMPRESSION: str = "none"          # none | gzip | zstd (opt-in)
+    PAYLOAD_COMPRESSION_MIN_BYTES: int = 2048
+    PAYLOAD_COMPRESSION_LEVEL: int | None = None
+    # pool por worker: conexiones máximas = POOL_SIZE + POOL_MAX_OVERFLOW (x workers x pods)
+    POOL_SIZE: int = 5
+    POOL_MAX_OVERFLOW: int = 10
+    POOL_TIMEOUT_SECONDS: float = 30           # espera máxima por una conexión libre
+    POOL_RECYCLE_SECONDS: int = 1800           # -1 = sin reciclar
+    POOL_USE_LIFO: bool = True                 # reusa las más recientes; las ociosas se cierran
+    STATEMENT_CACHE_SIZE: int = 100            # asyncpg; 0 con pgbouncer en modo transaction
 
     @computed_field
     @property
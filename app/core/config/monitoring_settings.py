@@ -2,8 +2,10 @@ from pydantic import BaseModel, HttpUrl, field_validator
 
 class MonitoringSettings(BaseModel):
     SENTRY_DSN: HttpUrl | None = None
+    # Bearer para /metrics; sin token el endpoint solo se monta en ENVIRONMENT=local
+    METRICS_TOKEN: str | None = None
 
-    @field_validator("SENTRY_DSN", mode="before")
+    @field_validator("SENTRY_DSN", "METRICS_TOKEN", mode="before")
     @classmethod
     def _noneify(cls, v):
         if isinstance(v, str) and v.lower() in ("null", "none", ""):
@@ -9,16 +9,60 @@ class SecuritySettings(BaseModel):
     FIRST_SUPERUSER_PASSWORD: str = "changethis"
 
     ENABLE_HMAC: bool = True
+    HMAC_AUTH_MODE: str = "dependency"              # dependency | middleware
+    HMAC_MIDDLEWARE_PATH_PREFIXES: list[str] = ["/api/v1/invoices"]
     HMAC_WINDOW_SECONDS: int = 300
     ENABLE_TIMESTAMP: bool = False
-    REQUIRE_TIMESTAMP_WITH_NONCE: bool = False      
-    ENABLE_NONCE: bool = False
+    REQUIRE_TIMESTAMP_WITH_NONCE: bool = False      # True: ENABLE_NONCE sin ENABLE_TIMESTAMP no arranca (si no, warning)
+    ENABLE_NONCE: bool = False                      # sin ENABLE_TIMESTAMP un nonce solo se recuerda nonce_ttl_seconds()
     USE_REDIS_FOR_NONCE: bool = False
     REDIS_DSN: str | None = None
+    NONCE_BACKEND: str = "postgres"                 # postgres | redis | memory
+    NONCE_MEMORY_SHARDS: int = 16
+    NONCE_BATCH_WINDOW_MS: float = 2                # 0 = un INSERT + commit por request
+    NONCE_BATCH_MAX: int = 64
+    NONCE_POOL_SIZE: int = 2                        # conexiones reservadas para registrar nonces sin lote
+    NONCE_PARTITION_INTERVAL: str = "day"           # hour | day
+    NONCE_PARTITIONS_AHEAD: int = 2
+    NONCE_PARTITION_MAINTENANCE_SECONDS: int = 600  # 0 = sin mantenimiento en proceso
+    NONCE_PARTITION_LOCK_TIMEOUT_MS: int = 500      # espera máxima del lock de CREATE/DETACH sobre security_nonces
+    NONCE_PARTITION_DDL_ATTEMPTS: int = 3
     ENABLE_IDEMPOTENCY: bool = False
     IDEMPOTENCY_REQUIRED: bool = False
     IDEMPOTENCY_TTL_DAYS: int = 14   
+    RETENTION_SWEEP_INTERVAL_SECONDS: int = 3600     # 0 = sin barrido en proceso
+    RETENTION_BATCH_SIZE: int = 1000
+    RETENTION_BATCH_PAUSE_MS: int = 50
+    IDEMPOTENCY_LEASE_SECONDS: int = 120             # > duración máxima esperable del handler
+    IDEMPOTENCY_LEASE_MAX_SECONDS: int = 3600        # tope de renovación del lease (handler/stream en curso)
+    IDEMPOTENCY_LEASE_SWEEP_SECONDS: int = 60        # 0 = sin sweeper (igual se reclama al reintentar)
+    IDEMPOTENCY_WAIT_SECONDS: float = 0              # >0 = esperar al request en curso en vez de 409
+    IDEMPOTENCY_WAIT_POLL_SECONDS: float = 0.5       # re-consulta mientras espera (claims descartados en otro nodo)
+    IDEMPOTENCY_FINALIZE_QUEUE_MAX: int = 1000       # 0 = finalize síncrono en el request
+    IDEMPOTENCY_FINALIZE_BATCH_MAX: int = 100
+    IDEMPOTENCY_FINALIZE_WINDOW_MS: float = 5
+    IDEMPOTENCY_FINALIZE_MAX_ATTEMPTS: int = 3      # por registro rechazado por la DB
+    IDEMPOTENCY_STORE_RAW: bool = False              # bytes + headers tal cual (bytea) en vez de JSONB
+    IDEMPOTENCY_CAPTURE_MAX_BYTES: int = 8 * 1024 * 1024   # más grande = se sirve pero no se guarda el cuerpo
+    IDEMPOTENCY_CAPTURE_MEMORY_BYTES: int = 256 * 1024     # por encima la captura se vuelca a un archivo temporal
+    IDEMPOTENCY_REPLAY_HEADERS: list[str] = ["location", "content-location", "etag", "last-modified"]
+    IDEMPOTENCY_CACHE_MAX_BYTES: int = 32 * 1024 * 1024   # 0 = sin cache en memoria
+    IDEMPOTENCY_CACHE_MAX_ENTRY_BYTES: int = 256 * 1024
+    IDEMPOTENCY_CACHE_TTL_SECONDS: int = 300
     TRUST_PROXY_HEADERS: bool = False
+    CREDENTIAL_CACHE_TTL_SECONDS: int = 60
+    NEGATIVE_CACHE_TTL_SECONDS: int = 30
+    NEGATIVE_CACHE_MAX_ENTRIES: int = 10000
+    AUTH_FAILURE_WINDOW_SECONDS: int = 60
+    AUTH_FAILURE_MAX_PER_IP: int = 0                # 0 = solo contar, sin bloquear
+    KEY_USAGE_FLUSH_SECONDS: int = 10               # 0 = UPDATE síncrono por request
+    ENABLE_RATE_LIMIT: bool = False
+    RATE_LIMIT_CLIENT_PER_MINUTE: int = 600         # default si la fila no define rate_limit_per_minute
+    RATE_LIMIT_CLIENT_BURST: int | None = None      # None = igual al límite por minuto
+    RATE_LIMIT_USER_PER_MINUTE: int = 120
+    RATE_LIMIT_USER_BURST: int | None = None
+    RATE_LIMIT_SLOTS: int = 8192
+    RATE_LIMIT_SHM_PATH: str | None = None          # None = /dev/shm (o tmp)
     
 
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
@@ -29,6 +73,20 @@ class SecuritySettings(BaseModel):
             )
             warnings.warn(message, stacklevel=1)
 
+    @model_validator(mode="after")
+    def _check_timestamp_with_nonce(self) -> Self:
+        # los nonces se olvidan tras nonce_ttl_seconds(); sin timestamp nada acota la
+        # edad de un request firmado y una captura se podría reenviar después
+        if self.ENABLE_NONCE and not self.ENABLE_TIMESTAMP:
+            message = (
+                "ENABLE_NONCE sin ENABLE_TIMESTAMP: un request capturado se puede "
+                "reenviar pasado nonce_ttl_seconds()"
+            )
+            if self.REQUIRE_TIMESTAMP_WITH_NONCE:
+                raise ValueError(message)
+            warnings.warn(message, stacklevel=1)
+        return self
+
     @model_validator(mode="after")
     def _enforce_non_default_secrets(self) -> Self:
         self._check_default_secret("SECRET_KEY", self.SECRET_KEY)
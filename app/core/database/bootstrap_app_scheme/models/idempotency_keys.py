@@ -3,10 +3,11 @@ from datetime import datetime
 from typing import Optional
 
 from sqlmodel import SQLModel, Field, Column
-from sqlalchemy import Integer, String, Boolean, UniqueConstraint, text
-from sqlalchemy.dialects.postgresql import TIMESTAMP, JSONB
+from sqlalchemy import Integer, String, Boolean, Index, UniqueConstraint, text
+from sqlalchemy.dialects.postgresql import TIMESTAMP, JSONB, BYTEA
 from sqlalchemy.sql import func
 
+from app.core.database.types import CompressedJSON
 from . import schema_name
 
 
@@ -14,6 +15,12 @@ class IdempotencyKeys(SQLModel, table=True):
     __tablename__ = "idempotency_keys"
     __table_args__ = (
         UniqueConstraint("client_id", "key", name="uq_client_idem"),
+        Index("ix_bootstrap_app_idempotency_keys_create_date", "create_date", "cod_idempotency_keys"),
+        Index(
+            "ix_bootstrap_app_idempotency_keys_processing_lease",
+            "lease_expires_at",
+            postgresql_where=text("status = 'processing'"),
+        ),
         {"schema": schema_name},
     )
 
@@ -45,6 +52,14 @@ class IdempotencyKeys(SQLModel, table=True):
     key: str = Field(sa_column=Column("key", String(128), nullable=False))
     requestFingerprint: str = Field(sa_column=Column("request_fingerprint", String(64), nullable=False))
 
-    responseJson: Optional[dict] = Field(default=None, sa_column=Column("response_json", JSONB))
+    responseJson: Optional[dict] = Field(default=None, sa_column=Column("response_json", CompressedJSON(binary=True)))
     httpStatus: Optional[int] = Field(default=None, sa_column=Column("http_status", Integer))
+    # IDEMPOTENCY_STORE_RAW: bytes exactos + media type + headers seleccionados
+    responseBody: Optional[bytes] = Field(default=None, sa_column=Column("response_body", BYTEA))
+    responseCodec: Optional[str] = Field(default=None, sa_column=Column("response_codec", String(16)))
+    responseMediaType: Optional[str] = Field(default=None, sa_column=Column("response_media_type", String(128)))
+    responseHeaders: Optional[dict] = Field(default=None, sa_column=Column("response_headers", JSONB))
+    # lease del claim: quién lo procesa y hasta cuándo (vencido => reclamable)
+    leaseOwner: Optional[str] = Field(default=None, sa_column=Column("lease_owner", String(64)))
+    leaseExpiresAt: Optional[datetime] = Field(default=None, sa_column=Column("lease_expires_at", TIMESTAMP(timezone=True)))
     status: str = Field(default="processing", sa_column=Column("status", String(16), nullable=False, server_default="processing"))
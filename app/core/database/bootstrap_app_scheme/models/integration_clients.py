@@ -28,6 +28,9 @@ class IntegrationClients(SQLModel, table=True):
     active: bool = Field(default=True, sa_column=Column("active", Boolean, nullable=False, server_default=text("true")))
     clientId: str = Field(sa_column=Column("client_id", String(64), unique=True, nullable=False))
     name: str = Field(sa_column=Column("name", String(255), nullable=False))
+    # límites del rate limiter por cliente (NULL = default de settings)
+    rateLimitPerMinute: int | None = Field(default=None, sa_column=Column("rate_limit_per_minute", Integer, nullable=True))
+    rateLimitBurst: int | None = Field(default=None, sa_column=Column("rate_limit_burst", Integer, nullable=True))
 
     # 👇 Pydantic ignora (ClassVar); SQLAlchemy sí mapea
     keys: ClassVar[list["ClientKeys"]] = relationship(
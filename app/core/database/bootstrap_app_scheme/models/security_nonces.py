@@ -2,7 +2,7 @@ from datetime import datetime
 from typing import ClassVar
 
 from sqlmodel import SQLModel, Field
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, UniqueConstraint, text
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, text
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -11,9 +11,11 @@ from . import schema_name
 
 class SecurityNonces(SQLModel, table=True):
     __tablename__ = "security_nonces"
+    # Particionada por rango de received_at (ver NoncePartitionManager). La
+    # unicidad (client_id, nonce) dentro de la ventana la garantiza register_nonces().
     __table_args__ = (
-        UniqueConstraint("client_id", "nonce", name="uq_nonce_per_client"),
-        {"schema": schema_name},
+        Index("ix_security_nonces_client_nonce", "client_id", "nonce", "received_at"),
+        {"schema": schema_name, "postgresql_partition_by": "RANGE (received_at)"},
     )
 
     codSecurityNonce: int | None = Field(default=None, sa_column=Column("cod_security_nonce", Integer, primary_key=True, autoincrement=True))
@@ -34,6 +36,6 @@ class SecurityNonces(SQLModel, table=True):
     clientId: str = Field(sa_column=Column("client_id", String(64), nullable=False))
     nonce: str = Field(sa_column=Column("nonce", String(64), nullable=False))
     requestTs: datetime = Field(sa_column=Column("request_ts", TIMESTAMP(timezone=True), nullable=False))
-    receivedAt: datetime = Field(sa_column=Column("received_at", TIMESTAMP(timezone=True), nullable=False, server_default=func.now()))
+    receivedAt: datetime = Field(sa_column=Column("received_at", TIMESTAMP(timezone=True), primary_key=True, nullable=False, server_default=func.now()))
 
     integrationClient: ClassVar["IntegrationClients"] = relationship("IntegrationClients", lazy="selectin")
@@ -0,0 +1,201 @@
+"""
+Mantenimiento de particiones de `security_nonces` (RANGE por received_at).
+
+Crea por adelantado `NONCE_PARTITIONS_AHEAD` particiones del intervalo
+configurado (`hour` | `day`) y descarta con DETACH + DROP las que quedaron
+completamente fuera de la ventana de replay (`nonce_ttl_seconds()`, acotada por
+la verificación de timestamp), en vez de borrar fila por fila. Las particiones se nombran
+`security_nonces_pYYYYMMDD` (día) o `security_nonces_pYYYYMMDDHH` (hora), en UTC.
+
+Varios workers pueden correr el ciclo: solo actúa quien toma el lock advisory
+(de sesión, en una conexión propia).
+
+CREATE ... PARTITION OF y DETACH PARTITION toman ACCESS EXCLUSIVE sobre
+`security_nonces`: mientras esperan ese lock, cada INSERT de nonce queda en la
+cola detrás de ellos. Por eso cada partición se crea o se descarta en su propia
+transacción corta con `lock_timeout` = `NONCE_PARTITION_LOCK_TIMEOUT_MS`; si no
+consigue el lock se reintenta (`NONCE_PARTITION_DDL_ATTEMPTS`, con espera
+creciente) y si no, queda para el próximo ciclo (las particiones se crean con
+anticipación y lo vencido lo cubre el barrido de retención). DETACH ...
+CONCURRENTLY no sirve acá: Postgres no lo permite con partición DEFAULT
+(`security_nonces_default`).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta, UTC
+from typing import List, Optional, Tuple
+
+from sqlalchemy import exc as sa_exc, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.config import settings
+from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
+from app.core.database.db_async import engine
+from app.core.security.nonce_store import nonce_ttl_seconds
+
+logger = logging.getLogger(__name__)
+
+_TABLE = "security_nonces"
+_LOCK_KEY = 0x6E6F6E63  # "nonc"
+_NAME_RE = re.compile(rf"^{_TABLE}_p(\d{{8}})(\d{{2}})?$")
+
+_LIST_PARTITIONS = text("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class p ON p.oid = i.inhparent
+    JOIN pg_namespace n ON n.oid = p.relnamespace
+    WHERE n.nspname = :schema AND p.relname = :table
+""")
+
+Range = Tuple[datetime, datetime]
+
+
+def _parse(name: str) -> Optional[Range]:
+    m = _NAME_RE.match(name)
+    if m is None:
+        return None
+    day = datetime.strptime(m.group(1), "%Y%m%d").replace(tzinfo=UTC)
+    if m.group(2) is None:
+        return day, day + timedelta(days=1)
+    start = day + timedelta(hours=int(m.group(2)))
+    return start, start + timedelta(hours=1)
+
+
+def _partition_name(start: datetime, hourly: bool) -> str:
+    return f"{_TABLE}_p{start.strftime('%Y%m%d%H' if hourly else '%Y%m%d')}"
+
+
+def _lock_not_available(e: sa_exc.DBAPIError) -> bool:
+    # 55P03 lock_not_available: venció lock_timeout
+    orig = getattr(e, "orig", None)
+    code = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    return code == "55P03" or "lock timeout" in str(e).lower()
+
+
+class NoncePartitionManager:
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def interval(self) -> float:
+        return float(getattr(settings.security, "NONCE_PARTITION_MAINTENANCE_SECONDS", 600))
+
+    @property
+    def hourly(self) -> bool:
+        return str(getattr(settings.security, "NONCE_PARTITION_INTERVAL", "day")).lower() == "hour"
+
+    @property
+    def ahead(self) -> int:
+        return max(1, int(getattr(settings.security, "NONCE_PARTITIONS_AHEAD", 2)))
+
+    @property
+    def lock_timeout_ms(self) -> int:
+        return max(1, int(getattr(settings.security, "NONCE_PARTITION_LOCK_TIMEOUT_MS", 500)))
+
+    @property
+    def ddl_attempts(self) -> int:
+        return max(1, int(getattr(settings.security, "NONCE_PARTITION_DDL_ATTEMPTS", 3)))
+
+    async def _ddl(self, conn: AsyncConnection, *statements: str) -> bool:
+        """
+        `statements` en una transacción corta con lock_timeout. Reintenta si no
+        consiguió el lock; False si se rindió (queda para el próximo ciclo).
+        """
+        for attempt in range(1, self.ddl_attempts + 1):
+            try:
+                await conn.execute(text(f"SET LOCAL lock_timeout = '{self.lock_timeout_ms}ms'"))
+                for stmt in statements:
+                    await conn.execute(text(stmt))
+                await conn.commit()
+                return True
+            except sa_exc.DBAPIError as e:
+                await conn.rollback()
+                if not _lock_not_available(e):
+                    raise
+                if attempt < self.ddl_attempts:
+                    await asyncio.sleep(attempt * self.lock_timeout_ms / 1000.0)
+        logger.warning("security_nonces: sin lock tras %s intentos, queda para el próximo ciclo: %s", self.ddl_attempts, statements[0])
+        return False
+
+    def _wanted(self, now: datetime) -> List[Range]:
+        if self.hourly:
+            step = timedelta(hours=1)
+            first = now.replace(minute=0, second=0, microsecond=0)
+        else:
+            step = timedelta(days=1)
+            first = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return [(first + i * step, first + (i + 1) * step) for i in range(self.ahead + 1)]
+
+    async def maintain(self, now: Optional[datetime] = None) -> Tuple[int, int]:
+        """Devuelve (particiones creadas, particiones eliminadas)."""
+        now = now or datetime.now(UTC)
+        cutoff = now - timedelta(seconds=nonce_ttl_seconds())
+        created = dropped = 0
+        # conexión propia: el lock advisory de sesión vive en ESTA conexión
+        async with engine.connect() as conn:
+            got = (await conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _LOCK_KEY})).scalar()
+            await conn.commit()
+            if not got:
+                return 0, 0
+            try:
+                res = await conn.execute(_LIST_PARTITIONS, {"schema": BOOTSTRAP_SCHEMA, "table": _TABLE})
+                existing = {name: rng for name in res.scalars() if (rng := _parse(name)) is not None}
+                await conn.commit()
+
+                for start, end in self._wanted(now):
+                    # no se superponen rangos (p.ej. al pasar de `day` a `hour`)
+                    if any(s < end and start < e for s, e in existing.values()):
+                        continue
+                    name = _partition_name(start, self.hourly)
+                    if await self._ddl(
+                        conn,
+                        f"CREATE TABLE IF NOT EXISTS {BOOTSTRAP_SCHEMA}.{name} "
+                        f"PARTITION OF {BOOTSTRAP_SCHEMA}.{_TABLE} "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')",
+                    ):
+                        existing[name] = (start, end)
+                        created += 1
+
+                for name, (_, end) in sorted(existing.items()):
+                    if end > cutoff:
+                        continue
+                    if await self._ddl(
+                        conn,
+                        f"ALTER TABLE {BOOTSTRAP_SCHEMA}.{_TABLE} DETACH PARTITION {BOOTSTRAP_SCHEMA}.{name}",
+                        f"DROP TABLE {BOOTSTRAP_SCHEMA}.{name}",
+                    ):
+                        dropped += 1
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+                await conn.commit()
+        if created or dropped:
+            logger.info("security_nonces: %s particiones creadas, %s eliminadas", created, dropped)
+        return created, dropped
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.maintain()
+            except Exception:
+                logger.exception("No se pudo mantener las particiones de security_nonces")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="nonce-partitions")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+nonce_partitions = NoncePartitionManager()
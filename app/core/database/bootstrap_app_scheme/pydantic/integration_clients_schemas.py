@@ -8,6 +8,8 @@ class IntegrationClientCreate(SQLModel):
     clientId: str = Field(min_length=1, max_length=64)
     name: str = Field(min_length=1, max_length=255)
     active: bool = True
+    rateLimitPerMinute: Optional[int] = Field(default=None, ge=1)
+    rateLimitBurst: Optional[int] = Field(default=None, ge=1)
 
 class IntegrationClientUpdate(SQLModel):
     createUser: Optional[int] = None
@@ -15,6 +17,8 @@ class IntegrationClientUpdate(SQLModel):
     clientId: Optional[str] = Field(default=None, min_length=1, max_length=64)
     name: Optional[str] = Field(default=None, min_length=1, max_length=255)
     active: Optional[bool] = None
+    rateLimitPerMinute: Optional[int] = Field(default=None, ge=1)
+    rateLimitBurst: Optional[int] = Field(default=None, ge=1)
     deleteDate: Optional[datetime] = None  # por si manejas soft-delete
 
 class IntegrationClientOut(SQLModel):
@@ -27,5 +31,7 @@ class IntegrationClientOut(SQLModel):
     active: bool
     clientId: str
     name: str
+    rateLimitPerMinute: Optional[int] = None
+    rateLimitBurst: Optional[int] = None
 
     model_config = {"from_attributes": True}
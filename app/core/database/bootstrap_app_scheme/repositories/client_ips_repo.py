@@ -5,11 +5,13 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database.bootstrap_app_scheme.models import ClientIPs
+from app.core.security.credential_cache import notify_credentials_changed
 from app.core.database.bootstrap_app_scheme.pydantic.client_ips_schemas import ClientIpCreate, ClientIpUpdate
 
 async def ip_create(db: AsyncSession, data: ClientIpCreate) -> ClientIPs:
     obj = ClientIPs(**data.model_dump(exclude_unset=True))
     db.add(obj)
+    await notify_credentials_changed(db, data.integrationClientCod)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -28,6 +30,7 @@ async def ip_upsert(db: AsyncSession, data: ClientIpCreate) -> ClientIPs:
         obj.active = data.active
         obj.createUser = data.createUser
         obj.userAt = data.userAt
+        await notify_credentials_changed(db, obj.integrationClientCod)
         await db.commit()
         await db.refresh(obj)
         return obj
@@ -47,6 +50,7 @@ async def ip_update(db: AsyncSession, cod: int, data: ClientIpUpdate) -> Optiona
         return None
     for k, v in data.model_dump(exclude_unset=True).items():
         setattr(obj, k, v)
+    await notify_credentials_changed(db, obj.integrationClientCod)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -56,5 +60,6 @@ async def ip_delete(db: AsyncSession, cod: int) -> bool:
     if not obj:
         return False
     await db.delete(obj)
+    await notify_credentials_changed(db, obj.integrationClientCod)
     await db.commit()
     return True
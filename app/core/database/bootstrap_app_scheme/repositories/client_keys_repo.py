@@ -6,11 +6,13 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database.bootstrap_app_scheme.models import ClientKeys
+from app.core.security.credential_cache import notify_credentials_changed
 from app.core.database.bootstrap_app_scheme.pydantic.client_keys_schemas import ClientKeyCreate, ClientKeyUpdate
 
 async def ck_create(db: AsyncSession, data: ClientKeyCreate) -> ClientKeys:
     obj = ClientKeys(**data.model_dump(exclude_unset=True))
     db.add(obj)
+    await notify_credentials_changed(db, data.integrationClientCod)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -38,6 +40,7 @@ async def ck_update(db: AsyncSession, cod: int, data: ClientKeyUpdate) -> Option
     payload = data.model_dump(exclude_unset=True)
     for k, v in payload.items():
         setattr(obj, k, v)
+    await notify_credentials_changed(db, obj.integrationClientCod)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -47,6 +50,7 @@ async def ck_delete(db: AsyncSession, cod: int) -> bool:
     if not obj:
         return False
     await db.delete(obj)
+    await notify_credentials_changed(db, obj.integrationClientCod)
     await db.commit()
     return True
 
@@ -9,6 +9,7 @@ from app.core.database.bootstrap_app_scheme.models import IdempotencyKeys
 from app.core.database.bootstrap_app_scheme.pydantic.idempotency_keys_schemas import (
     IdempotencyKeyCreate, IdempotencyKeyUpdate
 )
+from app.core.security.idempotency_cache import notify_idempotency_changed
 
 # Reclama / crea un registro para (clientId, key). Devuelve el registro "processing" existente o uno nuevo.
 async def idem_claim(db: AsyncSession, data: IdempotencyKeyCreate) -> IdempotencyKeys:
@@ -50,6 +51,7 @@ async def idem_complete(
     obj.responseJson = response_json
     obj.httpStatus = http_status
     obj.status = status
+    await notify_idempotency_changed(db, client_id, key)
     await db.commit()
     return True
 
@@ -59,6 +61,7 @@ async def idem_touch_status(db: AsyncSession, client_id: str, key: str, status:
     if not obj:
         return False
     obj.status = status
+    await notify_idempotency_changed(db, client_id, key)
     await db.commit()
     return True
 
@@ -66,10 +69,12 @@ async def idem_touch_status(db: AsyncSession, client_id: str, key: str, status:
 async def idem_exists(db: AsyncSession, client_id: str, key: str) -> bool:
     return (await idem_get(db, client_id, key)) is not None
 
-# Limpia registros viejos opcionalmente
+# Limpia registros viejos opcionalmente (DELETE único; el barrido periódico en
+# lotes es RetentionSweeper, que usa IDEMPOTENCY_TTL_DAYS)
 async def idem_prune_old(db: AsyncSession, older_than_days: int = 30) -> int:
     cutoff = datetime.utcnow() - timedelta(days=older_than_days)
     stmt = delete(IdempotencyKeys).where(IdempotencyKeys.createDate < cutoff)
     res = await db.execute(stmt)
+    await notify_idempotency_changed(db)
     await db.commit()
     return res.rowcount or 0
@@ -6,6 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import col
 
 from app.core.database.bootstrap_app_scheme.models import IntegrationClients
+from app.core.security.credential_cache import notify_credentials_changed
 from app.core.database.bootstrap_app_scheme.pydantic.integration_clients_schemas import (
     IntegrationClientCreate, IntegrationClientUpdate
 )
@@ -13,6 +14,8 @@ from app.core.database.bootstrap_app_scheme.pydantic.integration_clients_schemas
 async def ic_create(db: AsyncSession, data: IntegrationClientCreate) -> IntegrationClients:
     obj = IntegrationClients(**data.model_dump(exclude_unset=True))
     db.add(obj)
+    await db.flush()
+    await notify_credentials_changed(db, obj.codIntegrationClient)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -54,6 +57,7 @@ async def ic_update(db: AsyncSession, cod: int, data: IntegrationClientUpdate) -
         return None
     for k, v in data.model_dump(exclude_unset=True).items():
         setattr(obj, k, v)
+    await notify_credentials_changed(db, cod)
     await db.commit()
     await db.refresh(obj)
     return obj
@@ -63,5 +67,6 @@ async def ic_delete(db: AsyncSession, cod: int) -> bool:
     if not obj:
         return False
     await db.delete(obj)
+    await notify_credentials_changed(db, cod)
     await db.commit()
     return True
@@ -25,10 +25,13 @@ async def nonce_exists(db: AsyncSession, client_id: str, nonce: str) -> bool:
     res = await db.execute(stmt)
     return res.scalars().first() is not None
 
+# La PK es (codSecurityNonce, receivedAt) por el particionado: se busca por cod
 async def nonce_get(db: AsyncSession, cod: int) -> Optional[SecurityNonces]:
-    return await db.get(SecurityNonces, cod)
+    res = await db.execute(select(SecurityNonces).where(SecurityNonces.codSecurityNonce == cod))
+    return res.scalars().first()
 
-# Limpieza por antigüedad (por ejemplo, > 1 día)
+# Limpieza por antigüedad (por ejemplo, > 1 día). Con la tabla particionada lo
+# habitual es que NoncePartitionManager descarte particiones enteras.
 async def nonce_prune_old(db: AsyncSession, older_than_hours: int = 24) -> int:
     cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
     stmt = delete(SecurityNonces).where(SecurityNonces.createDate < cutoff)
@@ -0,0 +1,271 @@
+"""
+Barrido de retención de `idempotency_keys` y `security_nonces`.
+
+- idempotency_keys: filas con `create_date` anterior a `IDEMPOTENCY_TTL_DAYS`.
+- security_nonces: filas fuera de la ventana de replay. Lo normal es que
+  NoncePartitionManager ya haya descartado sus particiones; esto cubre la
+  partición DEFAULT.
+
+Borra en lotes de `RETENTION_BATCH_SIZE` en orden de (fecha, cod) con una pausa
+de `RETENTION_BATCH_PAUSE_MS` entre lotes (una transacción corta por lote). Un
+lock advisory de sesión garantiza un solo barrido a la vez en todo el cluster.
+Cada corrida reporta filas borradas y duración (log + /metrics).
+
+`AbandonedClaimSweeper` marca en bloque como 'fail' (sin http_status, o sea
+reclamables) los claims 'processing' cuyo lease venció: el próximo reintento los
+reclama en su propio INSERT ... ON CONFLICT. Los que ya tienen http_status (el
+handler confirmó y se perdió el cuerpo de un stream) se cierran con ese status y
+codec `omitted`: el replay responde "response not stored" y el handler no se
+vuelve a ejecutar. Despierta a quien esté esperando esas claves
+(IDEMPOTENCY_WAIT_SECONDS).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, UTC
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.config import settings
+from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
+from app.core.database.db_async import AsyncSessionLocal, engine
+from app.core.metrics import registry
+from app.core.security.idempotency import lease_seconds
+from app.core.security.idempotency_waiters import completion_waiters, notify_completed, wait_seconds
+from app.core.security.nonce_store import nonce_ttl_seconds
+
+logger = logging.getLogger(__name__)
+
+_LOCK_KEY = 0x72657465  # "rete"
+
+RETENTION_DELETED = registry.counter(
+    "retention_deleted_rows_total", "Filas borradas por el barrido de retención.", ("table",)
+)
+RETENTION_SECONDS = registry.histogram(
+    "retention_sweep_seconds", "Duración de cada barrido de retención.",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900),
+)
+
+# Keyset: cada lote arranca después del último (fecha, cod) visto; SKIP LOCKED
+# para no esperar filas que un request esté tocando.
+_DELETE_IDEMPOTENCY = text(f"""
+    WITH doomed AS (
+        SELECT cod_idempotency_keys
+        FROM {BOOTSTRAP_SCHEMA}.idempotency_keys
+        WHERE create_date < :cutoff
+          AND (create_date, cod_idempotency_keys) > (:last_ts, :last_cod)
+        ORDER BY create_date, cod_idempotency_keys
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM {BOOTSTRAP_SCHEMA}.idempotency_keys ik
+    USING doomed
+    WHERE ik.cod_idempotency_keys = doomed.cod_idempotency_keys
+    RETURNING ik.create_date, ik.cod_idempotency_keys
+""")
+
+_DELETE_NONCES = text(f"""
+    WITH doomed AS (
+        SELECT cod_security_nonce, received_at
+        FROM {BOOTSTRAP_SCHEMA}.security_nonces
+        WHERE received_at < :cutoff
+          AND (received_at, cod_security_nonce) > (:last_ts, :last_cod)
+        ORDER BY received_at, cod_security_nonce
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM {BOOTSTRAP_SCHEMA}.security_nonces sn
+    USING doomed
+    WHERE sn.cod_security_nonce = doomed.cod_security_nonce
+      AND sn.received_at = doomed.received_at
+    RETURNING sn.received_at, sn.cod_security_nonce
+""")
+
+_EXPIRE_LEASES = text(f"""
+    WITH stale AS (
+        SELECT cod_idempotency_keys
+        FROM {BOOTSTRAP_SCHEMA}.idempotency_keys
+        WHERE status = 'processing'
+          AND (lease_expires_at < NOW()
+               OR (lease_expires_at IS NULL AND create_date < NOW() - make_interval(secs => :lease)))
+        ORDER BY lease_expires_at NULLS FIRST
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE {BOOTSTRAP_SCHEMA}.idempotency_keys ik
+    SET status = CASE WHEN ik.http_status BETWEEN 200 AND 299 THEN 'success' ELSE 'fail' END,
+        lease_owner = NULL,
+        lease_expires_at = NULL,
+        update_date = NOW()
+    FROM stale
+    WHERE ik.cod_idempotency_keys = stale.cod_idempotency_keys
+    RETURNING ik.client_id, ik.key
+""")
+
+ABANDONED_CLAIMS = registry.counter(
+    "idempotency_abandoned_claims_total", "Claims 'processing' con lease vencido liberados por el sweeper."
+)
+
+_LEASE_LOCK_KEY = 0x6C656173  # "leas"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+@dataclass
+class SweepReport:
+    deleted: Dict[str, int] = field(default_factory=dict)
+    seconds: float = 0.0
+    skipped: bool = False
+
+
+class RetentionSweeper:
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def interval(self) -> float:
+        return float(getattr(settings.security, "RETENTION_SWEEP_INTERVAL_SECONDS", 3600))
+
+    @property
+    def batch_size(self) -> int:
+        return max(1, int(getattr(settings.security, "RETENTION_BATCH_SIZE", 1000)))
+
+    @property
+    def pause(self) -> float:
+        return max(0.0, float(getattr(settings.security, "RETENTION_BATCH_PAUSE_MS", 50)) / 1000.0)
+
+    async def _sweep_table(self, conn: AsyncConnection, table: str, stmt, cutoff: datetime) -> int:
+        last_ts, last_cod, total = _EPOCH, 0, 0
+        while True:
+            rows = (await conn.execute(
+                stmt, {"cutoff": cutoff, "last_ts": last_ts, "last_cod": last_cod, "n": self.batch_size}
+            )).all()
+            await conn.commit()
+            if not rows:
+                break
+            total += len(rows)
+            RETENTION_DELETED.inc(len(rows), table=table)
+            last_ts, last_cod = max((r[0], r[1]) for r in rows)
+            if len(rows) < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        return total
+
+    async def sweep(self) -> SweepReport:
+        report = SweepReport()
+        start = time.perf_counter()
+        now = datetime.now(UTC)
+        ttl_days = int(getattr(settings.security, "IDEMPOTENCY_TTL_DAYS", 14))
+        # conexión propia: el lock advisory de sesión vive en ESTA conexión
+        async with engine.connect() as conn:
+            got = (await conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _LOCK_KEY})).scalar()
+            await conn.commit()
+            if not got:
+                report.skipped = True
+                return report
+            try:
+                if ttl_days > 0:
+                    report.deleted["idempotency_keys"] = await self._sweep_table(
+                        conn, "idempotency_keys", _DELETE_IDEMPOTENCY, now - timedelta(days=ttl_days)
+                    )
+                report.deleted["security_nonces"] = await self._sweep_table(
+                    conn, "security_nonces", _DELETE_NONCES, now - timedelta(seconds=nonce_ttl_seconds())
+                )
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+                await conn.commit()
+        report.seconds = time.perf_counter() - start
+        RETENTION_SECONDS.observe(report.seconds)
+        logger.info("Retención: %s filas borradas en %.2fs (%s)", sum(report.deleted.values()), report.seconds, report.deleted)
+        return report
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Falló el barrido de retención")
+
+    async def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="retention-sweeper")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+retention_sweeper = RetentionSweeper()
+
+
+class AbandonedClaimSweeper:
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def interval(self) -> float:
+        return float(getattr(settings.security, "IDEMPOTENCY_LEASE_SWEEP_SECONDS", 60))
+
+    @property
+    def batch_size(self) -> int:
+        return max(1, int(getattr(settings.security, "RETENTION_BATCH_SIZE", 1000)))
+
+    async def sweep(self) -> int:
+        total = 0
+        while True:
+            async with AsyncSessionLocal() as session:
+                got = await session.scalar(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _LEASE_LOCK_KEY})
+                if not got:
+                    return total
+                rows = (await session.execute(
+                    _EXPIRE_LEASES, {"lease": lease_seconds(), "n": self.batch_size}
+                )).all()
+                waiting = wait_seconds() > 0
+                if waiting:
+                    for client_id, key in rows:
+                        await notify_completed(session, client_id, key)
+                await session.commit()
+            for client_id, key in rows:
+                completion_waiters.signal(client_id, key)
+            total += len(rows)
+            ABANDONED_CLAIMS.inc(len(rows))
+            if len(rows) < self.batch_size:
+                break
+        if total:
+            logger.warning("Idempotencia: %s claims abandonados liberados", total)
+        return total
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Falló el sweeper de claims abandonados")
+
+    async def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="abandoned-claims-sweeper")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+abandoned_claims = AbandonedClaimSweeper()
@@ -1,16 +1,52 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker, AsyncSession
 
 from app.core.config import settings
+from app.core.database.pool import InstrumentedAsyncPool, register_pool_metrics
+
+_url = make_url(settings.db.SQLALCHEMY_DATABASE_URI)
+_connect_args = {}
+if _url.get_driver_name() == "asyncpg":
+    # cache de asyncpg y el del adaptador de SQLAlchemy: 0 desactiva ambos (pgbouncer)
+    _statement_cache_size = int(getattr(settings.db, "STATEMENT_CACHE_SIZE", 100))
+    _url = _url.update_query_dict({"prepared_statement_cache_size": str(_statement_cache_size)})
+    _connect_args["statement_cache_size"] = _statement_cache_size
 
 engine = create_async_engine(
-    settings.db.SQLALCHEMY_DATABASE_URI,
+    _url,
     echo=settings.db.ECHO_SQL,
     pool_pre_ping=True,
+    poolclass=InstrumentedAsyncPool,
+    pool_size=int(getattr(settings.db, "POOL_SIZE", 5)),
+    max_overflow=int(getattr(settings.db, "POOL_MAX_OVERFLOW", 10)),
+    pool_timeout=float(getattr(settings.db, "POOL_TIMEOUT_SECONDS", 30)),
+    pool_recycle=int(getattr(settings.db, "POOL_RECYCLE_SECONDS", 1800)),
+    pool_use_lifo=bool(getattr(settings.db, "POOL_USE_LIFO", True)),
+    connect_args=_connect_args,
 )
 
+register_pool_metrics(engine)
+
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
     autoflush=False,
     expire_on_commit=False,
     class_=AsyncSession,
 )
+
+
+def create_dedicated_engine(connections: int = 1) -> AsyncEngine:
+    """
+    Engine con pool propio, fuera del de los requests, para escritores de fondo
+    que no pueden quedar esperando una conexión que tienen tomada los mismos
+    requests que los esperan a ellos (p.ej. el lote de nonces).
+    """
+    return create_async_engine(
+        _url,
+        echo=settings.db.ECHO_SQL,
+        pool_pre_ping=True,
+        pool_size=max(1, int(connections)),
+        max_overflow=0,
+        pool_recycle=int(getattr(settings.db, "POOL_RECYCLE_SECONDS", 1800)),
+        connect_args=_connect_args,
+    )
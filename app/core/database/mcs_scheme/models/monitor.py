@@ -7,6 +7,7 @@ from sqlmodel import SQLModel, Field, Column, JSON, Integer, Boolean
 from . import schema_name
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.sql import func
+from app.core.database.types import CompressedJSON
 
 class MonitorStatus(str, Enum):
     draft = "draft"
@@ -21,9 +22,9 @@ class Monitor(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     document: str = Field(sa_column=Column("document", Integer, nullable=False))
     status: MonitorStatus = Field(default=None, index=True)
-    payload_client: Optional[dict] = Field(default=None, sa_column=Column(JSON))
-    payload_sap: Optional[dict] = Field(default=None, sa_column=Column(JSON))
-    error_details: Optional[dict] = Field(default=None, sa_column=Column(JSON))
+    payload_client: Optional[dict] = Field(default=None, sa_column=Column(CompressedJSON()))
+    payload_sap: Optional[dict] = Field(default=None, sa_column=Column(CompressedJSON()))
+    error_details: Optional[dict] = Field(default=None, sa_column=Column(CompressedJSON()))
     sap_doc_entry: Optional[int] = Field(default=None, index=True)
     sap_doc_num: Optional[int] = Field(default=None, index=True)
     version: int = Field(default=1, description="Optimistic locking")
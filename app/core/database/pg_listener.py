@@ -0,0 +1,117 @@
+"""
+Listener LISTEN/NOTIFY de Postgres compartido por los caches en memoria.
+
+Cada worker de uvicorn abre UNA conexión asyncpg dedicada (fuera del pool de
+SQLAlchemy) y despacha las notificaciones a los callbacks registrados por canal.
+Si la conexión se cae, al reconectar se invoca `on_reconnect` de cada canal
+(las notificaciones perdidas no se reenvían, así que los caches se vacían).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[[str], None]
+
+_RECONNECT_DELAY_SECONDS = 2.0
+
+
+def _dsn() -> str:
+    url = settings.db.SQLALCHEMY_DATABASE_URI.set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+async def pg_notify(session: AsyncSession, channel: str, payload: str) -> None:
+    """
+    Encola un NOTIFY en la transacción de `session`: Postgres lo entrega
+    solo cuando esa transacción hace commit.
+    """
+    await session.execute(text("SELECT pg_notify(:ch, :p)"), {"ch": channel, "p": payload})
+
+
+class PgListener:
+    def __init__(self) -> None:
+        self._callbacks: Dict[str, List[Callback]] = {}
+        self._on_reconnect: Dict[str, List[Callable[[], None]]] = {}
+        self._conn: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def listen(
+        self,
+        channel: str,
+        callback: Callback,
+        *,
+        on_reconnect: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self._callbacks.setdefault(channel, []).append(callback)
+        if on_reconnect is not None:
+            self._on_reconnect.setdefault(channel, []).append(on_reconnect)
+
+    def _dispatch(self, _conn: object, _pid: int, channel: str, payload: str) -> None:
+        for cb in self._callbacks.get(channel, []):
+            try:
+                cb(payload)
+            except Exception:
+                logger.exception("Error en callback de canal %s", channel)
+
+    def _reset_all(self) -> None:
+        for hooks in self._on_reconnect.values():
+            for hook in hooks:
+                hook()
+
+    async def _connect(self) -> asyncpg.Connection:
+        conn = await asyncpg.connect(_dsn())
+        for channel in self._callbacks:
+            await conn.add_listener(channel, self._dispatch)
+        return conn
+
+    async def _run(self) -> None:
+        connected_before = False
+        while not self._stopping:
+            try:
+                self._conn = await self._connect()
+                if connected_before:
+                    self._reset_all()
+                connected_before = True
+                closed = asyncio.Event()
+                self._conn.add_termination_listener(lambda _c: closed.set())
+                await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Listener Postgres sin conexión: %s", e)
+            if not self._stopping:
+                await asyncio.sleep(_RECONNECT_DELAY_SECONDS)
+
+    async def start(self) -> None:
+        if self._task is None and self._callbacks:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="pg-listener")
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+
+
+pg_listener = PgListener()
+
+__all__ = ["PgListener", "pg_listener", "pg_notify"]
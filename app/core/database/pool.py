@@ -0,0 +1,67 @@
+"""
+Pool de conexiones instrumentado (por worker).
+
+`InstrumentedAsyncPool` mide cuánto tarda cada checkout (espera por una conexión
+libre, o apertura de una nueva en overflow) y cuenta los timeouts del pool;
+`register_pool_metrics` publica tamaño, ocupación y overflow en /metrics. Con
+4 workers x (POOL_SIZE + POOL_MAX_OVERFLOW) x pods se llega a `max_connections`
+de Postgres: estas series muestran cuánto del pool se usa de verdad.
+"""
+from __future__ import annotations
+
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.core.metrics import registry
+
+POOL_CHECKOUT_SECONDS = registry.histogram(
+    "db_pool_checkout_seconds",
+    "Tiempo para obtener una conexión del pool (espera + apertura en overflow).",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+POOL_TIMEOUTS = registry.counter(
+    "db_pool_timeouts_total",
+    "Checkouts que agotaron POOL_TIMEOUT_SECONDS sin conexión libre.",
+)
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+
+
+def register_pool_metrics(engine: AsyncEngine) -> None:
+    # engine.pool se lee en cada scrape: dispose() lo reemplaza por uno nuevo
+    def _pool():
+        return engine.sync_engine.pool
+
+    registry.gauge(
+        "db_pool_size", "Conexiones base del pool (POOL_SIZE).",
+        function=lambda: _pool().size(),
+    )
+    registry.gauge(
+        "db_pool_max_connections", "Tope de conexiones del worker (POOL_SIZE + POOL_MAX_OVERFLOW).",
+        function=lambda: _pool().size() + max(0, getattr(_pool(), "_max_overflow", 0)),
+    )
+    registry.gauge(
+        "db_pool_checked_out", "Conexiones en uso.",
+        function=lambda: _pool().checkedout(),
+    )
+    registry.gauge(
+        "db_pool_idle", "Conexiones abiertas y libres en el pool.",
+        function=lambda: _pool().checkedin(),
+    )
+    registry.gauge(
+        "db_pool_overflow", "Conexiones abiertas por encima de POOL_SIZE.",
+        function=lambda: max(0, _pool().overflow()),
+    )
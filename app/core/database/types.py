@@ -0,0 +1,39 @@
+"""
+Tipos de columna compartidos por los modelos.
+"""
+from __future__ import annotations
+
+from typing import Any
+
+from sqlalchemy import JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import TypeDecorator
+
+from app.core.compression import pack_json, unpack_json
+
+
+class CompressedJSON(TypeDecorator):
+    """
+    JSON/JSONB que comprime en forma transparente los valores grandes si
+    `PAYLOAD_COMPRESSION` lo habilita (ver `app.core.compression`). Ojo: los
+    operadores JSON de Postgres no ven el contenido de un valor comprimido; donde
+    haya columna de codec, mejor bytea + codec.
+    """
+
+    impl = JSON
+    cache_ok = True
+
+    def __init__(self, binary: bool = False) -> None:
+        super().__init__()
+        self.binary = binary
+
+    def load_dialect_impl(self, dialect):
+        if self.binary and dialect.name == "postgresql":
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(JSON())
+
+    def process_bind_param(self, value: Any, dialect) -> Any:
+        return pack_json(value)
+
+    def process_result_value(self, value: Any, dialect) -> Any:
+        return unpack_json(value)
@@ -0,0 +1,101 @@
+"""
+Unidad de trabajo por request: UNA sesión compartida por `get_session`,
+`hmac_auth` e `IdempotentRoute` (vive en `request.state.uow`). `get_session`
+vive acá (y no en app.api.deps) para que core/security pueda depender de la
+sesión del request sin importar la capa api.
+
+Las escrituras de infraestructura (claim de idempotencia, last_used_at síncrono)
+no hacen commit propio: quedan en la transacción del request y se confirman con
+el primer commit del handler, o al cerrar la unidad de trabajo si el handler no
+escribió nada. Si el request falla, se descartan junto con lo demás. El nonce
+anti-replay es la excepción: se confirma al registrarse, en una transacción
+propia del store (ver nonce_store), para que un request fallido no se pueda
+reenviar.
+
+`relaxed_commit` confirma con `synchronous_commit = off`; solo para escrituras
+cuya pérdida ante una caída del servidor es tolerable (registro de un fallo o
+cuerpo de un stream en idempotencia, telemetría), nunca para el claim, el nonce
+ni la respuesta de un handler que confirmó.
+"""
+from __future__ import annotations
+
+from typing import AsyncGenerator, Optional
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database.db_async import AsyncSessionLocal
+
+
+async def relaxed_commit(session: AsyncSession) -> None:
+    await session.execute(text("SET LOCAL synchronous_commit = off"))
+    await session.commit()
+
+
+class UnitOfWork:
+    def __init__(self) -> None:
+        self._session: Optional[AsyncSession] = None
+        self.pending = False
+
+    @property
+    def session(self) -> AsyncSession:
+        # lazy: no toma conexión del pool hasta la primera consulta
+        if self._session is None:
+            self._session = AsyncSessionLocal()
+        return self._session
+
+    def owns(self, session: AsyncSession) -> bool:
+        return self._session is not None and self._session is session
+
+    def defer(self) -> None:
+        """Marca escrituras sin commit que deben confirmarse al cerrar."""
+        self.pending = True
+
+    async def commit(self) -> None:
+        if self._session is not None and self._session.in_transaction():
+            await self._session.commit()
+        self.pending = False
+
+    async def rollback(self) -> None:
+        if self._session is not None:
+            await self._session.rollback()
+        self.pending = False
+
+    async def close(self) -> None:
+        if self._session is None:
+            return
+        try:
+            if self.pending:
+                await self.commit()
+        finally:
+            await self._session.close()
+            self._session = None
+
+
+def get_unit_of_work(request: Request) -> Optional[UnitOfWork]:
+    return getattr(request.state, "uow", None)
+
+
+def begin_unit_of_work(request: Request) -> UnitOfWork:
+    uow = get_unit_of_work(request)
+    if uow is None:
+        uow = request.state.uow = UnitOfWork()
+    return uow
+
+
+async def get_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """Dependencia FastAPI: la sesión de la unidad de trabajo del request."""
+    # si IdempotentRoute ya abrió la unidad de trabajo, ella la cierra
+    uow = get_unit_of_work(request)
+    if uow is not None:
+        yield uow.session
+        return
+    uow = request.state.uow = UnitOfWork()
+    try:
+        yield uow.session
+    except Exception:
+        await uow.rollback()
+        raise
+    finally:
+        await uow.close()
@@ -0,0 +1,57 @@
+"""
+Contadores (por worker) de intentos de autenticación fallidos por IP de origen.
+
+Ventana fija de `AUTH_FAILURE_WINDOW_SECONDS`; con `AUTH_FAILURE_MAX_PER_IP > 0`
+la IP queda bloqueada (429 temprano) hasta que termine su ventana.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from app.core.config import settings
+from app.core.metrics import registry
+
+_MAX_TRACKED_IPS = 50_000
+
+AUTH_FAILURES = registry.counter("hmac_auth_failures_total", "Intentos de autenticación rechazados (401/403).")
+
+
+class AuthFailureTracker:
+    def __init__(self, max_ips: int = _MAX_TRACKED_IPS) -> None:
+        self._max_ips = max_ips
+        self._windows: OrderedDict[str, Tuple[float, int]] = OrderedDict()
+
+    @property
+    def window(self) -> int:
+        return int(getattr(settings.security, "AUTH_FAILURE_WINDOW_SECONDS", 60))
+
+    @property
+    def limit(self) -> int:
+        return int(getattr(settings.security, "AUTH_FAILURE_MAX_PER_IP", 0))
+
+    def record(self, ip: str) -> int:
+        now = time.monotonic()
+        start, n = self._windows.get(ip, (now, 0))
+        if start + self.window <= now:
+            start, n = now, 0
+        self._windows[ip] = (start, n + 1)
+        self._windows.move_to_end(ip)
+        while len(self._windows) > self._max_ips:
+            self._windows.popitem(last=False)
+        AUTH_FAILURES.inc()
+        return n + 1
+
+    def count(self, ip: str) -> int:
+        entry = self._windows.get(ip)
+        if entry is None or entry[0] + self.window <= time.monotonic():
+            return 0
+        return entry[1]
+
+    def is_blocked(self, ip: str) -> bool:
+        limit = self.limit
+        return limit > 0 and self.count(ip) >= limit
+
+
+auth_failures = AuthFailureTracker()
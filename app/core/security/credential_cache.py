@@ -0,0 +1,243 @@
+"""
+Cache en memoria (por worker) de credenciales HMAC: cliente, CIDRs y keys activas.
+
+- Entradas con TTL (`CREDENTIAL_CACHE_TTL_SECONDS`, 0 = deshabilitado).
+- Los repos `ic_*`, `ip_*` y `ck_*` llaman a `notify_credentials_changed` dentro de
+  su transacción; el NOTIFY llega a todos los workers vía `pg_listener`.
+- Cache negativo acotado de client ids / (client, kid) desconocidos, con TTL corto
+  (`NEGATIVE_CACHE_TTL_SECONDS`); se vacía ante cualquier NOTIFY (altas incluidas).
+- Cada invalidación sube `generation`: una carga que empezó antes de un NOTIFY
+  pudo leer la fila vieja, así que su resultado se devuelve pero no se guarda.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
+from app.core.database.pg_listener import PgListener, pg_notify
+from app.core.security.hmac_verifier import HmacVerifier
+from app.core.security.ip_matcher import CidrMatcher
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "bootstrap_app_credentials"
+
+
+@dataclass(frozen=True)
+class CachedKey:
+    cod: int
+    kid: str
+    secret: str
+    expires_at: Optional[datetime] = None
+
+    def is_valid(self, now: datetime) -> bool:
+        return self.expires_at is None or self.expires_at > now
+
+
+@dataclass
+class ClientCredentials:
+    cod: int
+    client_id: str
+    cidrs: list[str] = field(default_factory=list)
+    keys: Dict[str, CachedKey] = field(default_factory=dict)
+    rate_per_minute: Optional[int] = None
+    rate_burst: Optional[int] = None
+    ip_rules: CidrMatcher = field(init=False, repr=False)
+    verifier: HmacVerifier = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # se compilan una vez por carga; se reutilizan hasta la próxima invalidación
+        self.ip_rules = CidrMatcher(self.cidrs)
+        self.verifier = HmacVerifier(self.keys)
+
+    def active_key(self, kid: str) -> Optional[CachedKey]:
+        key = self.keys.get(kid)
+        if key is None or not key.is_valid(datetime.now(UTC)):
+            return None
+        return key
+
+
+# Una sola ida y vuelta: cliente + CIDRs + keys activas no expiradas.
+# Sentencia constante a nivel de módulo => SQLAlchemy reutiliza la compilación y
+# asyncpg el prepared statement cacheado por conexión.
+_CREDENTIALS_SQL = text(f"""
+    SELECT ic.cod_integration_client,
+           ic.rate_limit_per_minute,
+           ic.rate_limit_burst,
+           COALESCE(ips.cidrs, ARRAY[]::text[]) AS cidrs,
+           COALESCE(ks.cods, ARRAY[]::integer[]) AS key_cods,
+           COALESCE(ks.kids, ARRAY[]::text[]) AS key_kids,
+           COALESCE(ks.secrets, ARRAY[]::text[]) AS key_secrets,
+           COALESCE(ks.expires, ARRAY[]::timestamptz[]) AS key_expires
+    FROM {BOOTSTRAP_SCHEMA}.integration_clients ic
+    LEFT JOIN LATERAL (
+        SELECT array_agg(ip.cidr::text ORDER BY ip.cod_client_ip) AS cidrs
+        FROM {BOOTSTRAP_SCHEMA}.client_ips ip
+        WHERE ip.integration_client_cod = ic.cod_integration_client
+    ) ips ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT array_agg(ck.cod_client_key ORDER BY ck.cod_client_key) AS cods,
+               array_agg(ck.kid::text ORDER BY ck.cod_client_key) AS kids,
+               array_agg(ck.secret::text ORDER BY ck.cod_client_key) AS secrets,
+               array_agg(ck.expires_at ORDER BY ck.cod_client_key) AS expires
+        FROM {BOOTSTRAP_SCHEMA}.client_keys ck
+        WHERE ck.integration_client_cod = ic.cod_integration_client
+          AND ck.active
+          AND (ck.expires_at IS NULL OR ck.expires_at > NOW())
+    ) ks ON TRUE
+    WHERE ic.client_id = :cid
+      AND ic.active
+    LIMIT 1
+""")
+
+
+async def load_credentials(session: AsyncSession, client_id: str) -> Optional[ClientCredentials]:
+    res = await session.execute(_CREDENTIALS_SQL, {"cid": client_id})
+    row = res.first()
+    if row is None:
+        return None
+    cod, rate_per_minute, rate_burst, cidrs, key_cods, key_kids, key_secrets, key_expires = row
+    keys = {
+        kid: CachedKey(cod=ck_cod, kid=kid, secret=secret, expires_at=expires_at)
+        for ck_cod, kid, secret, expires_at in zip(key_cods, key_kids, key_secrets, key_expires)
+    }
+    return ClientCredentials(
+        cod=cod,
+        client_id=client_id,
+        cidrs=list(cidrs),
+        keys=keys,
+        rate_per_minute=rate_per_minute,
+        rate_burst=rate_burst,
+    )
+
+
+class NegativeCache:
+    """LRU acotado con TTL de ids que sabemos que no existen."""
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[tuple[str, ...], float] = OrderedDict()
+
+    @property
+    def ttl(self) -> int:
+        return int(getattr(settings.security, "NEGATIVE_CACHE_TTL_SECONDS", 30))
+
+    @property
+    def max_entries(self) -> int:
+        return int(getattr(settings.security, "NEGATIVE_CACHE_MAX_ENTRIES", 10_000))
+
+    def add(self, *key: str) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries[key] = time.monotonic() + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key: tuple[str, ...]) -> bool:
+        exp = self._entries.get(key)
+        if exp is None:
+            return False
+        if exp <= time.monotonic():
+            self._entries.pop(key, None)
+            return False
+        return True
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class CredentialCache:
+    def __init__(self) -> None:
+        self._entries: Dict[str, tuple[float, ClientCredentials]] = {}
+        self._by_cod: Dict[int, str] = {}
+        self.negative = NegativeCache()
+        self.generation = 0
+
+    @property
+    def ttl(self) -> int:
+        return int(getattr(settings.security, "CREDENTIAL_CACHE_TTL_SECONDS", 60))
+
+    def is_known_unknown(self, client_id: str, kid: Optional[str] = None) -> bool:
+        """True si el cliente (o su kid) ya se buscó hace poco y no existía."""
+        if (client_id,) in self.negative:
+            return True
+        return kid is not None and (client_id, kid) in self.negative
+
+    def mark_unknown_key(self, client_id: str, kid: str) -> None:
+        self.negative.add(client_id, kid)
+
+    async def get(self, session: AsyncSession, client_id: str) -> Optional[ClientCredentials]:
+        ttl = self.ttl
+        if ttl > 0:
+            hit = self._entries.get(client_id)
+            if hit is not None and hit[0] > time.monotonic():
+                return hit[1]
+        if (client_id,) in self.negative:
+            return None
+
+        generation = self.generation
+        creds = await load_credentials(session, client_id)
+        if generation != self.generation:
+            # hubo un NOTIFY durante la carga: lo leído puede ser anterior al cambio
+            return creds
+        if creds is None:
+            self.negative.add(client_id)
+        if ttl > 0:
+            if creds is None:
+                self._entries.pop(client_id, None)
+            else:
+                self._entries[client_id] = (time.monotonic() + ttl, creds)
+                self._by_cod[creds.cod] = client_id
+        return creds
+
+    def invalidate(self, integration_client_cod: Optional[int] = None) -> None:
+        # un alta de cliente/key puede volver válido cualquier id del cache negativo
+        self.generation += 1
+        self.negative.clear()
+        if integration_client_cod is None:
+            self.clear()
+            return
+        client_id = self._by_cod.pop(integration_client_cod, None)
+        if client_id is not None:
+            self._entries.pop(client_id, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+        self._by_cod.clear()
+        self.negative.clear()
+
+    def _on_notify(self, payload: str) -> None:
+        if payload == "*":
+            self.clear()
+            return
+        try:
+            self.invalidate(int(payload))
+        except ValueError:
+            logger.warning("Payload inválido en %s: %r", CHANNEL, payload)
+            self.clear()
+
+    def subscribe(self, listener: PgListener) -> None:
+        listener.listen(CHANNEL, self._on_notify, on_reconnect=self.clear)
+
+
+credential_cache = CredentialCache()
+
+
+async def notify_credentials_changed(db: AsyncSession, integration_client_cod: Optional[int]) -> None:
+    """
+    Invalida localmente y emite NOTIFY (se entrega al hacer commit `db`).
+    Llamar antes del commit del repo que modificó cliente/IPs/keys.
+    """
+    credential_cache.invalidate(integration_client_cod)
+    payload = "*" if integration_client_cod is None else str(integration_client_cod)
+    await pg_notify(db, CHANNEL, payload)
@@ -1,190 +1,268 @@
 from __future__ import annotations
 
-import base64
-import hashlib
-import hmac
-import ipaddress
 import time
+from contextlib import contextmanager
 from datetime import datetime, UTC
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, Optional
 
 from fastapi import Depends, Header, HTTPException, Request, status
-from sqlalchemy import select, func, text
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.metrics import registry
 from app.core.database import async_session
 from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
-from app.core.database.bootstrap_app_scheme.models import (
-    IntegrationClients,
-    ClientKeys,
-    ClientIPs,
-    SecurityNonces,
-)
+from app.core.database.unit_of_work import get_session, get_unit_of_work
+from app.core.security.auth_failures import auth_failures
+from app.core.security.credential_cache import credential_cache
+from app.core.security.key_usage import key_usage
+from app.core.security.nonce_store import get_nonce_store
+from app.core.security.rate_limit import enforce_rate_limit
+from app.core.security.request_body import buffered_body
 
 
-# -------- helpers --------
+AUTH_STAGE_SECONDS = registry.histogram(
+    "hmac_auth_stage_seconds",
+    "Duración de cada etapa de hmac_auth.",
+    ("stage",),
+)
 
-def _sha256_hex(b: bytes) -> str:
-    return hashlib.sha256(b).hexdigest()
 
-def _hmac_b64(secret: str, msg: str) -> str:
-    dig = hmac.new(secret.encode(), msg.encode(), hashlib.sha256).digest()
-    return base64.urlsafe_b64encode(dig).decode().rstrip("=")
+# -------- helpers --------
 
-def _client_ip(request: Request) -> str:
+def client_ip(request: Request) -> str:
     if getattr(settings.security, "TRUST_PROXY_HEADERS", False):
         xfwd = request.headers.get("x-forwarded-for")
         if xfwd:
             return xfwd.split(",")[0].strip()
     return request.client.host if request.client else "0.0.0.0"
 
-def _ip_allowed(ip: str, cidrs: list[str]) -> bool:
-    ip_obj = ipaddress.ip_address(ip)
-    for c in cidrs:
-        try:
-            if ip_obj in ipaddress.ip_network(c, strict=False):
-                return True
-        except ValueError:
-            continue
-    return False
-
 def _canonical_v1(method: str, path: str, query: str, cid: str, kid: str, ts: str, nonce: str, body_hash: str) -> str:
     # misma forma que tenías (no cambié el layout)
     return "\n".join([method, path, query, cid, kid, ts, nonce, body_hash])
 
-async def _get_session() -> AsyncSession:
-    async with async_session() as s:  # type: ignore
-        yield s
+class _StageTimer:
+    """Mide cada etapa; al final alimenta el histograma y el header Server-Timing."""
+
+    def __init__(self) -> None:
+        # sin label por cliente: cardinalidad y /metrics no debe enumerar clientes
+        self.timings: list[tuple[str, float]] = []
 
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - start))
+
+    def publish(self, request: Request) -> None:
+        for name, seconds in self.timings:
+            AUTH_STAGE_SECONDS.observe(seconds, stage=name)
+        server_timing = getattr(request.state, "server_timing", None)
+        if server_timing is None:
+            server_timing = request.state.server_timing = []
+        server_timing.extend((f"auth_{name}", seconds) for name, seconds in self.timings)
 
 # -------- dependencia principal --------
 
 async def hmac_auth(
     request: Request,
-    session: AsyncSession = Depends(_get_session),
+    session: AsyncSession = Depends(get_session),
     x_client_id: str = Header(..., alias="X-Client-Id"),
     x_key_id: str = Header(..., alias="X-Key-Id"),
     x_timestamp: Optional[str] = Header(None, alias="X-Timestamp"),
     x_nonce: Optional[str] = Header(None, alias="X-Nonce"),
     x_signature: str = Header(..., alias="X-Signature"),
+) -> Dict[str, Any]:
+    # ya autenticado por HmacAuthMiddleware (HMAC_AUTH_MODE=middleware)
+    principal = getattr(request.state, "hmac_principal", None)
+    if principal is not None:
+        return principal
+    return await _authenticate(
+        request, session, x_client_id, x_key_id, x_timestamp, x_nonce, x_signature
+    )
+
+
+async def authenticate_request(request: Request) -> Dict[str, Any]:
+    """
+    Variante sin inyección de dependencias (la usa HmacAuthMiddleware): lee los
+    headers directo del scope. La sesión es lazy: solo toma conexión del pool si
+    hay miss de cache o algún backend que escriba en la DB.
+    """
+    headers = request.headers
+    x_client_id = headers.get("x-client-id")
+    x_key_id = headers.get("x-key-id")
+    x_signature = headers.get("x-signature")
+    if not (x_client_id and x_key_id and x_signature):
+        auth_failures.record(client_ip(request))
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="missing authentication headers")
+    async with async_session() as session:  # type: ignore
+        return await _authenticate(
+            request,
+            session,
+            x_client_id,
+            x_key_id,
+            headers.get("x-timestamp"),
+            headers.get("x-nonce"),
+            x_signature,
+        )
+
+
+async def _authenticate(
+    request: Request,
+    session: AsyncSession,
+    x_client_id: str,
+    x_key_id: str,
+    x_timestamp: Optional[str],
+    x_nonce: Optional[str],
+    x_signature: str,
+) -> Dict[str, Any]:
+    ip = client_ip(request)
+    timer = _StageTimer()
+    try:
+        return await _verify(
+            request, session, timer, ip, x_client_id, x_key_id, x_timestamp, x_nonce, x_signature
+        )
+    except HTTPException as e:
+        if e.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN):
+            auth_failures.record(ip)
+        raise
+    finally:
+        timer.publish(request)
+
+
+async def _verify(
+    request: Request,
+    session: AsyncSession,
+    timer: _StageTimer,
+    ip: str,
+    x_client_id: str,
+    x_key_id: str,
+    x_timestamp: Optional[str],
+    x_nonce: Optional[str],
+    x_signature: str,
 ) -> Dict[str, Any]:
     # 0) Toggle global
     if not getattr(settings.security, "ENABLE_HMAC", True):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="HMAC disabled")
 
-    # 1) Cliente activo
-    res_client = await session.execute(
-        select(IntegrationClients).where(
-            IntegrationClients.clientId == x_client_id,
-            IntegrationClients.active.is_(True),
-        ).limit(1)
-    )
-    client = res_client.scalar_one_or_none()
+    # Con la sesión de la unidad de trabajo del request no se hace commit acá: ahí
+    # puede estar el claim de idempotencia sin confirmar, que sale junto con el
+    # handler (last_used_at síncrono también). El nonce se confirma aparte, en la
+    # transacción propia del store: un rollback del request no lo borra (replay).
+    uow = get_unit_of_work(request)
+    deferred = uow is not None and uow.owns(session)
+
+    # 1) Cliente activo (cache en memoria; a la DB solo si hay miss)
+    with timer.stage("client_lookup"):
+        client = await credential_cache.get(session, x_client_id)
     if not client:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="unknown client")
 
     # 2) IP contra CIDRs (si tiene reglas)
-    ip = _client_ip(request)
-    res_cidrs = await session.execute(
-        select(ClientIPs.cidr).where(ClientIPs.integrationClientCod == client.codIntegrationClient)
-    )
-    cidrs = [row[0] for row in res_cidrs.all()]
-    if cidrs and not _ip_allowed(ip, cidrs):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="ip not allowed")
+    ip_rule: Optional[str] = None
+    if client.ip_rules:
+        with timer.stage("cidr_check"):
+            ip_rule = client.ip_rules.match(ip)
+        if ip_rule is None:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="ip not allowed")
 
     # 3) Timestamp (si habilitado)
     must_check_ts = getattr(settings.security, "ENABLE_TIMESTAMP", True)
     if must_check_ts:
-        if not x_timestamp:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="missing timestamp")
-        try:
-            ts = int(x_timestamp)
-        except (TypeError, ValueError):
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="bad timestamp")
-        window = int(getattr(settings.security, "HMAC_WINDOW_SECONDS", 300))
-        skew = int(getattr(settings.security, "CLOCK_SKEW_SECONDS", 60))
-        now = int(time.time())
-        if ts < now - (window + skew) or ts > now + skew:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="timestamp expired")
-
-    # 4) Nonce anti-replay (si habilitado)
-    if getattr(settings.security, "ENABLE_NONCE", True):
-        if not x_nonce:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="missing nonce")
-        # ON CONFLICT DO NOTHING sobre (client_id, nonce)
-        stmt_nonce = text(f"""
-            INSERT INTO {BOOTSTRAP_SCHEMA}.security_nonces
-                (integration_client_cod, create_user, user_at, active, client_id, nonce, request_ts, received_at)
-            VALUES
-                (:ic, 0, 0, TRUE, :cid, :nonce, to_timestamp(:ts), NOW())
-            ON CONFLICT (client_id, nonce) DO NOTHING
-        """)
-        res = await session.execute(
-            stmt_nonce,
-            {
-                "ic": client.codIntegrationClient,
-                "cid": x_client_id,
-                "nonce": x_nonce,
-                "ts": int(x_timestamp) if x_timestamp else int(time.time()),
-            },
-        )
-        await session.commit()
-        if res.rowcount == 0:
-            # Nonce ya existe
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="replay detected")
+        with timer.stage("timestamp"):
+            if not x_timestamp:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="missing timestamp")
+            try:
+                ts = int(x_timestamp)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="bad timestamp")
+            window = int(getattr(settings.security, "HMAC_WINDOW_SECONDS", 300))
+            skew = int(getattr(settings.security, "CLOCK_SKEW_SECONDS", 60))
+            now = int(time.time())
+            if ts < now - (window + skew) or ts > now + skew:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="timestamp expired")
+
+    # 4) Nonce presente (se registra después de validar la firma)
+    check_nonce = getattr(settings.security, "ENABLE_NONCE", True)
+    if check_nonce and not x_nonce:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="missing nonce")
 
     # 5) Key activa por kid (y no expirada)
-    res_key = await session.execute(
-        select(ClientKeys).where(
-            ClientKeys.integrationClientCod == client.codIntegrationClient,
-            ClientKeys.kid == x_key_id,
-            ClientKeys.active.is_(True),
-            (ClientKeys.expiresAt.is_(None)) | (ClientKeys.expiresAt > func.now()),
-        ).limit(1)
-    )
-    key = res_key.scalar_one_or_none()
+    with timer.stage("key_lookup"):
+        key = client.active_key(x_key_id)
     if not key:
+        credential_cache.mark_unknown_key(x_client_id, x_key_id)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="key not found or inactive/expired")
 
     # 6) Firma HMAC
-    # lee y reinyecta body para que el endpoint pueda usarlo
-    body = await request.body()
-    async def _receive():
-        return {"type": "http.request", "body": body, "more_body": False}
-    request._receive = _receive
-    request.state.raw_body = body
-
-    method = request.method.upper()
-    path = request.url.path
-    query = request.url.query or ""   # usa exactamente la query como viene
-    body_hash = _sha256_hex(body)
-
-    ts_for_sig = x_timestamp or "" if must_check_ts else ""
-    nonce_for_sig = x_nonce or "" if getattr(settings.security, "ENABLE_NONCE", True) else ""
-
-    # MISMA cadena que usabas:
-    signing_string = _canonical_v1(method, path, query, x_client_id, x_key_id, ts_for_sig, nonce_for_sig, body_hash)
-    expected_sig = _hmac_b64(key.secret, signing_string)
-    # print("HOLA")
-    # print(signing_string)
-    print(expected_sig) 
-    print(x_signature)
-    if not hmac.compare_digest(expected_sig, x_signature or ""):
+    with timer.stage("signature"):
+        # body + SHA-256 ya calculados por BodyBufferMiddleware (compartido con idempotencia)
+        body, body_hash = await buffered_body(request)
+
+        method = request.method.upper()
+        path = request.url.path
+        query = request.url.query or ""   # usa exactamente la query como viene
+
+        ts_for_sig = x_timestamp or "" if must_check_ts else ""
+        nonce_for_sig = x_nonce or "" if check_nonce else ""
+
+        # MISMA cadena que usabas:
+        signing_string = _canonical_v1(method, path, query, x_client_id, x_key_id, ts_for_sig, nonce_for_sig, body_hash)
+        # estado HMAC pre-keyed por (cliente, kid), clonado por request
+        valid = client.verifier.verify(key.kid, signing_string, x_signature)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid signature")
 
-    # 7) last_used_at
-    await session.execute(
-        text(f"UPDATE {BOOTSTRAP_SCHEMA}.client_keys SET last_used_at = NOW() WHERE cod_client_key = :i"),
-        {"i": key.codClientKey},
-    )
-    await session.commit()
+    # 7) Nonce anti-replay: solo requests con firma válida escriben en el store, y
+    # siempre en su propia transacción (commit=True), nunca en la del request
+    if check_nonce:
+        with timer.stage("nonce"):
+            accepted = await get_nonce_store().register(
+                session,
+                integration_client_cod=client.cod,
+                client_id=x_client_id,
+                nonce=x_nonce,
+                # sin ENABLE_TIMESTAMP el header no va firmado: manda la hora del servidor
+                request_ts=int(x_timestamp) if must_check_ts else int(time.time()),
+                commit=True,
+            )
+        if not accepted:
+            # Nonce ya existe
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="replay detected")
+
+    # 8) Rate limit por cliente (bucket compartido entre workers del nodo)
+    with timer.stage("rate_limit"):
+        enforce_rate_limit(
+            request,
+            "client",
+            x_client_id,
+            client.rate_per_minute or settings.security.RATE_LIMIT_CLIENT_PER_MINUTE,
+            client.rate_burst or settings.security.RATE_LIMIT_CLIENT_BURST,
+        )
+
+    # 9) last_used_at (write-behind por lotes; síncrono si KEY_USAGE_FLUSH_SECONDS=0)
+    with timer.stage("last_used"):
+        if key_usage.enabled:
+            key_usage.record(key.cod)
+        else:
+            await session.execute(
+                text(f"UPDATE {BOOTSTRAP_SCHEMA}.client_keys SET last_used_at = NOW() WHERE cod_client_key = :i"),
+                {"i": key.cod},
+            )
+            if deferred:
+                uow.defer()
+            else:
+                await session.commit()
 
     # retorno útil para tu endpoint si lo necesita
     return {
         "client_id": x_client_id,
         "kid": x_key_id,
-        "integration_client_cod": client.codIntegrationClient,
+        "integration_client_cod": client.cod,
         "ip": ip,
+        "ip_rule": ip_rule,
         "body": body,
     }
@@ -0,0 +1,54 @@
+"""
+Verificador HMAC por cliente con estado keyed preparado por kid.
+
+`hmac.new(secret)` (encode + padding/hash de la key) se hace una sola vez por
+(cliente, kid); cada verificación clona ese estado con `.copy()`. Vive dentro de
+`ClientCredentials`, así que una rotación/baja de key (NOTIFY o TTL) descarta el
+verificador completo. Acepta cualquier kid activo del cliente a la vez, lo que
+permite convivir key vieja y nueva durante una rotación.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+from datetime import datetime, UTC
+from typing import TYPE_CHECKING, Dict, Mapping, Optional
+
+if TYPE_CHECKING:
+    from app.core.security.credential_cache import CachedKey
+
+
+def _b64(digest: bytes) -> str:
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+class HmacVerifier:
+    def __init__(self, keys: Mapping[str, "CachedKey"]) -> None:
+        self._keys = keys
+        self._states: Dict[str, "hmac.HMAC"] = {}
+
+    def _state(self, kid: str) -> Optional["hmac.HMAC"]:
+        state = self._states.get(kid)
+        if state is None:
+            key = self._keys.get(kid)
+            if key is None:
+                return None
+            state = self._states[kid] = hmac.new(key.secret.encode(), digestmod=hashlib.sha256)
+        return state
+
+    def sign(self, kid: str, message: str) -> Optional[str]:
+        key = self._keys.get(kid)
+        if key is None or not key.is_valid(datetime.now(UTC)):
+            self._states.pop(kid, None)
+            return None
+        state = self._state(kid)
+        if state is None:
+            return None
+        mac = state.copy()
+        mac.update(message.encode())
+        return _b64(mac.digest())
+
+    def verify(self, kid: str, message: str, signature: str) -> bool:
+        expected = self.sign(kid, message)
+        return expected is not None and hmac.compare_digest(expected, signature or "")
@@ -1,16 +1,27 @@
 from __future__ import annotations
 
 import json
+import os
+import socket
+import uuid
 from datetime import datetime, UTC
-from typing import Any, Dict, Optional, TypedDict
+from typing import Any, Dict, List, Optional, Sequence, TypedDict
 
 from fastapi import HTTPException, status
-from sqlalchemy import select, text
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.compression import IDENTITY, OMITTED, compress, decompress, dumps_json, pack_json, unpack_json
 from app.core.config import settings
 from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
-from app.core.database.bootstrap_app_scheme.models import IdempotencyKeys
+from app.core.database.unit_of_work import relaxed_commit
+from app.core.security.idempotency_cache import idempotency_cache
+from app.core.security.idempotency_waiters import (
+    completion_waiters,
+    notify_completed,
+    notify_completed_many,
+    wait_seconds,
+)
 
 
 class IdemResult(TypedDict, total=False):
@@ -18,7 +29,14 @@ class IdemResult(TypedDict, total=False):
     cached: bool
     cached_status: Optional[int]
     cached_body: Optional[Dict[str, Any]]
+    # IDEMPOTENCY_STORE_RAW: respuesta original tal cual
+    cached_raw: Optional[bytes]
+    cached_media_type: Optional[str]
+    cached_headers: Optional[Dict[str, str]]
     in_progress: bool
+    created: bool
+    reclaimed: bool
+    lease_owner: Optional[str]
 
 
 def _json_or_none(data: Any) -> str | None:
@@ -30,81 +48,420 @@ def _json_or_none(data: Any) -> str | None:
         return None
 
 
+# Claim en una sola ida y vuelta. DO UPDATE en vez de DO NOTHING para que
+# RETURNING también devuelva la fila existente; `xmax = 0` solo en filas recién
+# insertadas => created. Si la fila está abandonada (lease vencido, o marcada
+# por el sweeper como 'fail' sin http_status) el mismo UPDATE la reclama para
+# este request; si no, el SET es un no-op. `owned` = el lease quedó a nuestro nombre.
+# Un claim 'processing' con http_status ya confirmó su handler (ver mark_handled):
+# no se reclama aunque venza el lease.
+_RECLAIMABLE = """(
+    (ik.status = 'processing' AND ik.http_status IS NULL
+     AND COALESCE(ik.lease_expires_at, ik.create_date + make_interval(secs => :lease)) < NOW())
+    OR (ik.status = 'fail' AND ik.http_status IS NULL)
+)"""
+
+#
+# El claim sin confirmar vive en la transacción del request (unidad de trabajo):
+# un duplicado concurrente esperaría en el índice único hasta el commit, con una
+# conexión del pool tomada. Por eso antes pide un lock advisory por clave
+# (pg_try_advisory_xact_lock, no bloquea; se suelta con la transacción): si lo
+# tiene otro, el INSERT no escribe nada y no se devuelve fila => ver _PEEK_SQL.
+# Una colisión de hashtext entre dos claves en vuelo solo da un in_progress de más.
+_CLAIM_LOCK_SPACE = 0x69646B79  # "idky"; espacio de dos int4, aparte de los nonces
+
+_CLAIM_SQL = text(f"""
+    WITH lock AS (
+        SELECT pg_try_advisory_xact_lock(
+            {_CLAIM_LOCK_SPACE}, hashtext(CAST(:cid AS text) || ':' || CAST(:k AS text))
+        ) AS got
+    )
+    INSERT INTO {BOOTSTRAP_SCHEMA}.idempotency_keys AS ik
+        (create_user, user_at, active, client_id, key, request_fingerprint, status,
+         lease_owner, lease_expires_at)
+    SELECT 0, 0, TRUE, :cid, :k, :fp, 'processing',
+           :owner, NOW() + make_interval(secs => :lease)
+    FROM lock
+    WHERE lock.got
+    ON CONFLICT (client_id, key) DO UPDATE SET
+        status = CASE WHEN {_RECLAIMABLE} THEN 'processing' ELSE ik.status END,
+        request_fingerprint = CASE WHEN {_RECLAIMABLE} THEN EXCLUDED.request_fingerprint ELSE ik.request_fingerprint END,
+        lease_owner = CASE WHEN {_RECLAIMABLE} THEN EXCLUDED.lease_owner ELSE ik.lease_owner END,
+        lease_expires_at = CASE WHEN {_RECLAIMABLE} THEN EXCLUDED.lease_expires_at ELSE ik.lease_expires_at END,
+        update_date = CASE WHEN {_RECLAIMABLE} THEN NOW() ELSE ik.update_date END
+    RETURNING ik.cod_idempotency_keys, ik.status, ik.http_status, ik.response_json,
+              ik.response_body, ik.response_codec, ik.response_media_type, ik.response_headers,
+              (ik.xmax = 0) AS created,
+              (ik.lease_owner IS NOT DISTINCT FROM CAST(:owner AS varchar)) AS owned
+""")
+
+# La clave la tiene otro request: se lee lo confirmado, sin esperar ni tocar la fila.
+_PEEK_SQL = text(f"""
+    SELECT cod_idempotency_keys, status, http_status, response_json,
+           response_body, response_codec, response_media_type, response_headers,
+           FALSE AS created, FALSE AS owned
+    FROM {BOOTSTRAP_SCHEMA}.idempotency_keys
+    WHERE client_id = :cid AND key = :k
+""")
+
+_FINALIZE_SQL = text(f"""
+    UPDATE {BOOTSTRAP_SCHEMA}.idempotency_keys
+    SET response_json = CAST(:data AS jsonb),
+        response_body = :body,
+        response_codec = :codec,
+        response_media_type = :mt,
+        response_headers = CAST(:hdr AS jsonb),
+        http_status = :st,
+        status = CASE WHEN :st BETWEEN 200 AND 299 THEN 'success' ELSE 'fail' END,
+        lease_expires_at = NULL,
+        update_date = NOW()
+    WHERE cod_idempotency_keys = :id
+      AND (CAST(:owner AS varchar) IS NULL OR lease_owner = :owner)
+""")
+
+# El handler de un stream confirmó pero el cuerpo todavía no existe: queda su
+# status con codec OMITTED y la fila sigue 'processing' (los reintentos esperan).
+_MARK_HANDLED_SQL = text(f"""
+    UPDATE {BOOTSTRAP_SCHEMA}.idempotency_keys
+    SET http_status = :st,
+        response_codec = :codec,
+        update_date = NOW()
+    WHERE cod_idempotency_keys = :id
+      AND (CAST(:owner AS varchar) IS NULL OR lease_owner = :owner)
+""")
+
+
+# respuesta sin cuerpo guardado (stream cortado o mayor al tope de captura): el
+# replay no puede devolverla y no debe parecer un éxito vacío
+NOT_STORED_STATUS = status.HTTP_409_CONFLICT
+
+
+def _not_stored_body(http_status: int) -> Dict[str, Any]:
+    return {"detail": "response not stored", "original_status": int(http_status)}
+
+
+def new_lease_owner() -> str:
+    return f"{socket.gethostname()[:32]}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+
+def lease_seconds() -> float:
+    return float(getattr(settings.security, "IDEMPOTENCY_LEASE_SECONDS", 120))
+
+
 async def begin_idempotency(
     session: AsyncSession,
     *,
     client_id: str,
     key: str,
     request_fingerprint: str,
+    commit: bool = True,
+    lease_owner: Optional[str] = None,
 ) -> IdemResult:
     """
     Intenta crear registro 'processing'. Si ya existe:
       - si termino, devuelve cached=True con respuesta
       - si sigue en curso, in_progress=True (puede responder con Conflicto|Repeticion)
+
+    Con commit=False el claim queda en la transacción del request (unidad de
+    trabajo); un duplicado concurrente no espera ese commit: encuentra el lock
+    advisory de la clave tomado y recibe in_progress (o la respuesta, si ya
+    estaba confirmada).
+
+    El claim lleva lease (`IDEMPOTENCY_LEASE_SECONDS`) y dueño; un registro
+    abandonado se reclama en la misma sentencia (reclaimed=True) y el request
+    sigue como si lo hubiera creado.
     """
     if not getattr(settings.security, "ENABLE_IDEMPOTENCY", True):
         return {"record_id": None, "cached": False, "in_progress": False}
-    ins = text(f"""
-        INSERT INTO {BOOTSTRAP_SCHEMA}.idempotency_keys
-            (create_user, user_at, active, client_id, key, request_fingerprint, status)
-        VALUES
-            (0, 0, TRUE, :cid, :k, :fp, 'processing')
-        ON CONFLICT (client_id, key) DO NOTHING
-    """)
-    res = await session.execute(ins, {"cid": client_id, "k": key, "fp": request_fingerprint})
-    await session.commit()
-    if res.rowcount == 1:
-        row = await session.execute(
-            select(IdempotencyKeys.codIdempotencyKeys).where(
-                IdempotencyKeys.clientId == client_id,
-                IdempotencyKeys.key == key
-            ).limit(1)
-        )
-        rec_id = row.scalar_one()
-        return {"record_id": rec_id, "cached": False, "in_progress": False}
-
-    q = await session.execute(
-        select(IdempotencyKeys).where(
-            IdempotencyKeys.clientId == client_id,
-            IdempotencyKeys.key == key,
-        ).limit(1)
+    owner = lease_owner or new_lease_owner()
+    res = await session.execute(
+        _CLAIM_SQL,
+        {"cid": client_id, "k": key, "fp": request_fingerprint, "owner": owner, "lease": lease_seconds()},
     )
+    row = res.first()
+    if row is None:
+        # lock advisory en manos de otro request
+        row = (await session.execute(_PEEK_SQL, {"cid": client_id, "k": key})).first()
+    if commit:
+        await session.commit()
+    if row is None:
+        # el claim del otro todavía no se confirmó
+        return {"record_id": None, "cached": False, "in_progress": True, "created": False}
+    (rec_id, status_, http_status, response_json, response_body, codec, media_type, headers,
+     created, owned) = row
 
-    row = q.scalar_one_or_none()
-    if not row:
-        return {"record_id": None, "cached": False, "in_progress": False}
+    if owned:
+        return {
+            "record_id": rec_id,
+            "cached": False,
+            "in_progress": False,
+            "created": bool(created),
+            "reclaimed": not created,
+            "lease_owner": owner,
+        }
 
-    if row.status != "processing" and row.httpStatus is not None:
+    if status_ != "processing" and http_status is not None and codec == OMITTED:
+        body = _not_stored_body(http_status)
+        idempotency_cache.put(client_id, key, NOT_STORED_STATUS, body)
         return {
-            "record_id": row.codIdempotencyKeys,
+            "record_id": rec_id,
             "cached": True,
-            "cached_status": int(row.httpStatus),
-            "cached_body": row.responseJson or {},
+            "cached_status": NOT_STORED_STATUS,
+            "cached_body": body,
             "in_progress": False,
+            "created": False,
         }
 
-    return {"record_id": row.codIdempotencyKeys, "cached": False, "in_progress": True}
+    if status_ != "processing" and http_status is not None and response_body is not None:
+        response_body = decompress(codec, bytes(response_body))
+        idempotency_cache.put_raw(client_id, key, int(http_status), response_body, media_type, headers)
+        return {
+            "record_id": rec_id,
+            "cached": True,
+            "cached_status": int(http_status),
+            "cached_raw": response_body,
+            "cached_media_type": media_type,
+            "cached_headers": headers or {},
+            "in_progress": False,
+            "created": False,
+        }
 
+    if status_ != "processing" and http_status is not None:
+        # sobre de escape, o comprimido en filas anteriores a guardarlo en response_body
+        response_json = unpack_json(response_json)
+        idempotency_cache.put(client_id, key, int(http_status), response_json or {})
+        return {
+            "record_id": rec_id,
+            "cached": True,
+            "cached_status": int(http_status),
+            "cached_body": response_json or {},
+            "in_progress": False,
+            "created": False,
+        }
 
-async def finalize_idempotency(
+    return {"record_id": rec_id, "cached": False, "in_progress": True, "created": False}
+
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def _compressed_json(data: Any) -> tuple[str, Optional[bytes]]:
+    """(codec, bytes) si conviene comprimir el JSON; (identity, None) si va en response_json."""
+    if data is None:
+        return IDENTITY, None
+    try:
+        codec, out = compress(dumps_json(data))
+    except (TypeError, ValueError):
+        return IDENTITY, None
+    return (codec, out) if codec != IDENTITY else (IDENTITY, None)
+
+
+def _finalize_params(
+    *,
+    record_id: int,
+    http_status: int,
+    response_obj: Dict[str, Any] | None,
+    response_body: Optional[bytes],
+    media_type: Optional[str],
+    headers: Optional[Dict[str, str]],
+    lease_owner: Optional[str],
+    omitted: bool,
+) -> Dict[str, Any]:
+    raw = omitted or response_body is not None
+    data = None
+    if omitted:
+        codec, stored_body = OMITTED, b""
+    elif raw:
+        codec, stored_body = compress(response_body)
+    else:
+        codec, stored_body = _compressed_json(response_obj)
+        if codec == IDENTITY:
+            # sin comprimir, pero escapado si trae el marcador (se lee con unpack_json)
+            data = _json_or_none(pack_json(response_obj, IDENTITY))
+        else:
+            # JSON grande comprimido: a la columna bytea con su codec, replay como bytes
+            raw, media_type, headers = True, JSON_MEDIA_TYPE, None
+    return {
+        "data": data,
+        "body": stored_body,
+        "codec": None if codec == IDENTITY else codec,
+        "mt": media_type if raw else None,
+        "hdr": _json_or_none(headers) if raw else None,
+        "st": int(http_status),
+        "id": int(record_id),
+        "owner": lease_owner,
+    }
+
+
+def publish_finalized(item: Dict[str, Any]) -> None:
+    """
+    Solo después del commit: despierta reintentos locales y llena el cache.
+    `item` lleva los argumentos de `finalize_idempotency`; sin client_id/key no hace nada.
+    """
+    client_id, key = item.get("client_id"), item.get("key")
+    if client_id is None or key is None:
+        return
+    http_status = int(item["http_status"])
+    completion_waiters.signal(client_id, key)
+    if item.get("omitted"):
+        idempotency_cache.put(client_id, key, NOT_STORED_STATUS, _not_stored_body(http_status))
+        return
+    if item.get("response_body") is not None:
+        idempotency_cache.put_raw(
+            client_id, key, http_status, item["response_body"], item.get("media_type"), item.get("headers")
+        )
+    else:
+        idempotency_cache.put(client_id, key, http_status, item.get("response_obj"))
+
+
+async def mark_handled(
     session: AsyncSession,
     *,
     record_id: Optional[int],
     http_status: int,
-    response_obj: Dict[str, Any] | None,
+    lease_owner: Optional[str] = None,
 ) -> None:
+    """
+    Sin commit: viaja en la transacción del handler, así el claim nunca queda
+    confirmado sin constancia de que el handler corrió. El finalize posterior
+    guarda el cuerpo; si se pierde, el sweeper cierra la fila como no guardada.
+    """
     if not (getattr(settings.security, "ENABLE_IDEMPOTENCY", True) and record_id):
         return
-    upd = text(f"""
-        UPDATE {BOOTSTRAP_SCHEMA}.idempotency_keys
-        SET response_json = :data::jsonb,
-            http_status = :st,
-            status = CASE WHEN :st BETWEEN 200 AND 299 THEN 'success' ELSE 'fail' END,
-            update_date = NOW()
-        WHERE cod_idempotency_keys = :id
-    """)
     await session.execute(
-        upd,
-        {"data": _json_or_none(response_obj), "st": int(http_status), "id": int(record_id)},
+        _MARK_HANDLED_SQL,
+        {"st": int(http_status), "codec": OMITTED, "id": int(record_id), "owner": lease_owner},
+    )
+
+
+async def finalize_idempotency(
+    session: AsyncSession,
+    *,
+    record_id: Optional[int],
+    http_status: int,
+    response_obj: Dict[str, Any] | None,
+    relaxed: bool = False,
+    commit: bool = True,
+    client_id: Optional[str] = None,
+    key: Optional[str] = None,
+    response_body: Optional[bytes] = None,
+    media_type: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    lease_owner: Optional[str] = None,
+    omitted: bool = False,
+) -> bool:
+    """
+    relaxed=True confirma con synchronous_commit=off (ver unit_of_work).
+    Con commit=False la escritura queda en la transacción de `session` (la del
+    handler: sale durable junto con sus escrituras) y quien confirma llama a
+    `publish_finalized` después del commit. Devuelve si se escribió el registro.
+    Con client_id/key, la respuesta confirmada queda en el cache en memoria.
+    Con response_body se guardan los bytes exactos (+ media type y headers) y
+    response_obj se ignora. Con lease_owner solo se escribe si el lease sigue
+    siendo nuestro (si otro request lo reclamó, su resultado manda).
+    Con omitted=True el cuerpo no se capturó (stream cortado o mayor a
+    IDEMPOTENCY_CAPTURE_MAX_BYTES): se guarda el status original, y el replay
+    responde NOT_STORED_STATUS ("response not stored") en vez de un éxito vacío.
+    """
+    if not (getattr(settings.security, "ENABLE_IDEMPOTENCY", True) and record_id):
+        return False
+    res = await session.execute(
+        _FINALIZE_SQL,
+        _finalize_params(
+            record_id=record_id,
+            http_status=http_status,
+            response_obj=response_obj,
+            response_body=response_body,
+            media_type=media_type,
+            headers=headers,
+            lease_owner=lease_owner,
+            omitted=omitted,
+        ),
     )
-    await session.commit()
+    # rowcount 0 => el claim se descartó con el rollback del request
+    written = res.rowcount == 1
+    if written and client_id is not None and key is not None and wait_seconds() > 0:
+        await notify_completed(session, client_id, key)
+    if not commit:
+        return written
+    if relaxed:
+        await relaxed_commit(session)
+    else:
+        await session.commit()
+    if written:
+        publish_finalized({
+            "client_id": client_id,
+            "key": key,
+            "http_status": http_status,
+            "response_obj": response_obj,
+            "response_body": response_body,
+            "media_type": media_type,
+            "headers": headers,
+            "omitted": omitted,
+        })
+    return written
+
+
+# un solo texto para cualquier tamaño de lote (cacheable como sentencia preparada);
+# jsonb viaja como text[] y se castea por fila
+_FINALIZE_MANY_SQL = text(f"""
+    UPDATE {BOOTSTRAP_SCHEMA}.idempotency_keys AS ik
+    SET response_json = CAST(v.data AS jsonb),
+        response_body = v.body,
+        response_codec = v.codec,
+        response_media_type = v.mt,
+        response_headers = CAST(v.hdr AS jsonb),
+        http_status = v.st,
+        status = CASE WHEN v.st BETWEEN 200 AND 299 THEN 'success' ELSE 'fail' END,
+        lease_expires_at = NULL,
+        update_date = NOW()
+    FROM unnest(
+        CAST(:id AS integer[]), CAST(:data AS text[]), CAST(:body AS bytea[]),
+        CAST(:codec AS varchar[]), CAST(:mt AS varchar[]), CAST(:hdr AS text[]),
+        CAST(:st AS integer[]), CAST(:owner AS varchar[])
+    ) AS v(id, data, body, codec, mt, hdr, st, owner)
+    WHERE ik.cod_idempotency_keys = v.id
+      AND (v.owner IS NULL OR ik.lease_owner = v.owner)
+    RETURNING ik.cod_idempotency_keys
+""")
+
+_FINALIZE_COLUMNS = ("id", "data", "body", "codec", "mt", "hdr", "st", "owner")
+
+
+async def finalize_idempotency_many(session: AsyncSession, items: Sequence[Dict[str, Any]]) -> int:
+    """
+    Varios finalize en un solo `UPDATE ... FROM unnest(...)` + un commit relajado.
+    Cada item lleva los mismos argumentos que `finalize_idempotency` (sin session
+    ni relaxed). Devuelve cuántos registros se escribieron.
+    """
+    if not getattr(settings.security, "ENABLE_IDEMPOTENCY", True):
+        return 0
+    items = [it for it in items if it.get("record_id")]
+    if not items:
+        return 0
+    params: Dict[str, List[Any]] = {name: [] for name in _FINALIZE_COLUMNS}
+    for it in items:
+        row = _finalize_params(
+            record_id=it["record_id"],
+            http_status=it["http_status"],
+            response_obj=it.get("response_obj"),
+            response_body=it.get("response_body"),
+            media_type=it.get("media_type"),
+            headers=it.get("headers"),
+            lease_owner=it.get("lease_owner"),
+            omitted=bool(it.get("omitted")),
+        )
+        for name in _FINALIZE_COLUMNS:
+            params[name].append(row[name])
+    res = await session.execute(_FINALIZE_MANY_SQL, params)
+    written = {row[0] for row in res.all()}
+    done = [
+        it for it in items
+        if int(it["record_id"]) in written and it.get("client_id") is not None and it.get("key") is not None
+    ]
+    if done and wait_seconds() > 0:
+        await notify_completed_many(session, [(it["client_id"], it["key"]) for it in done])
+    await relaxed_commit(session)
+    for it in done:
+        publish_finalized(it)
+    return len(written)
@@ -0,0 +1,180 @@
+"""
+Cache en memoria (por worker) de respuestas idempotentes ya completadas.
+
+- Clave `(client_id, key)`; valor: status + body ya serializado (+ media type y
+  headers guardados con IDEMPOTENCY_STORE_RAW).
+- LRU acotado por bytes (`IDEMPOTENCY_CACHE_MAX_BYTES`, 0 = deshabilitado);
+  respuestas más grandes que `IDEMPOTENCY_CACHE_MAX_ENTRY_BYTES` no se cachean.
+- TTL corto (`IDEMPOTENCY_CACHE_TTL_SECONDS`) como red de seguridad.
+- Se llena en `finalize_idempotency` y al leer un registro completado en
+  `begin_idempotency`; los repos que modifican/borran registros llaman a
+  `notify_idempotency_changed` y el NOTIFY invalida en todos los workers.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database.pg_listener import PgListener, pg_notify
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "bootstrap_app_idempotency"
+
+_ENTRY_OVERHEAD = 200  # bytes aprox. de tuplas/objetos por entrada
+
+CacheKey = Tuple[str, str]
+
+CACHE_LOOKUPS = registry.counter(
+    "idempotency_cache_lookups_total", "Consultas al cache de respuestas idempotentes.", ("result",)
+)
+
+
+def render_json(data: Any) -> bytes:
+    # mismo formato que JSONResponse.render
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    status_code: int
+    body: bytes
+    expires_at: float
+    media_type: str = "application/json"
+    headers: Optional[Dict[str, str]] = None
+
+    @property
+    def size(self) -> int:
+        extra = sum(len(k) + len(v) for k, v in (self.headers or {}).items())
+        return len(self.body) + extra + _ENTRY_OVERHEAD
+
+
+class IdempotencyResponseCache:
+    def __init__(self) -> None:
+        self._entries: OrderedDict[CacheKey, CachedResponse] = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return int(getattr(settings.security, "IDEMPOTENCY_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+    @property
+    def max_entry_bytes(self) -> int:
+        return int(getattr(settings.security, "IDEMPOTENCY_CACHE_MAX_ENTRY_BYTES", 256 * 1024))
+
+    @property
+    def ttl(self) -> int:
+        return int(getattr(settings.security, "IDEMPOTENCY_CACHE_TTL_SECONDS", 300))
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, client_id: str, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get((client_id, key))
+        if entry is None:
+            CACHE_LOOKUPS.inc(result="miss")
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove((client_id, key))
+            CACHE_LOOKUPS.inc(result="miss")
+            return None
+        self._entries.move_to_end((client_id, key))
+        CACHE_LOOKUPS.inc(result="hit")
+        return entry
+
+    def put(self, client_id: str, key: str, status_code: int, data: Any) -> None:
+        if self.max_bytes <= 0 or self.ttl <= 0:
+            return
+        try:
+            body = render_json(data if data is not None else {})
+        except (TypeError, ValueError):
+            return
+        self._store(client_id, key, CachedResponse(int(status_code), body, time.monotonic() + self.ttl))
+
+    def put_raw(
+        self,
+        client_id: str,
+        key: str,
+        status_code: int,
+        body: bytes,
+        media_type: Optional[str],
+        headers: Optional[Dict[str, str]],
+    ) -> None:
+        if self.max_bytes <= 0 or self.ttl <= 0:
+            return
+        entry = CachedResponse(
+            int(status_code),
+            bytes(body),
+            time.monotonic() + self.ttl,
+            media_type or "application/octet-stream",
+            dict(headers) if headers else None,
+        )
+        self._store(client_id, key, entry)
+
+    def _store(self, client_id: str, key: str, entry: CachedResponse) -> None:
+        if entry.size > min(self.max_entry_bytes, self.max_bytes):
+            return
+        self._remove((client_id, key))
+        self._entries[(client_id, key)] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+
+    def _remove(self, ck: CacheKey) -> None:
+        old = self._entries.pop(ck, None)
+        if old is not None:
+            self._bytes -= old.size
+
+    def invalidate(self, client_id: str, key: str) -> None:
+        self._remove((client_id, key))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _on_notify(self, payload: str) -> None:
+        if payload == "*":
+            self.clear()
+            return
+        try:
+            client_id, key = json.loads(payload)
+        except (ValueError, TypeError):
+            logger.warning("Payload inválido en %s: %r", CHANNEL, payload)
+            self.clear()
+            return
+        self.invalidate(client_id, key)
+
+    def subscribe(self, listener: PgListener) -> None:
+        listener.listen(CHANNEL, self._on_notify, on_reconnect=self.clear)
+
+
+idempotency_cache = IdempotencyResponseCache()
+
+registry.gauge(
+    "idempotency_cache_bytes", "Bytes ocupados por el cache de respuestas idempotentes.",
+    function=lambda: idempotency_cache.size_bytes,
+)
+
+
+async def notify_idempotency_changed(db: AsyncSession, client_id: Optional[str] = None, key: Optional[str] = None) -> None:
+    """Invalida local y encola el NOTIFY (se entrega al commit). Sin clave => todo."""
+    if client_id is None or key is None:
+        idempotency_cache.clear()
+        payload = "*"
+    else:
+        idempotency_cache.invalidate(client_id, key)
+        payload = json.dumps([client_id, key])
+    await pg_notify(db, CHANNEL, payload)
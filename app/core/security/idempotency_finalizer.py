@@ -0,0 +1,218 @@
+"""
+Finalize idempotente fuera del camino de la respuesta.
+
+IdempotentRoute entrega a una cola acotada en memoria lo que puede perderse sin
+re-ejecutar un handler (el registro de un fallo, cuyo rollback no dejó nada
+confirmado, y el cuerpo de un stream, cuyo status ya salió con el commit del
+handler) y responde; una tarea de fondo junta hasta
+`IDEMPOTENCY_FINALIZE_BATCH_MAX` registros (o lo que llegue en
+`IDEMPOTENCY_FINALIZE_WINDOW_MS`) y los escribe con un solo
+`UPDATE ... FROM unnest(...)` y un commit relajado.
+
+- Cola llena (`IDEMPOTENCY_FINALIZE_QUEUE_MAX`) o worker detenido: el request
+  escribe síncrono con su propia sesión, como antes.
+- Lote que falla por conexión/timeout: vuelve entero a la cola y se reintenta.
+- Cualquier otro error (p.ej. un payload que la DB rechaza): el lote se parte
+  en mitades hasta aislar el registro culpable, que se reintenta al final de la
+  cola hasta `IDEMPOTENCY_FINALIZE_MAX_ATTEMPTS` veces y después se descarta
+  (log + métrica; el lease lo libera). El resto del lote se escribe igual.
+- Al apagar se vacía la cola antes de cerrar el engine.
+- `IDEMPOTENCY_FINALIZE_QUEUE_MAX=0` desactiva la cola.
+
+Mientras un registro espera en la cola sigue en `processing` (con lease): un
+reintento en esa ventana recibe 409 o espera (IDEMPOTENCY_WAIT_SECONDS) igual
+que con un request en curso.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database.db_async import AsyncSessionLocal
+from app.core.metrics import registry
+from app.core.security.idempotency import finalize_idempotency, finalize_idempotency_many
+
+logger = logging.getLogger(__name__)
+
+FINALIZE_SYNC_FALLBACK = registry.counter(
+    "idempotency_finalize_sync_fallback_total",
+    "Finalize escritos en el request porque la cola estaba llena o detenida.",
+)
+FINALIZE_BATCH_SIZE = registry.histogram(
+    "idempotency_finalize_batch_size",
+    "Registros por UPDATE de finalize en lote.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+FINALIZE_DROPPED = registry.counter(
+    "idempotency_finalize_dropped_total",
+    "Finalize descartados tras agotar IDEMPOTENCY_FINALIZE_MAX_ATTEMPTS.",
+)
+
+# (kwargs de finalize_idempotency, intentos fallidos en solitario)
+_Entry = Tuple[Dict[str, Any], int]
+
+
+def _is_transient(e: BaseException) -> bool:
+    """Errores de conexión/pool: el lote no tiene la culpa, se reintenta entero."""
+    if isinstance(e, (sa_exc.OperationalError, sa_exc.InterfaceError, sa_exc.TimeoutError, OSError, asyncio.TimeoutError)):
+        return True
+    return isinstance(e, sa_exc.DBAPIError) and bool(e.connection_invalidated)
+
+
+class FinalizeQueue:
+    def __init__(self) -> None:
+        self._pending: Deque[_Entry] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @property
+    def capacity(self) -> int:
+        return int(getattr(settings.security, "IDEMPOTENCY_FINALIZE_QUEUE_MAX", 1000))
+
+    @property
+    def batch_max(self) -> int:
+        return max(1, int(getattr(settings.security, "IDEMPOTENCY_FINALIZE_BATCH_MAX", 100)))
+
+    @property
+    def window(self) -> float:
+        return max(0.0, float(getattr(settings.security, "IDEMPOTENCY_FINALIZE_WINDOW_MS", 5))) / 1000.0
+
+    @property
+    def max_attempts(self) -> int:
+        return max(1, int(getattr(settings.security, "IDEMPOTENCY_FINALIZE_MAX_ATTEMPTS", 3)))
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def submit(self, session: AsyncSession, **kwargs: Any) -> None:
+        """
+        Mismos argumentos que `finalize_idempotency` (sin relaxed: siempre relajado).
+        `session` solo se usa si hay que escribir síncrono.
+        """
+        if not (getattr(settings.security, "ENABLE_IDEMPOTENCY", True) and kwargs.get("record_id")):
+            return
+        if not self.running or len(self._pending) >= self.capacity:
+            FINALIZE_SYNC_FALLBACK.inc()
+            await finalize_idempotency(session, relaxed=True, **kwargs)
+            return
+        self._pending.append((kwargs, 0))
+        self._wakeup.set()
+
+    def _take(self) -> List[_Entry]:
+        n = min(self.batch_max, len(self._pending))
+        return [self._pending.popleft() for _ in range(n)]
+
+    def _requeue(self, entries: List[_Entry], *, front: bool) -> None:
+        room = max(0, self.capacity - len(self._pending))
+        if front:
+            self._pending.extendleft(reversed(entries[:room]))
+        else:
+            self._pending.extend(entries[:room])
+        if len(entries) > room:
+            FINALIZE_DROPPED.inc(len(entries) - room)
+            logger.error("Cola de finalize llena: se descartan %s registros", len(entries) - room)
+
+    async def _write(self, batch: List[_Entry]) -> None:
+        async with AsyncSessionLocal() as session:
+            await finalize_idempotency_many(session, [kwargs for kwargs, _ in batch])
+        FINALIZE_BATCH_SIZE.observe(len(batch))
+
+    async def _write_isolating(self, batch: List[_Entry], retry: List[_Entry]) -> None:
+        """
+        Escribe el lote; si falla por algo que no es de conexión, parte en mitades
+        hasta aislar el registro que la DB rechaza y lo deja en `retry` (o lo
+        descarta si agotó los intentos). Los errores de conexión suben.
+        """
+        try:
+            await self._write(batch)
+            return
+        except Exception as e:
+            if _is_transient(e):
+                raise
+            error = e
+        if len(batch) > 1:
+            mid = len(batch) // 2
+            await self._write_isolating(batch[:mid], retry)
+            await self._write_isolating(batch[mid:], retry)
+            return
+        kwargs, attempts = batch[0]
+        attempts += 1
+        if attempts >= self.max_attempts:
+            FINALIZE_DROPPED.inc()
+            logger.error(
+                "Finalize idempotente descartado tras %s intentos (record_id=%s): %r",
+                attempts, kwargs.get("record_id"), error,
+            )
+            return
+        logger.warning("Finalize idempotente rechazado (record_id=%s), se reintenta: %r", kwargs.get("record_id"), error)
+        retry.append((kwargs, attempts))
+
+    async def flush(self) -> int:
+        written = 0
+        while self._pending:
+            batch = self._take()
+            retry: List[_Entry] = []
+            try:
+                await self._write_isolating(batch, retry)
+            except BaseException:
+                # conexión caída o cancelación al apagar: el lote vuelve entero al
+                # frente (reescribir los que ya entraron deja el mismo resultado)
+                self._requeue(batch, front=True)
+                raise
+            # los rechazados van al final: no frenan al resto de la cola
+            self._requeue(retry, front=False)
+            written += len(batch) - len(retry)
+        return written
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.window and len(self._pending) < self.batch_max:
+                await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("No se pudo escribir el lote de finalize idempotente")
+                await asyncio.sleep(1.0)
+                if self._pending:
+                    self._wakeup.set()
+
+    async def start(self) -> None:
+        if self.capacity > 0 and self._task is None:
+            self._wakeup = asyncio.Event()
+            if self._pending:
+                self._wakeup.set()
+            self._task = asyncio.create_task(self._run(), name="idempotency-finalizer")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("No se pudo vaciar la cola de finalize al apagar")
+
+
+finalize_queue = FinalizeQueue()
+
+registry.gauge(
+    "idempotency_finalize_queue_depth",
+    "Finalize idempotentes pendientes en la cola del worker.",
+    function=lambda: len(finalize_queue),
+)
@@ -0,0 +1,109 @@
+"""
+Renovación del lease de un claim idempotente mientras el request sigue vivo.
+
+Sin renovar, un handler o un stream que dura más que `IDEMPOTENCY_LEASE_SECONDS`
+queda como abandonado: el sweeper lo pasa a 'fail', el finalize del dueño se
+rechaza y un reintento vuelve a ejecutar el handler. `LeaseHeartbeat` extiende
+el lease cada `IDEMPOTENCY_LEASE_SECONDS / 3` desde una sesión propia hasta que
+se detiene (al entregar el finalize) o llega a `IDEMPOTENCY_LEASE_MAX_SECONDS`
+(tope duro: un stream colgado, o que nunca empezó, no retiene la clave para siempre).
+
+La renovación de fondo usa `FOR UPDATE SKIP LOCKED`: mientras el claim sigue sin
+confirmar en la transacción del request la fila está bloqueada (nadie más puede
+reclamarla) y no hay nada que esperar. Por eso, antes de confirmar un claim que
+pasó un intervalo sin renovarse, el request lo renueva dentro de su propia
+transacción (`renew_if_due`): un reintento bloqueado en esa fila no lo encuentra
+vencido al liberarse.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
+from app.core.database.db_async import AsyncSessionLocal
+from app.core.database.unit_of_work import relaxed_commit
+from app.core.security.idempotency import lease_seconds
+
+logger = logging.getLogger(__name__)
+
+_EXTEND_LEASE_SQL = text(f"""
+    UPDATE {BOOTSTRAP_SCHEMA}.idempotency_keys
+    SET lease_expires_at = NOW() + make_interval(secs => :lease)
+    WHERE cod_idempotency_keys = (
+        SELECT cod_idempotency_keys
+        FROM {BOOTSTRAP_SCHEMA}.idempotency_keys
+        WHERE cod_idempotency_keys = :id
+          AND status = 'processing'
+          AND lease_owner = :owner
+        FOR UPDATE SKIP LOCKED
+    )
+""")
+
+
+async def extend_lease(session: AsyncSession, *, record_id: int, lease_owner: str) -> bool:
+    """
+    Extiende el lease si sigue a nombre de `lease_owner`. No confirma. False si
+    no se tocó (lease perdido, fila bloqueada por otra transacción o aún sin
+    confirmar).
+    """
+    res = await session.execute(
+        _EXTEND_LEASE_SQL, {"id": record_id, "owner": lease_owner, "lease": lease_seconds()}
+    )
+    return bool(res.rowcount)
+
+
+class LeaseHeartbeat:
+    def __init__(self, record_id: Optional[int], lease_owner: Optional[str]) -> None:
+        self.record_id = record_id
+        self.lease_owner = lease_owner
+        self._task: Optional[asyncio.Task] = None
+        self._renewed_at = 0.0
+
+    @property
+    def interval(self) -> float:
+        return lease_seconds() / 3.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.record_id and self.lease_owner and lease_seconds() > 0)
+
+    def _due(self) -> bool:
+        return asyncio.get_running_loop().time() - self._renewed_at >= self.interval
+
+    def start(self) -> "LeaseHeartbeat":
+        if self.enabled and self._task is None:
+            self._renewed_at = asyncio.get_running_loop().time()
+            self._task = asyncio.create_task(self._run(), name="idempotency-lease")
+        return self
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + float(getattr(settings.security, "IDEMPOTENCY_LEASE_MAX_SECONDS", 3600))
+        while loop.time() + self.interval < deadline:
+            await asyncio.sleep(self.interval)
+            try:
+                async with AsyncSessionLocal() as session:
+                    renewed = await extend_lease(session, record_id=self.record_id, lease_owner=self.lease_owner)
+                    await relaxed_commit(session)
+                if renewed:
+                    self._renewed_at = loop.time()
+            except Exception:
+                logger.warning("No se pudo renovar el lease idempotente %s", self.record_id, exc_info=True)
+
+    async def renew_if_due(self, session: AsyncSession) -> None:
+        """Antes de confirmar el claim: renueva en la transacción del request si hace falta."""
+        if self._task is None or not self._due():
+            return
+        if await extend_lease(session, record_id=self.record_id, lease_owner=self.lease_owner):
+            self._renewed_at = asyncio.get_running_loop().time()
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
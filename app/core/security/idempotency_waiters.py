@@ -0,0 +1,105 @@
+"""
+Espera de finalización para claves idempotentes en curso (opt-in con
+`IDEMPOTENCY_WAIT_SECONDS > 0`; con 0 se responde 409 como antes).
+
+Un reintento que encuentra la clave en `processing` se suscribe a
+`(client_id, key)` y duerme hasta que el request original haga finalize:
+- mismo worker: señal en proceso al confirmar el finalize;
+- otros workers: NOTIFY en `bootstrap_app_idempotency_done` (se entrega con el
+  commit del finalize) vía `pg_listener`.
+Al despertar (o vencer el timeout) el reintento vuelve a consultar la DB, así
+que una señal perdida solo cuesta latencia, nunca una respuesta incorrecta.
+
+Si el original falla, su claim se descarta con el rollback: en el mismo worker
+se despierta a los suscriptos; en otros no llega aviso (el NOTIFY se iría con
+el rollback) y lo descubren re-consultando cada `IDEMPOTENCY_WAIT_POLL_SECONDS`.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, Sequence, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database.pg_listener import PgListener, pg_notify
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "bootstrap_app_idempotency_done"
+
+WaitKey = Tuple[str, str]
+
+
+def wait_seconds() -> float:
+    return float(getattr(settings.security, "IDEMPOTENCY_WAIT_SECONDS", 0))
+
+
+def poll_seconds() -> float:
+    return max(0.05, float(getattr(settings.security, "IDEMPOTENCY_WAIT_POLL_SECONDS", 0.5)))
+
+
+class CompletionWaiters:
+    def __init__(self) -> None:
+        self._waiters: Dict[WaitKey, Set[asyncio.Event]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._waiters.values())
+
+    @contextmanager
+    def subscribe(self, client_id: str, key: str) -> Iterator[asyncio.Event]:
+        event = asyncio.Event()
+        wk = (client_id, key)
+        self._waiters.setdefault(wk, set()).add(event)
+        try:
+            yield event
+        finally:
+            events = self._waiters.get(wk)
+            if events is not None:
+                events.discard(event)
+                if not events:
+                    del self._waiters[wk]
+
+    def signal(self, client_id: str, key: str) -> None:
+        for event in self._waiters.get((client_id, key), ()):
+            event.set()
+
+    def signal_all(self) -> None:
+        for events in self._waiters.values():
+            for event in events:
+                event.set()
+
+    def _on_notify(self, payload: str) -> None:
+        try:
+            client_id, key = json.loads(payload)
+        except (ValueError, TypeError):
+            logger.warning("Payload inválido en %s: %r", CHANNEL, payload)
+            self.signal_all()
+            return
+        self.signal(client_id, key)
+
+    def subscribe_listener(self, listener: PgListener) -> None:
+        # tras reconectar pudieron perderse avisos: todos vuelven a consultar
+        listener.listen(CHANNEL, self._on_notify, on_reconnect=self.signal_all)
+
+
+completion_waiters = CompletionWaiters()
+
+
+async def notify_completed(session: AsyncSession, client_id: str, key: str) -> None:
+    """Encola el aviso para otros workers (se entrega con el commit de `session`)."""
+    await pg_notify(session, CHANNEL, json.dumps([client_id, key]))
+
+
+async def notify_completed_many(session: AsyncSession, keys: Sequence[WaitKey]) -> None:
+    """Igual que `notify_completed` para un lote, en una sola sentencia."""
+    if not keys:
+        return
+    await session.execute(
+        text("SELECT pg_notify(:ch, p) FROM unnest(CAST(:ps AS text[])) AS p"),
+        {"ch": CHANNEL, "ps": [json.dumps([client_id, key]) for client_id, key in keys]},
+    )
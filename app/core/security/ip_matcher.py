@@ -0,0 +1,93 @@
+"""
+Matcher de allow-lists CIDR precompilado (IPv4 e IPv6).
+
+Cada regla se normaliza a (prefixlen, red como entero) y se indexa en un dict
+por longitud de prefijo. Buscar una IP cuesta una máscara + un lookup por cada
+longitud de prefijo distinta presente (≤ 33 / 129), sin importar cuántas reglas
+tenga el cliente. Devuelve la regla más específica que matchea.
+
+Las reglas no se pliegan: una regla `::ffff:a.b.c.d/n` queda en su propia tabla
+de 128 bits. Solo se pliega la IP del cliente: una dirección IPv4 o su forma
+IPv4-mapped (`::ffff:a.b.c.d`) se busca en la tabla IPv4 y en la de reglas
+mapped, y gana el prefijo más largo medido en bits IPv6 (IPv4 /n = /96+n). Las
+reglas IPv6 más amplias que `::ffff:0:0/96` (p.ej. `::/0`) no cubren clientes
+IPv4.
+"""
+from __future__ import annotations
+
+import ipaddress
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_MAPPED_NET = ipaddress.IPv6Network("::ffff:0:0/96")
+
+
+class _Table:
+    __slots__ = ("bits", "by_len", "lens")
+
+    def __init__(self, bits: int) -> None:
+        self.bits = bits
+        self.by_len: Dict[int, Dict[int, str]] = {}
+        self.lens: List[Tuple[int, int]] = []  # (prefixlen, mask) de más largo a más corto
+
+    def add(self, prefixlen: int, network: int, rule: str) -> None:
+        self.by_len.setdefault(prefixlen, {}).setdefault(network, rule)
+
+    def freeze(self) -> None:
+        full = (1 << self.bits) - 1
+        self.lens = [
+            (plen, (full >> (self.bits - plen)) << (self.bits - plen) if plen else 0)
+            for plen in sorted(self.by_len, reverse=True)
+        ]
+
+    def match(self, value: int) -> Optional[Tuple[int, str]]:
+        for plen, mask in self.lens:
+            rule = self.by_len[plen].get(value & mask)
+            if rule is not None:
+                return plen, rule
+        return None
+
+
+class CidrMatcher:
+    def __init__(self, cidrs: Iterable[str]) -> None:
+        self._v4 = _Table(32)
+        self._v6 = _Table(128)
+        self._mapped = _Table(128)
+        self._count = 0
+        for c in cidrs:
+            try:
+                net = ipaddress.ip_network(str(c), strict=False)
+            except ValueError:
+                continue
+            if net.version == 4:
+                table = self._v4
+            elif net.subnet_of(_MAPPED_NET):
+                table = self._mapped
+            else:
+                table = self._v6
+            table.add(net.prefixlen, int(net.network_address), str(c))
+            self._count += 1
+        self._v4.freeze()
+        self._v6.freeze()
+        self._mapped.freeze()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __bool__(self) -> bool:
+        return self._count > 0
+
+    def match(self, ip: str) -> Optional[str]:
+        """Devuelve la regla (CIDR tal cual se guardó) que permite `ip`, o None."""
+        try:
+            ip_obj = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        v4 = ip_obj if ip_obj.version == 4 else ip_obj.ipv4_mapped
+        if v4 is None:
+            hit = self._v6.match(int(ip_obj))
+            return hit[1] if hit is not None else None
+        best = self._mapped.match(int(_MAPPED_NET.network_address) | int(v4))
+        hit = self._v4.match(int(v4))
+        if hit is not None and (best is None or hit[0] + 96 > best[0]):
+            best = hit
+        return best[1] if best is not None else None
@@ -0,0 +1,93 @@
+"""
+Write-behind de `client_keys.last_used_at`.
+
+hmac_auth solo anota en memoria el último uso por `codClientKey`; una tarea de
+fondo lo vuelca cada `KEY_USAGE_FLUSH_SECONDS` con UN UPDATE por lotes (y una vez
+más al apagar). Con `KEY_USAGE_FLUSH_SECONDS=0` se vuelve a la escritura síncrona.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, UTC
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
+from app.core.database.db_async import AsyncSessionLocal
+from app.core.database.unit_of_work import relaxed_commit
+
+logger = logging.getLogger(__name__)
+
+_BATCH_UPDATE = text(f"""
+    UPDATE {BOOTSTRAP_SCHEMA}.client_keys AS ck
+    SET last_used_at = v.used_at
+    FROM unnest(CAST(:ids AS integer[]), CAST(:used AS timestamptz[])) AS v(cod, used_at)
+    WHERE ck.cod_client_key = v.cod
+      AND (ck.last_used_at IS NULL OR ck.last_used_at < v.used_at)
+""")
+
+
+class KeyUsageRecorder:
+    def __init__(self) -> None:
+        self._pending: Dict[int, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def interval(self) -> float:
+        return float(getattr(settings.security, "KEY_USAGE_FLUSH_SECONDS", 10))
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def record(self, cod_client_key: int) -> None:
+        self._pending[cod_client_key] = datetime.now(UTC)
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        ids = list(pending)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(_BATCH_UPDATE, {"ids": ids, "used": [pending[i] for i in ids]})
+                # telemetría: perder el último lote ante una caída es aceptable
+                await relaxed_commit(session)
+        except Exception:
+            # se reintenta en el próximo ciclo, sin pisar usos más nuevos
+            for cod, used in pending.items():
+                if self._pending.get(cod, used) <= used:
+                    self._pending[cod] = used
+            raise
+        return len(ids)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("No se pudo volcar last_used_at")
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="key-usage-flusher")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("No se pudo volcar last_used_at al apagar")
+
+
+key_usage = KeyUsageRecorder()
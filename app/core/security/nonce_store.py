@@ -0,0 +1,311 @@
+"""
+Almacenes de nonces anti-replay.
+
+- `postgres`: `register_nonces()` sobre `security_nonces` (particionada por received_at),
+              confirmado por conexiones reservadas (`NONCE_POOL_SIZE`, fuera del pool
+              de requests), nunca en la transacción del request.
+              Con `NONCE_BATCH_WINDOW_MS > 0` se agrupan los registros de requests
+              concurrentes (group commit): una llamada y un commit por lote.
+- `redis`:    SET NX EX con TTL = `nonce_ttl_seconds()`.
+- `memory`:   en proceso, shardeado por buckets de tiempo (solo despliegues de un nodo).
+
+Todos recuerdan el nonce solo por `nonce_ttl_seconds()`: lo que impide el replay
+después es la verificación de timestamp. ENABLE_NONCE sin ENABLE_TIMESTAMP
+avisa al arrancar (o falla con REQUIRE_TIMESTAMP_WITH_NONCE, ver SecuritySettings).
+
+Se elige con `NONCE_BACKEND` (o `USE_REDIS_FOR_NONCE=True`, que fuerza redis).
+"""
+from __future__ import annotations
+
+import abc
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.database.bootstrap_app_scheme import schema_name as BOOTSTRAP_SCHEMA
+from app.core.database.db_async import create_dedicated_engine
+
+
+def nonce_ttl_seconds() -> int:
+    """
+    Cuánto tiempo hay que recordar un nonce: hmac_auth acepta timestamps en
+    [now - (window + skew), now + skew], así que un request fechado `skew` en el
+    futuro sigue siendo válido hasta window + 2*skew después de recibirse.
+    """
+    window = int(getattr(settings.security, "HMAC_WINDOW_SECONDS", 300))
+    skew = int(getattr(settings.security, "CLOCK_SKEW_SECONDS", 60))
+    return window + 2 * skew
+
+
+class NonceStore(abc.ABC):
+    """
+    Interfaz: `register` devuelve True si el nonce es nuevo, False si es replay.
+
+    Con `commit=True` (lo que usa hmac_auth) el nonce queda confirmado antes de
+    devolver, en una transacción propia: ni un rollback posterior del request lo
+    descarta, ni se confirma de paso lo que `session` tenga pendiente (p.ej. el
+    claim de idempotencia). Con `commit=False` la escritura queda en la
+    transacción de `session` y corre su suerte (solo para quien quiera ligarla a
+    esa transacción). Redis y memoria registran siempre en el momento.
+    """
+
+    @abc.abstractmethod
+    async def register(
+        self,
+        session: AsyncSession,
+        *,
+        integration_client_cod: int,
+        client_id: str,
+        nonce: str,
+        request_ts: int,
+        commit: bool = True,
+    ) -> bool:
+        ...
+
+    async def close(self) -> None:
+        return None
+
+
+# La tabla particionada no admite UNIQUE (client_id, nonce) sin received_at:
+# la función serializa por nonce con un lock advisory y solo busca duplicados
+# dentro de la ventana (poda de particiones), devolviendo los aceptados.
+_REGISTER = text(f"""
+    SELECT out_client_id, out_nonce
+    FROM {BOOTSTRAP_SCHEMA}.register_nonces(
+        CAST(:ic AS integer[]), CAST(:cid AS text[]), CAST(:nonce AS text[]),
+        CAST(:ts AS bigint[]), :window
+    )
+""")
+
+NonceItem = Tuple[int, str, str, int]  # (integration_client_cod, client_id, nonce, request_ts)
+
+
+async def _register_many(session: AsyncSession, items: List[NonceItem], commit: bool = True) -> Set[Tuple[str, str]]:
+    res = await session.execute(
+        _REGISTER,
+        {
+            "ic": [i[0] for i in items],
+            "cid": [i[1] for i in items],
+            "nonce": [i[2] for i in items],
+            "ts": [i[3] for i in items],
+            "window": nonce_ttl_seconds(),
+        },
+    )
+    accepted = {(row[0], row[1]) for row in res}
+    if commit:
+        await session.commit()
+    return accepted
+
+
+class _ReservedSessions:
+    """
+    Sesiones sobre un engine propio de `connections` conexiones, fuera del pool de
+    requests: quien registra un nonce suele tener ya una conexión del pool tomada
+    (la de la unidad de trabajo) y no debe esperar otra del mismo pool.
+    """
+
+    def __init__(self, connections: int) -> None:
+        self._connections = max(1, int(connections))
+        self._engine: Optional[AsyncEngine] = None
+        self._sessions: Optional[async_sessionmaker] = None
+
+    def __call__(self) -> AsyncSession:
+        if self._sessions is None:
+            self._engine = create_dedicated_engine(self._connections)
+            self._sessions = async_sessionmaker(bind=self._engine, expire_on_commit=False, class_=AsyncSession)
+        return self._sessions()
+
+    async def dispose(self) -> None:
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = self._sessions = None
+
+
+class PostgresNonceStore(NonceStore):
+    # sin commit, el lock advisory de register_nonces() dura hasta el commit del
+    # request y un replay concurrente espera y después ve el nonce confirmado
+    def __init__(self, connections: int = 2) -> None:
+        self._sessions = _ReservedSessions(connections)
+
+    async def register(self, session, *, integration_client_cod, client_id, nonce, request_ts, commit=True):
+        item = (integration_client_cod, client_id, nonce, int(request_ts))
+        if not commit:
+            accepted = await _register_many(session, [item], commit=False)
+        else:
+            async with self._sessions() as own:
+                accepted = await _register_many(own, [item])
+        return (client_id, nonce) in accepted
+
+    async def close(self) -> None:
+        await self._sessions.dispose()
+
+
+class BatchingPostgresNonceStore(NonceStore):
+    """
+    Junta los registros que llegan dentro de `window_ms` (o hasta `max_items`) y
+    los escribe con una sola llamada a `register_nonces()` + commit. Cada request
+    espera su future: True (aceptado) o False (replay). Si el mismo nonce aparece
+    dos veces en un lote solo se acepta la primera aparición.
+
+    Los lotes van por una conexión reservada (engine propio de una conexión, fuera
+    del pool de requests): los requests que esperan su future pueden tener tomadas
+    todas las conexiones del pool, y el lote no debe competir con ellos. Los lotes
+    se escriben de a uno; mientras tanto los siguientes se siguen juntando.
+
+    Con `commit=False` no hay lote: se escribe en la transacción de `session`.
+    """
+
+    def __init__(self, window_ms: float, max_items: int) -> None:
+        self._window = max(0.0, float(window_ms)) / 1000.0
+        self._max = max(1, int(max_items))
+        self._pending: List[Tuple[NonceItem, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._sessions = _ReservedSessions(1)
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    async def register(self, session, *, integration_client_cod, client_id, nonce, request_ts, commit=True):
+        item = (integration_client_cod, client_id, nonce, int(request_ts))
+        if not commit:
+            accepted = await _register_many(session, [item], commit=False)
+            return (client_id, nonce) in accepted
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self._max:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._write(batch), name="nonce-batch")
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _write(self, batch: List[Tuple[NonceItem, asyncio.Future]]) -> None:
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        try:
+            session = self._sessions()
+            async with self._write_lock, session:
+                accepted = await _register_many(session, [item for item, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        seen: Set[Tuple[str, str]] = set()
+        for (_, client_id, nonce, _), fut in batch:
+            key = (client_id, nonce)
+            ok = key in accepted and key not in seen
+            seen.add(key)
+            if not fut.done():
+                fut.set_result(ok)
+
+    async def close(self) -> None:
+        self._flush()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        await self._sessions.dispose()
+        self._write_lock = None
+
+
+class RedisNonceStore(NonceStore):
+    def __init__(self, dsn: str, ttl_seconds: int, client: Any = None) -> None:
+        if client is None:
+            try:
+                from redis import asyncio as aioredis
+            except ImportError as e:  # dependencia opcional
+                raise RuntimeError("NONCE_BACKEND=redis requiere el paquete 'redis' (extra [redis])") from e
+            client = aioredis.from_url(dsn)
+        self._redis: Any = client
+        self._ttl = max(1, int(ttl_seconds))
+
+    async def register(self, session, *, integration_client_cod, client_id, nonce, request_ts, commit=True):
+        ok = await self._redis.set(f"nonce:{client_id}:{nonce}", request_ts, nx=True, ex=self._ttl)
+        return bool(ok)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class MemoryNonceStore(NonceStore):
+    """
+    Cada shard guarda un set de nonces por bucket de tiempo; los buckets más
+    viejos que el TTL se descartan enteros (sin recorrer claves una por una).
+    """
+
+    def __init__(self, ttl_seconds: int, shards: int = 16, buckets: int = 4) -> None:
+        self._width = max(1, -(-int(ttl_seconds) // max(1, buckets)))
+        self._live = -(-int(ttl_seconds) // self._width)
+        self._shards: List[OrderedDict[int, set[str]]] = [OrderedDict() for _ in range(max(1, shards))]
+
+    def _shard(self, key: str) -> OrderedDict[int, set[str]]:
+        return self._shards[hash(key) % len(self._shards)]
+
+    async def register(self, session, *, integration_client_cod, client_id, nonce, request_ts, commit=True):
+        key = f"{client_id}\x00{nonce}"
+        shard = self._shard(key)
+        current = int(time.monotonic() // self._width)
+        oldest = current - self._live
+        while shard:
+            first = next(iter(shard))
+            if first >= oldest:
+                break
+            shard.popitem(last=False)
+        for seen in shard.values():
+            if key in seen:
+                return False
+        bucket = shard.get(current)
+        if bucket is None:
+            bucket = shard[current] = set()
+        bucket.add(key)
+        return True
+
+
+_store: Optional[NonceStore] = None
+
+
+def _build_store() -> NonceStore:
+    sec = settings.security
+    backend = str(getattr(sec, "NONCE_BACKEND", "postgres")).lower()
+    if getattr(sec, "USE_REDIS_FOR_NONCE", False):
+        backend = "redis"
+    if backend == "redis":
+        if not sec.REDIS_DSN:
+            raise RuntimeError("NONCE_BACKEND=redis requiere REDIS_DSN")
+        return RedisNonceStore(sec.REDIS_DSN, nonce_ttl_seconds())
+    if backend == "memory":
+        return MemoryNonceStore(nonce_ttl_seconds(), shards=int(getattr(sec, "NONCE_MEMORY_SHARDS", 16)))
+    if backend == "postgres":
+        window_ms = float(getattr(sec, "NONCE_BATCH_WINDOW_MS", 0))
+        if window_ms > 0:
+            return BatchingPostgresNonceStore(window_ms, int(getattr(sec, "NONCE_BATCH_MAX", 64)))
+        return PostgresNonceStore(int(getattr(sec, "NONCE_POOL_SIZE", 2)))
+    raise RuntimeError(f"NONCE_BACKEND desconocido: {backend}")
+
+
+def get_nonce_store() -> NonceStore:
+    global _store
+    if _store is None:
+        _store = _build_store()
+    return _store
+
+
+async def close_nonce_store() -> None:
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
@@ -0,0 +1,177 @@
+"""
+Rate limiter token-bucket compartido por todos los workers de un nodo.
+
+Los buckets viven en un archivo mapeado en memoria (`/dev/shm` si existe) con
+una tabla hash de `RATE_LIMIT_SLOTS` slots de tamaño fijo:
+
+    key_hash u64 | tokens f64 | updated f64 (epoch) | full_at f64 (epoch)
+
+Cada operación bloquea SOLO su cadena de sondeo (`_PROBES` slots desde el slot
+base) con un lock de rango de bytes (`fcntl.lockf`), así que workers distintos
+no se serializan entre sí salvo que sus cadenas se solapen. La clave se busca
+primero en toda la cadena; solo si no está se toma el primer slot vacío o cuyo
+bucket ya se rellenó por completo (`full_at`): equivale a un bucket nuevo. Si no
+hay slot libre se comparte el slot base (más estricto, nunca más permisivo).
+
+Claves: `client:<client_id>` (hmac_auth, límites por fila de IntegrationClients)
+y `user:<id>` (get_current_user). Las respuestas llevan `RateLimit-Limit`,
+`RateLimit-Remaining` y `RateLimit-Reset` (+ `Retry-After` en 429) vía
+ResponseHeadersMiddleware.
+
+Solo POSIX (fcntl).
+"""
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request, status
+
+from app.core.config import settings
+from app.core.metrics import registry
+
+_SLOT = struct.Struct("<Qddd")
+_PROBES = 8
+_FILE_NAME = "bootstrap_app_ratelimit.bin"
+
+RATE_LIMITED = registry.counter(
+    "rate_limit_rejected_total", "Requests rechazados por el rate limiter.", ("kind",)
+)
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: int          # segundos hasta tener el bucket lleno
+    retry_after: int    # segundos hasta poder pasar (0 si allowed)
+
+    def headers(self) -> Dict[str, str]:
+        out = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset),
+        }
+        if not self.allowed:
+            out["Retry-After"] = str(self.retry_after)
+        return out
+
+
+def _key_hash(key: str) -> int:
+    h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+    return h or 1  # 0 = slot vacío
+
+
+def _default_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, _FILE_NAME)
+
+
+class SharedTokenBucket:
+    def __init__(self, path: str, slots: int) -> None:
+        self._slots = max(_PROBES, int(slots))
+        size = self._slots * _SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            # otro tamaño = otra configuración: se reinicia la tabla
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        # lockf no excluye entre hilos del mismo proceso (endpoints sync en threadpool)
+        self._thread_lock = threading.Lock()
+
+    def _lock_chain(self, home: int, op: int) -> None:
+        # la cadena de sondeo entera, en orden de offset (sin deadlocks entre cadenas)
+        end = home + _PROBES
+        if end <= self._slots:
+            ranges = [(home, _PROBES)]
+        else:
+            ranges = [(0, end - self._slots), (home, self._slots - home)]
+        for start, n in ranges:
+            fcntl.lockf(self._fd, op, n * _SLOT.size, start * _SLOT.size)
+
+    def take(self, key: str, per_minute: int, burst: Optional[int] = None, cost: float = 1.0) -> RateLimitResult:
+        per_minute = max(1, int(per_minute))
+        capacity = float(max(1, int(burst or per_minute)))
+        rate = per_minute / 60.0
+        h = _key_hash(key)
+        home = h % self._slots
+        chain = [(home + i) % self._slots for i in range(_PROBES)]
+        with self._thread_lock:
+            now = time.time()
+            self._lock_chain(home, fcntl.LOCK_EX)
+            try:
+                slots = [_SLOT.unpack_from(self._map, idx * _SLOT.size) for idx in chain]
+                # primero el slot propio en TODA la cadena; recién después uno libre
+                pos = next((i for i, slot in enumerate(slots) if slot[0] == h), None)
+                if pos is None:
+                    pos = next((i for i, slot in enumerate(slots) if slot[0] == 0 or slot[3] <= now), None)
+                    if pos is not None:
+                        slot_h, tokens, updated = h, capacity, now
+                    else:
+                        # sin lugar libre: se comparte el slot base
+                        pos = 0
+                        slot_h, tokens, updated, _ = slots[0]
+                else:
+                    slot_h, tokens, updated, _ = slots[pos]
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                full_at = now + (capacity - tokens) / rate
+                _SLOT.pack_into(self._map, chain[pos] * _SLOT.size, slot_h, tokens, now, full_at)
+            finally:
+                self._lock_chain(home, fcntl.LOCK_UN)
+        return RateLimitResult(
+            allowed=allowed,
+            limit=per_minute,
+            remaining=max(0, int(tokens)),
+            reset=max(0, math.ceil(full_at - now)),
+            retry_after=0 if allowed else max(1, math.ceil((cost - tokens) / rate)),
+        )
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+
+_limiter: Optional[SharedTokenBucket] = None
+
+
+def get_rate_limiter() -> SharedTokenBucket:
+    global _limiter
+    if _limiter is None:
+        sec = settings.security
+        _limiter = SharedTokenBucket(
+            getattr(sec, "RATE_LIMIT_SHM_PATH", None) or _default_path(),
+            int(getattr(sec, "RATE_LIMIT_SLOTS", 8192)),
+        )
+    return _limiter
+
+
+def enforce_rate_limit(request: Request, kind: str, key: str, per_minute: int, burst: Optional[int] = None) -> None:
+    """Consume un token; deja los headers RateLimit-* en el request y lanza 429 si no alcanza."""
+    if not getattr(settings.security, "ENABLE_RATE_LIMIT", False):
+        return
+    result = get_rate_limiter().take(f"{kind}:{key}", per_minute, burst)
+    headers = getattr(request.state, "response_headers", None)
+    if headers is None:
+        headers = request.state.response_headers = {}
+    headers.update(result.headers())
+    if not result.allowed:
+        RATE_LIMITED.inc(kind=kind)
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="rate limit exceeded")
@@ -0,0 +1,29 @@
+"""
+Acceso al body del request compartido entre HMAC e idempotencia.
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Tuple
+
+from fastapi import Request
+
+
+async def buffered_body(request: Request) -> Tuple[bytes, str]:
+    """
+    Devuelve (body, sha256 hex) reutilizando lo que dejó `BodyBufferMiddleware`
+    (app.api.middlewares.body_buffer).
+    Si el middleware no corrió, lee y hashea acá (y deja el mismo estado).
+    """
+    state = request.state
+    body = getattr(state, "raw_body", None)
+    body_hash = getattr(state, "body_sha256", None)
+    if body is None or body_hash is None:
+        body = await request.body()
+        body_hash = hashlib.sha256(body).hexdigest()
+        state.raw_body = body
+        state.body_sha256 = body_hash
+    elif not hasattr(request, "_body"):
+        # evita que request.body() vuelva a consumir el receive
+        request._body = body
+    return body, body_hash
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 import sentry_sdk
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
@@ -10,7 +12,22 @@ from starlette.middleware.cors import CORSMiddleware
 
 import app.core.database 
 from app.api.main import api_router
+from app.api.middlewares import (
+    AuthPrecheckMiddleware,
+    BodyBufferMiddleware,
+    HmacAuthMiddleware,
+    ResponseHeadersMiddleware,
+)
 from app.core.config import settings
+from app.core.database.bootstrap_app_scheme.nonce_partitions import nonce_partitions
+from app.core.database.bootstrap_app_scheme.retention import abandoned_claims, retention_sweeper
+from app.core.database.pg_listener import pg_listener
+from app.core.security.credential_cache import credential_cache
+from app.core.security.idempotency_cache import idempotency_cache
+from app.core.security.idempotency_finalizer import finalize_queue
+from app.core.security.idempotency_waiters import completion_waiters
+from app.core.security.key_usage import key_usage
+from app.core.security.nonce_store import close_nonce_store
 
 def custom_generate_unique_id(route: APIRoute) -> str:
     return f"{route.tags[0]}-{route.name}"
@@ -18,10 +35,34 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 if settings.monitoring.SENTRY_DSN and settings.app.ENVIRONMENT != "local":
     sentry_sdk.init(dsn=str(settings.monitoring.SENTRY_DSN), enable_tracing=True)
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # caches en memoria: invalidación entre workers vía LISTEN/NOTIFY
+    credential_cache.subscribe(pg_listener)
+    idempotency_cache.subscribe(pg_listener)
+    completion_waiters.subscribe_listener(pg_listener)
+    await pg_listener.start()
+    await key_usage.start()
+    await finalize_queue.start()
+    await nonce_partitions.start()
+    await retention_sweeper.start()
+    await abandoned_claims.start()
+    try:
+        yield
+    finally:
+        await abandoned_claims.stop()
+        await retention_sweeper.stop()
+        await nonce_partitions.stop()
+        await finalize_queue.stop()
+        await key_usage.stop()
+        await pg_listener.stop()
+        await close_nonce_store()
+
 app = FastAPI(
     title=settings.app.PROJECT_NAME,
     openapi_url=f"{settings.app.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
 app.add_exception_handler(HTTPException, errors.fastapi_http_exception_handler)
@@ -30,6 +71,16 @@ app.add_exception_handler(RequestValidationError, errors.validation_exception_ha
 app.add_exception_handler(SQLAlchemyError, errors.sqlalchemy_exception_handler)
 app.add_exception_handler(Exception, errors.unhandled_exception_handler)
 
+if settings.security.HMAC_AUTH_MODE == "middleware":
+    app.add_middleware(
+        HmacAuthMiddleware,
+        path_prefixes=settings.security.HMAC_MIDDLEWARE_PATH_PREFIXES,
+    )
+app.add_middleware(BodyBufferMiddleware)
+app.add_middleware(ResponseHeadersMiddleware)
+# por fuera del buffer: rechaza antes de leer el body
+app.add_middleware(AuthPrecheckMiddleware)
+# CORS envuelve a todos: los 401/403/429 de auth también llevan sus headers
 if settings.cors.all_cors_origins:
     app.add_middleware(
         CORSMiddleware,
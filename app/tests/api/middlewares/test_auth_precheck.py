@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+
+from app.api.middlewares import AuthPrecheckMiddleware
+from app.core import errors
+from app.core.database.unit_of_work import get_session
+from app.core.security import credential_cache as credential_cache_module
+from app.core.security.auth_failures import auth_failures
+from app.core.security.credential_cache import CachedKey, ClientCredentials, credential_cache
+from app.core.security.hmac_auth import hmac_auth
+from app.tests.conftest import FakeSession
+
+
+@pytest.fixture
+def app(monkeypatch, security):
+    security(
+        ENABLE_NONCE=False, ENABLE_TIMESTAMP=False, TRUST_PROXY_HEADERS=True,
+        AUTH_FAILURE_MAX_PER_IP=3, NEGATIVE_CACHE_TTL_SECONDS=30, CREDENTIAL_CACHE_TTL_SECONDS=60,
+    )
+    creds = ClientCredentials(cod=1, client_id="c1", keys={"k1": CachedKey(cod=10, kid="k1", secret="s")})
+    loads: list = []
+    checkouts: list = []
+
+    async def _load(session, client_id):
+        loads.append(client_id)
+        return creds if client_id == "c1" else None
+
+    async def _session():
+        checkouts.append(1)
+        yield FakeSession()
+
+    monkeypatch.setattr(credential_cache_module, "load_credentials", _load)
+    credential_cache.clear()
+    auth_failures._windows.clear()
+
+    app = FastAPI()
+    app.add_exception_handler(HTTPException, errors.fastapi_http_exception_handler)
+    app.add_middleware(AuthPrecheckMiddleware)
+
+    @app.post("/pay")
+    async def pay(principal=Depends(hmac_auth)):
+        return {"ok": True}
+
+    app.dependency_overrides[get_session] = _session
+    app.state.loads, app.state.checkouts = loads, checkouts
+    yield app
+    credential_cache.clear()
+    auth_failures._windows.clear()
+
+
+def _post(app: FastAPI, client_id: str, kid: str = "k1", ip: str = "203.0.113.7"):
+    headers = {"X-Client-Id": client_id, "X-Key-Id": kid, "X-Signature": "x", "X-Forwarded-For": ip}
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/pay", headers=headers)
+
+    return asyncio.run(run())
+
+
+def test_unknown_client_is_rejected_before_any_checkout(app):
+    first = _post(app, "ghost")
+    assert (first.status_code, first.json()["message"]) == (401, "unknown client")
+    assert app.state.loads == ["ghost"] and len(app.state.checkouts) == 1
+
+    again = _post(app, "ghost", ip="198.51.100.1")
+    assert (again.status_code, again.json()["message"]) == (401, "unknown client or key")
+    assert app.state.loads == ["ghost"] and len(app.state.checkouts) == 1
+
+
+def test_unknown_kid_is_remembered_per_client(app):
+    assert _post(app, "c1", kid="old").json()["message"] == "key not found or inactive/expired"
+    assert _post(app, "c1", kid="old").json()["message"] == "unknown client or key"
+    checkouts = len(app.state.checkouts)
+    # la key válida del mismo cliente sigue llegando a la verificación de firma
+    assert _post(app, "c1", ip="198.51.100.2").json()["message"] == "invalid signature"
+    assert len(app.state.checkouts) == checkouts + 1
+
+
+def test_repeated_failures_block_the_source_ip(app):
+    for _ in range(3):
+        assert _post(app, "ghost").status_code == 401
+    assert auth_failures.count("203.0.113.7") == 3
+    blocked = _post(app, "c1")
+    assert blocked.status_code == 429
+    assert _post(app, "c1", ip="198.51.100.3").status_code == 401
+
+
+def test_creating_a_client_lifts_the_negative_entry(app):
+    _post(app, "ghost")
+    credential_cache._on_notify("42")
+    assert _post(app, "ghost").json()["message"] == "unknown client"
+    assert app.state.loads == ["ghost", "ghost"]
@@ -0,0 +1,59 @@
+import asyncio
+import hashlib
+
+from fastapi import Request
+
+from app.api.middlewares import BodyBufferMiddleware
+from app.core.security.request_body import buffered_body
+
+_CHUNKS = [b'{"amount"', b": 100, ", b'"currency": "ARS"}']
+_BODY = b"".join(_CHUNKS)
+
+
+def _run(headers, method: str = "POST"):
+    """Pasa un request en chunks por el middleware; devuelve lo que vio la app y los receive()."""
+    pending = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(_CHUNKS) - 1}
+        for i, chunk in enumerate(_CHUNKS)
+    ]
+    received: list = []
+    seen: dict = {}
+
+    async def receive():
+        message = pending.pop(0) if pending else {"type": "http.disconnect"}
+        received.append(message["type"])
+        return message
+
+    async def app(scope, receive, send):
+        request = Request(scope, receive)
+        seen["state"] = dict(scope.get("state", {}))
+        seen["shared"] = await buffered_body(request)
+        seen["body"] = await request.body()
+
+    scope = {"type": "http", "method": method, "path": "/pay", "headers": headers, "query_string": b""}
+    asyncio.run(BodyBufferMiddleware(app)(scope, receive, None))
+    return seen, received
+
+
+def test_signed_body_is_read_and_hashed_once():
+    seen, received = _run([(b"x-signature", b"sig")])
+    digest = hashlib.sha256(_BODY).hexdigest()
+    assert seen["state"] == {"raw_body": _BODY, "body_sha256": digest}
+    assert seen["shared"] == (_BODY, digest)
+    assert seen["body"] == _BODY
+    # el middleware consumió el stream una sola vez; nadie más lo volvió a leer
+    assert received == ["http.request"] * len(_CHUNKS)
+
+
+def test_idempotency_key_alone_triggers_buffering():
+    seen, _ = _run([(b"idempotency-key", b"k-1")])
+    assert seen["state"]["raw_body"] == _BODY
+
+
+def test_untriggered_requests_pass_through():
+    for headers, method in (([], "POST"), ([(b"x-signature", b"sig")], "GET")):
+        seen, received = _run(headers, method)
+        assert seen["state"] == {}
+        # sin middleware, buffered_body lee y hashea por su cuenta
+        assert seen["shared"] == (_BODY, hashlib.sha256(_BODY).hexdigest())
+        assert received == ["http.request"] * len(_CHUNKS)
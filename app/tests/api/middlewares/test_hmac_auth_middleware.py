@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+
+from app.api.middlewares import BodyBufferMiddleware, HmacAuthMiddleware
+from app.core import errors
+from app.core.database.unit_of_work import get_session
+from app.core.security import credential_cache as credential_cache_module
+from app.core.security import hmac_auth as hmac_auth_module
+from app.core.security.auth_failures import auth_failures
+from app.core.security.credential_cache import CachedKey, ClientCredentials
+from app.core.security.hmac_auth import _canonical_v1, hmac_auth
+from app.core.security.key_usage import key_usage
+from app.tests.conftest import FakeSession
+
+_BODY = b'{"amount": 100}'
+
+
+@pytest.fixture
+def app(monkeypatch, security):
+    security(ENABLE_NONCE=False, ENABLE_TIMESTAMP=False, ENABLE_RATE_LIMIT=False, KEY_USAGE_FLUSH_SECONDS=60)
+    creds = ClientCredentials(cod=1, client_id="c1", keys={"k1": CachedKey(cod=10, kid="k1", secret="s")})
+    lookups: list = []
+    sessions: list = []
+
+    async def _get(session, client_id):
+        lookups.append(client_id)
+        return creds if client_id == "c1" else None
+
+    def _session():
+        sessions.append(FakeSession())
+        return sessions[-1]
+
+    monkeypatch.setattr(credential_cache_module.credential_cache, "get", _get)
+    monkeypatch.setattr(hmac_auth_module, "async_session", _session)
+
+    calls: list = []
+    app = FastAPI()
+    app.add_exception_handler(HTTPException, errors.fastapi_http_exception_handler)
+    app.add_middleware(HmacAuthMiddleware, path_prefixes=["/api"])
+    app.add_middleware(BodyBufferMiddleware)
+
+    @app.post("/api/pay")
+    async def pay(payload: dict, principal=Depends(hmac_auth)):
+        calls.append((payload, principal))
+        return {"ok": True}
+
+    @app.post("/public")
+    async def public():
+        calls.append("public")
+        return {"ok": True}
+
+    async def _request_session():
+        yield FakeSession()
+
+    app.dependency_overrides[get_session] = _request_session
+    app.state.calls, app.state.lookups, app.state.sessions = calls, lookups, sessions
+    app.state.creds = creds
+    yield app
+    auth_failures._windows.clear()
+    key_usage._pending.clear()
+
+
+def _signed(creds: ClientCredentials, signature=None) -> dict:
+    message = _canonical_v1("POST", "/api/pay", "", "c1", "k1", "", "", hashlib.sha256(_BODY).hexdigest())
+    return {
+        "X-Client-Id": "c1",
+        "X-Key-Id": "k1",
+        "X-Signature": signature or creds.verifier.sign("k1", message),
+        "content-type": "application/json",
+    }
+
+
+def _post(app: FastAPI, path: str, headers: dict) -> httpx.Response:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post(path, content=_BODY, headers=headers)
+
+    return asyncio.run(run())
+
+
+def test_principal_is_handed_to_the_route_without_reauthenticating(app):
+    resp = _post(app, "/api/pay", _signed(app.state.creds))
+    assert resp.status_code == 200
+    [(payload, principal)] = app.state.calls
+    assert payload == {"amount": 100}
+    assert (principal["client_id"], principal["kid"], principal["body"]) == ("c1", "k1", _BODY)
+    assert app.state.lookups == ["c1"]
+    assert len(app.state.sessions) == 1 and app.state.sessions[0].executed == []
+    assert key_usage._pending.keys() == {10}
+
+
+def test_bad_requests_are_rejected_before_routing(app):
+    forged = _post(app, "/api/pay", _signed(app.state.creds, signature="forged"))
+    assert (forged.status_code, forged.json()["message"]) == (401, "invalid signature")
+    missing = _post(app, "/api/pay", {"X-Client-Id": "c1"})
+    assert (missing.status_code, missing.json()["message"]) == (401, "missing authentication headers")
+    assert app.state.calls == []
+
+
+def test_paths_outside_the_prefixes_are_not_authenticated(app):
+    assert _post(app, "/public", {}).status_code == 200
+    assert app.state.calls == ["public"]
+    assert app.state.lookups == []
@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI, Response
+
+from app.api.middlewares import BodyBufferMiddleware, IdempotentRoute
+from app.core.security.idempotency_cache import idempotency_cache
+
+# formato propio del handler: el replay no debe re-serializarlo
+_BODY = b'{ "id" : 42,  "total": 1.50 }'
+
+
+@pytest.fixture
+def app(memory_db, security):
+    security(IDEMPOTENCY_STORE_RAW=True)
+    calls: list = []
+    router = APIRouter(route_class=IdempotentRoute)
+
+    @router.post("/invoices", status_code=201)
+    async def create(payload: dict):
+        calls.append(payload)
+        return Response(
+            content=_BODY,
+            status_code=201,
+            media_type="application/vnd.invoice+json",
+            headers={"Location": "/invoices/42", "ETag": '"v1"', "X-Trace": "per-request"},
+        )
+
+    app = FastAPI()
+    app.add_middleware(BodyBufferMiddleware)
+    app.include_router(router)
+    app.state.calls = calls
+    return app
+
+
+async def _post(app: FastAPI) -> httpx.Response:
+    headers = {"Idempotency-Key": "inv-1", "X-Client-Id": "c1", "content-type": "application/json"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/invoices", content=b'{"amount": 5}', headers=headers)
+
+
+@pytest.mark.parametrize("from_db", [False, True])
+def test_replay_returns_the_exact_bytes_and_selected_headers(app, memory_db, from_db):
+    async def run():
+        first = await _post(app)
+        if from_db:
+            idempotency_cache.clear()  # otro worker: se lee de la fila
+        return first, await _post(app)
+
+    first, replay = asyncio.run(run())
+    assert app.state.calls == [{"amount": 5}]
+    assert first.content == replay.content == _BODY
+    assert replay.status_code == 201
+    assert replay.headers["content-type"] == "application/vnd.invoice+json"
+    assert (replay.headers["location"], replay.headers["etag"]) == ("/invoices/42", '"v1"')
+    # solo se guardan los headers de IDEMPOTENCY_REPLAY_HEADERS
+    assert "x-trace" not in replay.headers
+    row = memory_db.row("c1", "inv-1")
+    assert row["json"] is None and bytes(row["body"]) == _BODY
@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI, Request
+
+from app.api.middlewares import ResponseHeadersMiddleware
+from app.core.security import rate_limit
+from app.core.security.rate_limit import SharedTokenBucket, enforce_rate_limit
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(ResponseHeadersMiddleware)
+
+    @app.get("/ok")
+    async def ok(request: Request):
+        request.state.server_timing = [("auth_client_lookup", 0.0012), ("auth_signature", 0.00005)]
+        return {"ok": True}
+
+    @app.get("/limited")
+    async def limited(request: Request):
+        enforce_rate_limit(request, "client", "c1", per_minute=1, burst=1)
+        return {"ok": True}
+
+    @app.get("/plain")
+    async def plain():
+        return {"ok": True}
+
+    return app
+
+
+def _get(app: FastAPI, path: str) -> httpx.Response:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get(path)
+
+    return asyncio.run(run())
+
+
+def test_stage_timings_become_server_timing():
+    resp = _get(_app(), "/ok")
+    assert resp.headers["server-timing"] == "auth_client_lookup;dur=1.200, auth_signature;dur=0.050"
+
+
+def test_no_timings_no_header():
+    assert "server-timing" not in _get(_app(), "/plain").headers
+
+
+def test_rate_limit_headers_also_reach_the_429(monkeypatch, security, tmp_path):
+    security(ENABLE_RATE_LIMIT=True)
+    limiter = SharedTokenBucket(str(tmp_path / "rl.bin"), 16)
+    monkeypatch.setattr(rate_limit, "_limiter", limiter)
+    app = _app()
+    try:
+        allowed, denied = _get(app, "/limited"), _get(app, "/limited")
+    finally:
+        limiter.close()
+
+    assert allowed.status_code == 200
+    assert (allowed.headers["ratelimit-limit"], allowed.headers["ratelimit-remaining"]) == ("1", "0")
+    assert "retry-after" not in allowed.headers
+    assert denied.status_code == 429
+    assert denied.headers["ratelimit-remaining"] == "0"
+    assert int(denied.headers["retry-after"]) >= 1
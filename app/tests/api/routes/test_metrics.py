@@ -0,0 +1,19 @@
+import pytest
+from fastapi import HTTPException
+
+from app.api.routes import metrics
+from app.api.routes.metrics import require_metrics_token
+
+
+def test_metrics_token_required(monkeypatch):
+    monkeypatch.setattr(metrics.settings.monitoring, "METRICS_TOKEN", "s3cret")
+    require_metrics_token("Bearer s3cret")
+    for header in (None, "Bearer wrong", "Basic s3cret", "s3cret"):
+        with pytest.raises(HTTPException) as exc:
+            require_metrics_token(header)
+        assert exc.value.status_code == 401
+
+
+def test_metrics_open_without_token(monkeypatch):
+    monkeypatch.setattr(metrics.settings.monitoring, "METRICS_TOKEN", None)
+    require_metrics_token(None)
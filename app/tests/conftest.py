@@ -0,0 +1,179 @@
+import os
+
+# settings mínimos para importar la app sin .env (los tests no abren conexiones)
+for _name, _value in {
+    "APP__DEBUG": "false",
+    "DB__POSTGRES_SERVER": "localhost",
+    "DB__POSTGRES_USER": "postgres",
+    "SECURITY__SECRET_KEY": "test-secret",
+    "CORS__BACKEND_CORS_ORIGINS": "[]",
+    "EMAIL__SMTP_TLS": "true",
+    "MONITORING__SENTRY_DSN": "none",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple  # noqa: E402
+
+import pytest  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+
+
+# ---------------------------------------------------------------------------
+# Fakes compartidos
+# ---------------------------------------------------------------------------
+
+
+class FakeResult:
+    """Lo que los módulos leen de un Result de SQLAlchemy."""
+
+    def __init__(self, rows: Sequence[Tuple] = (), rowcount: Optional[int] = None) -> None:
+        self._rows = list(rows)
+        self.rowcount = len(self._rows) if rowcount is None else rowcount
+
+    def one(self) -> Tuple:
+        if len(self._rows) != 1:
+            raise AssertionError(f"se esperaba una fila, hay {len(self._rows)}")
+        return self._rows[0]
+
+    def first(self) -> Optional[Tuple]:
+        return self._rows[0] if self._rows else None
+
+    def all(self) -> List[Tuple]:
+        return list(self._rows)
+
+    def scalar(self) -> Any:
+        return self._rows[0][0] if self._rows else None
+
+    def scalars(self) -> List[Any]:
+        return [row[0] for row in self._rows]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+Responder = Callable[[str, Dict[str, Any]], Optional[FakeResult]]
+
+
+class FakeSession:
+    """
+    AsyncSession con respuestas programadas: `responder(sql, params)` devuelve el
+    FakeResult de cada execute (None => resultado vacío). Registra cada sentencia
+    en `executed` y cuenta commits/rollbacks.
+    """
+
+    def __init__(self, responder: Optional[Responder] = None) -> None:
+        self.responder = responder
+        self.executed: List[Tuple[str, Dict[str, Any]]] = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+        self._tx = False
+
+    async def __aenter__(self) -> "FakeSession":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    def in_transaction(self) -> bool:
+        return self._tx
+
+    async def execute(self, stmt: Any, params: Optional[Dict[str, Any]] = None) -> FakeResult:
+        sql = getattr(stmt, "text", str(stmt))
+        params = params or {}
+        self.executed.append((sql, params))
+        self._tx = True
+        res = self.responder(sql, params) if self.responder else None
+        return res if res is not None else FakeResult()
+
+    async def scalar(self, stmt: Any, params: Optional[Dict[str, Any]] = None) -> Any:
+        return (await self.execute(stmt, params)).scalar()
+
+    async def commit(self) -> None:
+        self.commits += 1
+        self._tx = False
+
+    async def rollback(self) -> None:
+        self.rollbacks += 1
+        self._tx = False
+
+    async def close(self) -> None:
+        self.closed = True
+        self._tx = False
+
+    def statements(self, fragment: str) -> List[Dict[str, Any]]:
+        """Parámetros de cada sentencia ejecutada que contiene `fragment`."""
+        return [params for sql, params in self.executed if fragment in sql]
+
+
+class FakeRedis:
+    """Redis local en memoria: solo SET con NX/EX, con reloj controlable."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self._data: Dict[str, Tuple[object, Optional[float]]] = {}
+        self.closed = False
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+    def _alive(self, key: str) -> bool:
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        expires = entry[1]
+        if expires is not None and expires <= self.now:
+            del self._data[key]
+            return False
+        return True
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and self._alive(key):
+            return None
+        self._data[key] = (value, self.now + ex if ex else None)
+        return True
+
+    def ttl(self, key: str) -> float:
+        return self._data[key][1] - self.now
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+# ---------------------------------------------------------------------------
+# Fixtures
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def security(monkeypatch):
+    """`security(NAME=valor, ...)`: pisa settings.security solo durante el test."""
+
+    def _set(**values: Any) -> None:
+        for name, value in values.items():
+            monkeypatch.setattr(settings.security, name, value, raising=False)
+
+    return _set
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def memory_db(monkeypatch, security):
+    """
+    Idempotencia habilitada sobre el backend en memoria del benchmark (con
+    rollback): devuelve el MemoryStore; `memory_db.session()` abre una sesión.
+    """
+    from app.benchmarks.idempotency import MemoryStore, use_memory
+    from app.core.security.idempotency_cache import idempotency_cache
+
+    security(ENABLE_IDEMPOTENCY=True)
+    idempotency_cache.clear()
+    store = MemoryStore()
+    store.session = use_memory(store, patch=monkeypatch.setattr)
+    yield store
+    idempotency_cache.clear()
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from app.core.database.pg_listener import PgListener
+from app.core.security import credential_cache as module
+from app.core.security.credential_cache import (
+    CHANNEL,
+    CachedKey,
+    ClientCredentials,
+    CredentialCache,
+    notify_credentials_changed,
+)
+from app.tests.conftest import FakeSession
+
+
+def _creds(secret: str = "s1") -> ClientCredentials:
+    return ClientCredentials(cod=7, client_id="c1", keys={"k1": CachedKey(cod=70, kid="k1", secret=secret)})
+
+
+class Loader:
+    """Reemplaza load_credentials: devuelve `rows[client_id]` y cuenta las idas a la DB."""
+
+    def __init__(self, **rows) -> None:
+        self.rows = rows
+        self.loads = 0
+        self.gate = None
+
+    async def __call__(self, session, client_id):
+        self.loads += 1
+        row = self.rows.get(client_id)
+        if self.gate is not None:
+            await self.gate.wait()
+        return row
+
+
+@pytest.fixture
+def loader(monkeypatch, security):
+    security(CREDENTIAL_CACHE_TTL_SECONDS=60, NEGATIVE_CACHE_TTL_SECONDS=30)
+    loader = Loader(c1=_creds())
+    monkeypatch.setattr(module, "load_credentials", loader)
+    return loader
+
+
+def test_hit_until_notify_invalidates(loader):
+    cache = CredentialCache()
+
+    async def run():
+        first = await cache.get(None, "c1")
+        assert await cache.get(None, "c1") is first
+        assert loader.loads == 1
+        loader.rows["c1"] = _creds("s2")
+        cache._on_notify("7")
+        return await cache.get(None, "c1")
+
+    fresh = asyncio.run(run())
+    assert loader.loads == 2
+    assert fresh.keys["k1"].secret == "s2"
+
+
+def test_load_racing_a_notify_is_not_stored(loader):
+    cache = CredentialCache()
+
+    async def run():
+        loader.gate = asyncio.Event()
+        pending = asyncio.create_task(cache.get(None, "c1"))
+        await asyncio.sleep(0)
+        # la key se revoca mientras la carga (con la fila vieja) sigue en vuelo
+        cache._on_notify("7")
+        loader.gate.set()
+        stale = await pending
+        loader.gate = None
+        loader.rows["c1"] = _creds("s2")
+        return stale, await cache.get(None, "c1")
+
+    stale, fresh = asyncio.run(run())
+    assert stale.keys["k1"].secret == "s1"
+    assert fresh.keys["k1"].secret == "s2"
+    assert loader.loads == 2
+
+
+def test_unknown_client_is_negatively_cached_until_any_notify(loader):
+    cache = CredentialCache()
+
+    async def run():
+        assert await cache.get(None, "ghost") is None
+        assert await cache.get(None, "ghost") is None
+        assert cache.is_known_unknown("ghost")
+        assert loader.loads == 1
+        # alta de un cliente: cualquier id desconocido puede volverse válido
+        loader.rows["ghost"] = _creds()
+        cache._on_notify("99")
+        return await cache.get(None, "ghost")
+
+    assert asyncio.run(run()) is not None
+    assert loader.loads == 2
+
+
+def test_wildcard_and_reconnect_clear_everything(loader):
+    cache = CredentialCache()
+    asyncio.run(cache.get(None, "c1"))
+    cache.mark_unknown_key("c1", "old")
+    cache._on_notify("*")
+    assert not cache.is_known_unknown("c1", "old")
+    asyncio.run(cache.get(None, "c1"))
+    assert loader.loads == 2
+
+
+def test_repository_notify_reaches_other_workers(loader, monkeypatch):
+    local, remote = CredentialCache(), CredentialCache()
+    listener = PgListener()
+    remote.subscribe(listener)
+    monkeypatch.setattr(module, "credential_cache", local)
+    db = FakeSession()
+
+    async def run():
+        await local.get(None, "c1")
+        await remote.get(None, "c1")
+        await notify_credentials_changed(db, 7)
+        # Postgres entrega el NOTIFY al listener de cada worker tras el commit
+        for params in db.statements("pg_notify"):
+            listener._dispatch(None, 0, params["ch"], params["p"])
+        await local.get(None, "c1")
+        await remote.get(None, "c1")
+
+    asyncio.run(run())
+    assert db.statements("pg_notify") == [{"ch": CHANNEL, "p": "7"}]
+    assert loader.loads == 4
+
+
+def test_listener_reconnect_flushes_the_cache(loader):
+    cache = CredentialCache()
+    listener = PgListener()
+    cache.subscribe(listener)
+    asyncio.run(cache.get(None, "c1"))
+    # NOTIFYs perdidos mientras no había conexión: no se puede confiar en nada
+    listener._reset_all()
+    asyncio.run(cache.get(None, "c1"))
+    assert loader.loads == 2
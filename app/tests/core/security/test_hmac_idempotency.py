@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import time
+
+import httpx
+import pytest
+from fastapi import APIRouter, Depends, FastAPI
+
+from app.api.middlewares import BodyBufferMiddleware, IdempotentRoute
+from app.core.security import credential_cache as credential_cache_module
+from app.core.security import nonce_store
+from app.core.security.credential_cache import CachedKey, ClientCredentials
+from app.core.security.hmac_auth import _canonical_v1, hmac_auth
+from app.core.security.nonce_store import PostgresNonceStore
+
+_BODY = b'{"amount": 100}'
+
+
+@pytest.fixture
+def credentials(monkeypatch, security, memory_db):
+    security(ENABLE_NONCE=True, ENABLE_TIMESTAMP=True, NONCE_BACKEND="postgres", KEY_USAGE_FLUSH_SECONDS=0)
+    creds = ClientCredentials(cod=1, client_id="c1", keys={"k1": CachedKey(cod=10, kid="k1", secret="s")})
+
+    async def _get(session, client_id):
+        return creds if client_id == "c1" else None
+
+    monkeypatch.setattr(credential_cache_module.credential_cache, "get", _get)
+    store = PostgresNonceStore()
+    monkeypatch.setattr(store, "_sessions", memory_db.session)
+    monkeypatch.setattr(nonce_store, "_store", store)
+    return creds
+
+
+def _app(calls: list) -> FastAPI:
+    router = APIRouter(route_class=IdempotentRoute)
+
+    @router.post("/pay", status_code=201)
+    async def pay(payload: dict, principal=Depends(hmac_auth)):
+        calls.append(payload)
+        return {"ok": True}
+
+    app = FastAPI()
+    app.add_middleware(BodyBufferMiddleware)
+    app.include_router(router)
+    return app
+
+
+def _headers(creds: ClientCredentials, nonce: str, signature=None, timestamp: bool = True):
+    ts = str(int(time.time())) if timestamp else ""
+    message = _canonical_v1(
+        "POST", "/pay", "", "c1", "k1", ts, nonce, hashlib.sha256(_BODY).hexdigest()
+    )
+    headers = {
+        "X-Client-Id": "c1",
+        "X-Key-Id": "k1",
+        "X-Nonce": nonce,
+        "X-Signature": signature or creds.verifier.sign("k1", message),
+        "Idempotency-Key": "pay-1",
+        "content-type": "application/json",
+    }
+    if timestamp:
+        headers["X-Timestamp"] = ts
+    return headers
+
+
+async def _post(app: FastAPI, headers) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/pay", content=_BODY, headers=headers)
+
+
+def test_rejected_signature_leaves_no_idempotency_row(credentials, memory_db):
+    calls: list = []
+    app = _app(calls)
+
+    resp = asyncio.run(_post(app, _headers(credentials, "n-1", signature="forged")))
+    assert resp.status_code == 401
+    assert resp.json()["detail"] == "invalid signature"
+    assert memory_db.row("c1", "pay-1") is None
+    assert memory_db.nonces == set()
+
+    # la clave no quedó envenenada: el request legítimo se procesa
+    resp = asyncio.run(_post(app, _headers(credentials, "n-2")))
+    assert resp.status_code == 201
+    assert calls == [{"amount": 100}]
+    assert memory_db.row("c1", "pay-1")["status"] == "success"
+    assert memory_db.nonces == {("c1", "n-2")}
+
+
+def test_nonce_only_signs_without_timestamp(credentials, memory_db, security):
+    # sin ENABLE_TIMESTAMP la cadena firmada no lleva timestamp (layout v1 original)
+    security(ENABLE_TIMESTAMP=False)
+    calls: list = []
+    resp = asyncio.run(_post(_app(calls), _headers(credentials, "n-1", timestamp=False)))
+    assert resp.status_code == 201
+    assert memory_db.nonces == {("c1", "n-1")}
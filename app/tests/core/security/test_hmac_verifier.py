@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import hmac
+from datetime import UTC, datetime, timedelta
+
+from app.core.security import hmac_verifier
+from app.core.security.credential_cache import CachedKey
+from app.core.security.hmac_verifier import HmacVerifier
+
+
+def _reference(secret: str, message: str) -> str:
+    digest = hmac.new(secret.encode(), message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def _keys(**secrets) -> dict:
+    return {kid: CachedKey(cod=i, kid=kid, secret=secret) for i, (kid, secret) in enumerate(secrets.items())}
+
+
+def test_keyed_state_is_built_once_and_cloned(monkeypatch):
+    expected = {message: _reference("s1", message) for message in ("a", "b")}
+    built: list = []
+    real_new = hmac.new
+
+    def counting_new(key, *args, **kwargs):
+        built.append(key)
+        return real_new(key, *args, **kwargs)
+
+    monkeypatch.setattr(hmac_verifier.hmac, "new", counting_new)
+    verifier = HmacVerifier(_keys(k1="s1"))
+    for message in ("a", "b", "a"):
+        assert verifier.sign("k1", message) == expected[message]
+    # el estado base no se ensucia con los updates de cada verificación
+    assert built == [b"s1"]
+
+
+def test_every_active_kid_verifies_during_rotation():
+    verifier = HmacVerifier(_keys(old="s-old", new="s-new"))
+    assert verifier.verify("old", "m", _reference("s-old", "m"))
+    assert verifier.verify("new", "m", _reference("s-new", "m"))
+    assert not verifier.verify("new", "m", _reference("s-old", "m"))
+    assert not verifier.verify("gone", "m", _reference("s-old", "m"))
+    assert not verifier.verify("old", "m", None)
+
+
+def test_expired_key_stops_verifying_and_drops_its_state():
+    keys = _keys(k1="s1")
+    verifier = HmacVerifier(keys)
+    assert verifier.verify("k1", "m", _reference("s1", "m"))
+    keys["k1"] = CachedKey(cod=0, kid="k1", secret="s1", expires_at=datetime.now(UTC) - timedelta(seconds=1))
+    assert not verifier.verify("k1", "m", _reference("s1", "m"))
+    assert "k1" not in verifier._states
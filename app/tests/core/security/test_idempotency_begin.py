@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.core.security.idempotency import _CLAIM_SQL, _PEEK_SQL, begin_idempotency
+from app.core.security.idempotency_cache import idempotency_cache
+from app.tests.conftest import FakeResult, FakeSession
+
+
+@pytest.fixture(autouse=True)
+def enabled(security):
+    security(ENABLE_IDEMPOTENCY=True)
+    idempotency_cache.clear()
+    yield
+    idempotency_cache.clear()
+
+
+def _row(status="processing", http_status=None, response_json=None, created=False, owned=False):
+    return (11, status, http_status, response_json, None, None, None, None, created, owned)
+
+
+def _begin(claim_rows, peek_rows=()):
+    def respond(sql, params):
+        return FakeResult(claim_rows if sql == _CLAIM_SQL.text else peek_rows)
+
+    session = FakeSession(respond)
+    result = asyncio.run(
+        begin_idempotency(session, client_id="c1", key="k", request_fingerprint="fp", lease_owner="me")
+    )
+    return result, session
+
+
+def test_new_key_is_claimed_in_one_statement():
+    result, session = _begin([_row(created=True, owned=True)])
+    assert [sql for sql, _ in session.executed] == [_CLAIM_SQL.text]
+    assert session.executed[0][1]["owner"] == "me"
+    assert session.commits == 1
+    assert result == {
+        "record_id": 11, "cached": False, "in_progress": False,
+        "created": True, "reclaimed": False, "lease_owner": "me",
+    }
+
+
+def test_completed_key_returns_the_stored_response_from_the_same_statement():
+    result, session = _begin([_row(status="success", http_status=201, response_json={"id": 5})])
+    assert len(session.executed) == 1
+    assert (result["cached"], result["cached_status"], result["cached_body"]) == (True, 201, {"id": 5})
+    assert idempotency_cache.get("c1", "k") is not None
+
+
+def test_key_held_by_another_request_is_in_progress():
+    result, session = _begin([_row()])
+    assert len(session.executed) == 1
+    assert result["in_progress"] and not result["cached"]
+
+
+def test_abandoned_claim_is_taken_over():
+    result, _ = _begin([_row(owned=True)])
+    assert (result["created"], result["reclaimed"], result["in_progress"]) == (False, True, False)
+
+
+def test_locked_key_falls_back_to_a_plain_read():
+    result, session = _begin([], peek_rows=[])
+    assert [sql for sql, _ in session.executed] == [_CLAIM_SQL.text, _PEEK_SQL.text]
+    assert result == {"record_id": None, "cached": False, "in_progress": True, "created": False}
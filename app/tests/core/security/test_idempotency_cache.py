@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import httpx
+from fastapi import APIRouter, FastAPI
+
+from app.api.middlewares import BodyBufferMiddleware, IdempotentRoute
+from app.core.database.pg_listener import PgListener
+from app.core.security import idempotency_cache as module
+from app.core.security.idempotency_cache import (
+    _ENTRY_OVERHEAD,
+    IdempotencyResponseCache,
+    notify_idempotency_changed,
+)
+from app.tests.conftest import FakeSession
+
+
+def test_lru_is_bounded_by_bytes(security):
+    # cada entrada de 100 bytes de body ocupa 100 + overhead; entran dos
+    security(IDEMPOTENCY_CACHE_MAX_BYTES=2 * (100 + _ENTRY_OVERHEAD) + 50, IDEMPOTENCY_CACHE_MAX_ENTRY_BYTES=10_000)
+    cache = IdempotencyResponseCache()
+    for key in ("a", "b"):
+        cache.put_raw("c1", key, 201, b"x" * 100, "text/plain", None)
+    assert cache.get("c1", "a") is not None  # "a" pasa a ser la más reciente
+    cache.put_raw("c1", "c", 201, b"x" * 100, "text/plain", None)
+    assert [k for k in ("a", "b", "c") if cache.get("c1", k)] == ["a", "c"]
+    assert cache.size_bytes == 2 * (100 + _ENTRY_OVERHEAD)
+
+
+def test_oversized_entries_and_expired_entries_are_not_served(security, monkeypatch):
+    security(IDEMPOTENCY_CACHE_MAX_ENTRY_BYTES=_ENTRY_OVERHEAD + 10, IDEMPOTENCY_CACHE_TTL_SECONDS=5)
+    cache = IdempotencyResponseCache()
+    cache.put_raw("c1", "big", 200, b"x" * 11, None, None)
+    assert cache.get("c1", "big") is None and len(cache) == 0
+
+    cache.put("c1", "small", 200, {"ok": 1})
+    assert cache.get("c1", "small").body == b'{"ok":1}'
+    now = module.time.monotonic()
+    monkeypatch.setattr(module.time, "monotonic", lambda: now + 6)
+    assert cache.get("c1", "small") is None
+    assert cache.size_bytes == 0
+
+
+def test_changes_invalidate_every_worker(monkeypatch):
+    local, remote = IdempotencyResponseCache(), IdempotencyResponseCache()
+    listener = PgListener()
+    remote.subscribe(listener)
+    for cache in (local, remote):
+        cache.put("c1", "k", 201, {"ok": True})
+        cache.put("c1", "other", 201, {"ok": True})
+
+    db = FakeSession()
+    monkeypatch.setattr(module, "idempotency_cache", local)
+    asyncio.run(notify_idempotency_changed(db, "c1", "k"))
+    [params] = db.statements("pg_notify")
+    assert json.loads(params["p"]) == ["c1", "k"]
+    listener._dispatch(None, 0, params["ch"], params["p"])
+
+    for cache in (local, remote):
+        assert cache.get("c1", "k") is None
+        assert cache.get("c1", "other") is not None
+    listener._reset_all()
+    assert len(remote) == 0
+
+
+def test_completed_retry_is_answered_without_touching_the_db(memory_db, monkeypatch):
+    claims: list = []
+    real_claim = memory_db.claim
+
+    def counting_claim(p, session):
+        claims.append(p["k"])
+        return real_claim(p, session)
+
+    monkeypatch.setattr(memory_db, "claim", counting_claim)
+    router = APIRouter(route_class=IdempotentRoute)
+
+    @router.post("/pay", status_code=201)
+    async def pay(payload: dict):
+        return {"paid": payload["amount"]}
+
+    app = FastAPI()
+    app.add_middleware(BodyBufferMiddleware)
+    app.include_router(router)
+    headers = {"Idempotency-Key": "k-1", "X-Client-Id": "c1", "content-type": "application/json"}
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            first = await client.post("/pay", content=b'{"amount": 5}', headers=headers)
+            retry = await client.post("/pay", content=b'{"amount": 5}', headers=headers)
+            return first, retry
+
+    first, retry = asyncio.run(run())
+    assert first.status_code == retry.status_code == 201
+    assert retry.content == first.content
+    assert claims == ["k-1"]
@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+from fastapi import APIRouter, FastAPI, HTTPException
+
+from app.api.middlewares import BodyBufferMiddleware, IdempotentRoute
+from app.core.security.idempotency import begin_idempotency
+
+
+def _begin(session, key: str = "k-1"):
+    return begin_idempotency(session, client_id="c1", key=key, request_fingerprint="fp", commit=False)
+
+
+def test_concurrent_duplicate_does_not_wait_for_uncommitted_claim(memory_db):
+    async def run():
+        original, duplicate = memory_db.session(), memory_db.session()
+        first = await _begin(original)
+        # el claim sigue sin confirmar: el duplicado no espera, sale in_progress
+        busy = await asyncio.wait_for(_begin(duplicate), 0.5)
+        await duplicate.rollback()
+        other_key = await _begin(duplicate, key="k-2")
+        await duplicate.rollback()
+        # el original falla: la clave queda libre para el reintento
+        await original.rollback()
+        retry = await _begin(duplicate)
+        return first, busy, other_key, retry
+
+    first, busy, other_key, retry = asyncio.run(run())
+    assert first["created"]
+    assert busy["in_progress"] and not busy.get("cached")
+    assert other_key["created"]
+    assert retry["created"]
+
+
+def test_waiting_retry_takes_over_when_original_fails(memory_db, security):
+    security(IDEMPOTENCY_WAIT_SECONDS=5, IDEMPOTENCY_WAIT_POLL_SECONDS=5)
+    gate = asyncio.Event()
+    calls: list = []
+    router = APIRouter(route_class=IdempotentRoute)
+
+    @router.post("/pay", status_code=201)
+    async def pay(payload: dict):
+        calls.append(payload)
+        if len(calls) == 1:
+            await gate.wait()
+            raise HTTPException(status_code=503, detail="upstream down")
+        return {"ok": True}
+
+    app = FastAPI()
+    app.add_middleware(BodyBufferMiddleware)
+    app.include_router(router)
+    headers = {"Idempotency-Key": "k-1", "X-Client-Id": "c1", "content-type": "application/json"}
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            original = asyncio.create_task(client.post("/pay", content=b"{}", headers=headers))
+            await asyncio.sleep(0.05)
+            retry = asyncio.create_task(client.post("/pay", content=b"{}", headers=headers))
+            await asyncio.sleep(0.05)
+            started = loop.time()
+            gate.set()
+            return await original, await retry, loop.time() - started
+
+    original, retry, waited = asyncio.run(run())
+    assert original.status_code == 503
+    assert retry.status_code == 201
+    assert len(calls) == 2
+    # despertado por el rollback del original, no por el poll
+    assert waited < 1
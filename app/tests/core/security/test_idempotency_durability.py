@@ -0,0 +1,97 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.api.middlewares import BodyBufferMiddleware, IdempotentRoute
+from app.api.middlewares import idempotent_route
+from app.core.database.bootstrap_app_scheme.retention import AbandonedClaimSweeper
+from app.core.security.idempotency import NOT_STORED_STATUS
+from app.core.security.idempotency_cache import idempotency_cache
+from app.core.security.idempotency_finalizer import finalize_queue
+
+
+@pytest.fixture
+def app(memory_db, security):
+    # ventana larga: nada de lo encolado llega a la DB antes del "crash"
+    security(IDEMPOTENCY_FINALIZE_WINDOW_MS=60_000, IDEMPOTENCY_WAIT_SECONDS=0)
+    calls: list = []
+    router = APIRouter(route_class=IdempotentRoute)
+
+    @router.post("/pay", status_code=201)
+    async def pay(payload: dict):
+        calls.append(payload)
+        return {"paid": payload["amount"]}
+
+    @router.post("/export")
+    async def export():
+        calls.append("export")
+
+        async def rows():
+            yield b"a,b\n"
+            yield b"1,2\n"
+        return StreamingResponse(rows(), media_type="text/csv")
+
+    app = FastAPI()
+    app.add_middleware(BodyBufferMiddleware)
+    app.include_router(router)
+    app.state.calls = calls
+    yield app
+    finalize_queue._pending.clear()
+
+
+async def _post(app: FastAPI, path: str) -> httpx.Response:
+    headers = {"Idempotency-Key": "k-1", "X-Client-Id": "c1", "content-type": "application/json"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post(path, content=b'{"amount": 5}', headers=headers)
+
+
+async def _crash() -> None:
+    """El proceso muere: lo encolado y el cache en memoria se pierden sin escribirse."""
+    if idempotent_route._stream_finalizers:
+        await asyncio.gather(*idempotent_route._stream_finalizers)
+    task, finalize_queue._task = finalize_queue._task, None
+    task.cancel()
+    finalize_queue._pending.clear()
+    idempotency_cache.clear()
+
+
+def _expire(memory_db) -> None:
+    row = memory_db.row("c1", "k-1")
+    if row["lease_expires_at"] is not None:
+        row["lease_expires_at"] = 0.0
+
+
+def test_finalized_response_survives_crash_and_sweep(app, memory_db):
+    async def run():
+        await finalize_queue.start()
+        first = await _post(app, "/pay")
+        await _crash()
+        _expire(memory_db)
+        await AbandonedClaimSweeper().sweep()
+        return first, await _post(app, "/pay")
+
+    first, retry = asyncio.run(run())
+    assert first.status_code == retry.status_code == 201
+    assert retry.json() == {"paid": 5}
+    assert app.state.calls == [{"amount": 5}]
+
+
+def test_stream_lost_before_body_is_not_reexecuted(app, memory_db):
+    async def run():
+        await finalize_queue.start()
+        first = await _post(app, "/export")
+        await _crash()
+        _expire(memory_db)
+        busy = await _post(app, "/export")  # lease vencido, pero el handler ya confirmó
+        await AbandonedClaimSweeper().sweep()
+        return first, busy, await _post(app, "/export")
+
+    first, busy, retry = asyncio.run(run())
+    assert first.status_code == 200 and first.content == b"a,b\n1,2\n"
+    assert busy.status_code == 409 and busy.json()["detail"] == "request in progress"
+    assert retry.status_code == NOT_STORED_STATUS
+    assert retry.json() == {"detail": "response not stored", "original_status": 200}
+    assert app.state.calls == ["export"]
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc as sa_exc
+
+from app.core.security.idempotency_finalizer import FinalizeQueue
+
+
+class FakeWriter:
+    """Reemplaza `_write`: falla con los record_id marcados y anota lo escrito."""
+
+    def __init__(self, poison=(), transient_once: bool = False) -> None:
+        self.poison = set(poison)
+        self.transient_once = transient_once
+        self.written: list[int] = []
+        self.calls = 0
+
+    async def __call__(self, batch) -> None:
+        self.calls += 1
+        ids = [kwargs["record_id"] for kwargs, _ in batch]
+        if self.transient_once:
+            self.transient_once = False
+            raise sa_exc.OperationalError("UPDATE", {}, ConnectionResetError())
+        if self.poison.intersection(ids):
+            raise sa_exc.DataError("UPDATE", {}, ValueError("invalid input"))
+        self.written.extend(ids)
+
+
+@pytest.fixture
+def make_queue(monkeypatch, security):
+    def _make(writer: FakeWriter, ids, attempts: int = 3) -> FinalizeQueue:
+        security(IDEMPOTENCY_FINALIZE_MAX_ATTEMPTS=attempts, IDEMPOTENCY_FINALIZE_BATCH_MAX=8)
+        queue = FinalizeQueue()
+        monkeypatch.setattr(queue, "_write", writer)
+        queue._pending.extend(({"record_id": i, "http_status": 200}, 0) for i in ids)
+        return queue
+
+    return _make
+
+
+def test_poison_row_is_isolated_and_dropped(make_queue):
+    writer = FakeWriter(poison={3})
+    queue = make_queue(writer, range(1, 9))
+    asyncio.run(queue.flush())
+    assert sorted(writer.written) == [1, 2, 4, 5, 6, 7, 8]
+    assert len(queue) == 0
+
+
+def test_poison_row_does_not_block_later_rows(make_queue):
+    writer = FakeWriter(poison={1})
+    queue = make_queue(writer, range(1, 3), attempts=2)
+    asyncio.run(queue.flush())
+    assert writer.written == [2]
+    assert len(queue) == 0
+
+
+def test_transient_error_requeues_whole_batch(make_queue):
+    writer = FakeWriter(transient_once=True)
+    queue = make_queue(writer, range(1, 5))
+    with pytest.raises(sa_exc.OperationalError):
+        asyncio.run(queue.flush())
+    assert [kwargs["record_id"] for kwargs, attempts in queue._pending] == [1, 2, 3, 4]
+    assert all(attempts == 0 for _, attempts in queue._pending)
+    asyncio.run(queue.flush())
+    assert writer.written == [1, 2, 3, 4]
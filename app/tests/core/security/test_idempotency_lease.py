@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app.core.security import idempotency_lease
+from app.core.security.idempotency_lease import LeaseHeartbeat
+from app.tests.conftest import FakeResult, FakeSession
+
+
+class LeaseRows:
+    """Fila del claim: anota cada renovación; `locked` = tomada por otra transacción."""
+
+    def __init__(self) -> None:
+        self.renewals: list[dict] = []
+        self.locked = False
+
+    def __call__(self, sql, params):
+        if "lease_expires_at" not in sql:
+            return None
+        if self.locked:
+            return FakeResult(rowcount=0)
+        self.renewals.append(params)
+        return FakeResult(rowcount=1)
+
+
+@pytest.fixture
+def rows(monkeypatch):
+    rows = LeaseRows()
+    monkeypatch.setattr(idempotency_lease, "AsyncSessionLocal", lambda: FakeSession(rows))
+    return rows
+
+
+def test_heartbeat_renews_until_stopped(rows, security):
+    security(IDEMPOTENCY_LEASE_SECONDS=0.06)
+
+    async def run():
+        heartbeat = LeaseHeartbeat(7, "owner-a").start()
+        await asyncio.sleep(0.07)
+        heartbeat.stop()
+        renewed = len(rows.renewals)
+        await asyncio.sleep(0.05)
+        return renewed
+
+    renewed = asyncio.run(run())
+    assert renewed >= 2
+    assert len(rows.renewals) == renewed
+    assert rows.renewals[0] == {"id": 7, "owner": "owner-a", "lease": 0.06}
+
+
+def test_heartbeat_stops_at_max_seconds(rows, security):
+    security(IDEMPOTENCY_LEASE_SECONDS=0.03, IDEMPOTENCY_LEASE_MAX_SECONDS=0.05)
+
+    async def run():
+        heartbeat = LeaseHeartbeat(7, "owner-a").start()
+        await asyncio.sleep(0.1)
+        heartbeat.stop()
+
+    asyncio.run(run())
+    assert 1 <= len(rows.renewals) <= 4
+
+
+def test_renew_if_due_uses_request_session_when_row_was_locked(rows, security):
+    security(IDEMPOTENCY_LEASE_SECONDS=0.03)
+
+    async def run():
+        rows.locked = True
+        heartbeat = LeaseHeartbeat(7, "owner-a").start()
+        await asyncio.sleep(0.02)
+        await heartbeat.renew_if_due(FakeSession(rows))  # todavía al día: no renueva
+        assert rows.renewals == []
+        await asyncio.sleep(0.02)  # la renovación de fondo encontró la fila bloqueada
+        rows.locked = False
+        await heartbeat.renew_if_due(FakeSession(rows))
+        heartbeat.stop()
+
+    asyncio.run(run())
+    assert len(rows.renewals) == 1
+
+
+def test_heartbeat_disabled_without_owner(rows, security):
+    security(IDEMPOTENCY_LEASE_SECONDS=0.03)
+
+    async def run():
+        heartbeat = LeaseHeartbeat(7, None).start()
+        await asyncio.sleep(0.05)
+        await heartbeat.renew_if_due(FakeSession(rows))
+        heartbeat.stop()
+
+    asyncio.run(run())
+    assert rows.renewals == []
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from app.core.compression import OMITTED
+from app.core.security import idempotency
+from app.core.security.idempotency import NOT_STORED_STATUS, begin_idempotency, finalize_idempotency
+from app.core.security.idempotency_cache import idempotency_cache
+from app.tests.conftest import FakeResult, FakeSession
+
+
+@pytest.fixture(autouse=True)
+def _enabled(security):
+    security(ENABLE_IDEMPOTENCY=True)
+    idempotency_cache.clear()
+
+
+def _claim_row(codec):
+    # id, status, http_status, json, body, codec, media type, headers, created, owned
+    return (1, "success", 200, None, b"", codec, "text/csv", {"etag": "x"}, False, False)
+
+
+def test_omitted_response_replays_as_not_stored():
+    session = FakeSession(lambda sql, params: FakeResult([_claim_row(OMITTED)]))
+    idem = asyncio.run(begin_idempotency(
+        session, client_id="c1", key="k-omitted", request_fingerprint="fp", commit=False,
+    ))
+    assert idem["cached"]
+    assert idem["cached_status"] == NOT_STORED_STATUS
+    assert idem["cached_body"] == {"detail": "response not stored", "original_status": 200}
+    assert "cached_raw" not in idem
+    hit = idempotency_cache.get("c1", "k-omitted")
+    assert hit is not None and hit.status_code == NOT_STORED_STATUS
+
+
+def test_finalize_omitted_caches_not_stored(monkeypatch):
+    monkeypatch.setattr(idempotency, "relaxed_commit", lambda session: session.commit())
+    session = FakeSession(lambda sql, params: FakeResult(rowcount=1))
+    asyncio.run(finalize_idempotency(
+        session, record_id=1, http_status=201, response_obj=None, relaxed=True,
+        client_id="c1", key="k-cut", omitted=True,
+    ))
+    (params,) = session.statements("UPDATE")
+    assert params["codec"] == OMITTED
+    assert params["st"] == 201
+    hit = idempotency_cache.get("c1", "k-cut")
+    assert hit is not None and hit.status_code == NOT_STORED_STATUS
@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI
+
+from app.api.middlewares import BodyBufferMiddleware, IdempotentRoute
+from app.core.database.pg_listener import PgListener
+from app.core.security.idempotency_waiters import CHANNEL, CompletionWaiters, notify_completed
+from app.tests.conftest import FakeSession
+
+
+def test_signal_wakes_only_the_matching_key():
+    waiters = CompletionWaiters()
+
+    async def run():
+        with waiters.subscribe("c1", "a") as a, waiters.subscribe("c1", "b") as b:
+            assert len(waiters) == 2
+            waiters.signal("c1", "a")
+            return a.is_set(), b.is_set()
+
+    assert asyncio.run(run()) == (True, False)
+    assert len(waiters) == 0
+
+
+def test_notify_from_another_worker_wakes_the_waiter():
+    waiters = CompletionWaiters()
+    listener = PgListener()
+    waiters.subscribe_listener(listener)
+    db = FakeSession()
+
+    async def run():
+        with waiters.subscribe("c1", "k") as done, waiters.subscribe("c2", "k") as other:
+            await notify_completed(db, "c1", "k")
+            [params] = db.statements("pg_notify")
+            listener._dispatch(None, 0, CHANNEL, params["p"])
+            woken = done.is_set(), other.is_set()
+            # avisos perdidos durante una reconexión: todos vuelven a consultar
+            listener._reset_all()
+            return woken, other.is_set()
+
+    assert asyncio.run(run()) == ((True, False), True)
+
+
+@pytest.fixture
+def app(memory_db, security):
+    gate = asyncio.Event()
+    calls: list = []
+    router = APIRouter(route_class=IdempotentRoute)
+
+    @router.post("/pay", status_code=201)
+    async def pay(payload: dict):
+        calls.append(payload)
+        await gate.wait()
+        return {"paid": payload["amount"]}
+
+    app = FastAPI()
+    app.add_middleware(BodyBufferMiddleware)
+    app.include_router(router)
+    app.state.gate, app.state.calls = gate, calls
+    return app
+
+
+async def _original_and_retry(app: FastAPI, release_after: float):
+    headers = {"Idempotency-Key": "k-1", "X-Client-Id": "c1", "content-type": "application/json"}
+    loop = asyncio.get_running_loop()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+
+        async def timed_retry():
+            started = loop.time()
+            resp = await client.post("/pay", content=b'{"amount": 5}', headers=headers)
+            return resp, loop.time() - started
+
+        original = asyncio.create_task(client.post("/pay", content=b'{"amount": 5}', headers=headers))
+        await asyncio.sleep(0.05)
+        retry = asyncio.create_task(timed_retry())
+        await asyncio.sleep(release_after)
+        app.state.gate.set()
+        return (await original, *await retry)
+
+
+def test_retry_receives_the_response_once_the_original_finishes(app, security):
+    security(IDEMPOTENCY_WAIT_SECONDS=5, IDEMPOTENCY_WAIT_POLL_SECONDS=5)
+    original, retry, waited = asyncio.run(_original_and_retry(app, release_after=0.1))
+    assert waited >= 0.1
+    assert original.status_code == retry.status_code == 201
+    assert retry.json() == {"paid": 5}
+    assert app.state.calls == [{"amount": 5}]
+    # despertado por la señal del finalize, no por el poll de 5 s
+    assert waited < 1
+
+
+def test_wait_is_bounded(app, security):
+    security(IDEMPOTENCY_WAIT_SECONDS=0.2, IDEMPOTENCY_WAIT_POLL_SECONDS=0.05)
+    _, retry, waited = asyncio.run(_original_and_retry(app, release_after=0.5))
+    assert retry.status_code == 409 and 0.2 <= waited < 0.5
+
+
+def test_without_wait_seconds_in_progress_is_an_immediate_409(app, security):
+    security(IDEMPOTENCY_WAIT_SECONDS=0)
+    _, retry, waited = asyncio.run(_original_and_retry(app, release_after=0.3))
+    assert retry.status_code == 409 and waited < 0.3
+    assert retry.json()["detail"] == "request in progress"
@@ -0,0 +1,39 @@
+from app.core.security.ip_matcher import CidrMatcher
+
+
+def test_most_specific_rule_wins():
+    m = CidrMatcher(["10.0.0.0/8", "10.1.0.0/16", "2001:db8::/32", "bogus"])
+    assert len(m) == 3
+    assert m.match("10.1.2.3") == "10.1.0.0/16"
+    assert m.match("10.2.0.1") == "10.0.0.0/8"
+    assert m.match("2001:db8::1") == "2001:db8::/32"
+    assert m.match("11.0.0.1") is None
+    assert m.match("not-an-ip") is None
+
+
+def test_mapped_client_matches_ipv4_rule():
+    m = CidrMatcher(["10.0.0.0/8"])
+    assert m.match("::ffff:10.1.2.3") == "10.0.0.0/8"
+
+
+def test_mapped_rule_stays_ipv6_and_matches_both_client_forms():
+    m = CidrMatcher(["::ffff:10.0.0.0/104"])
+    assert m.match("::ffff:10.1.2.3") == "::ffff:10.0.0.0/104"
+    assert m.match("10.1.2.3") == "::ffff:10.0.0.0/104"
+    assert m.match("11.1.2.3") is None
+    # /104 mapeada no se vuelve IPv4 /8 para direcciones IPv6 que no son mapped
+    assert m.match("::10.1.2.3") is None
+
+
+def test_wide_ipv6_rule_does_not_cover_ipv4_clients():
+    m = CidrMatcher(["::/0"])
+    assert m.match("2001:db8::1") == "::/0"
+    assert m.match("10.1.2.3") is None
+    assert m.match("::ffff:10.1.2.3") is None
+
+
+def test_specificity_across_families():
+    m = CidrMatcher(["10.0.0.0/8", "::ffff:10.1.0.0/112"])
+    assert m.match("10.1.2.3") == "::ffff:10.1.0.0/112"
+    m = CidrMatcher(["10.1.2.0/24", "::ffff:10.0.0.0/104"])
+    assert m.match("::ffff:10.1.2.3") == "10.1.2.0/24"
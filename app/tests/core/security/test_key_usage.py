@@ -0,0 +1,59 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from app.core.security import key_usage as module
+from app.core.security.key_usage import KeyUsageRecorder
+from app.tests.conftest import FakeSession
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    opened: list = []
+
+    def _factory():
+        opened.append(FakeSession())
+        return opened[-1]
+
+    monkeypatch.setattr(module, "AsyncSessionLocal", _factory)
+    return opened
+
+
+def test_uses_are_coalesced_into_one_batched_update(sessions):
+    recorder = KeyUsageRecorder()
+    for cod in (10, 11, 10, 10):
+        recorder.record(cod)
+    latest = recorder._pending[10]
+
+    assert asyncio.run(recorder.flush()) == 2
+    [session] = sessions
+    [params] = session.statements("client_keys")
+    assert params["ids"] == [10, 11] and params["used"][0] == latest
+    # telemetría: commit relajado, sin esperar al WAL
+    assert session.statements("synchronous_commit = off") and session.commits == 1
+    assert asyncio.run(recorder.flush()) == 0 and len(sessions) == 1
+
+
+def test_failed_flush_requeues_without_overwriting_newer_uses(sessions, monkeypatch):
+    recorder = KeyUsageRecorder()
+    recorder.record(10)
+    recorder.record(11)
+    stale, newer = dict(recorder._pending), {}
+
+    async def boom(session):
+        newer[11] = recorder._pending[11] = stale[11] + timedelta(seconds=1)  # uso nuevo mientras el lote falla
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(module, "relaxed_commit", boom)
+    with pytest.raises(RuntimeError):
+        asyncio.run(recorder.flush())
+    assert recorder._pending[10] == stale[10]
+    assert recorder._pending[11] == newer[11]
+
+
+def test_zero_interval_disables_the_flusher(security):
+    security(KEY_USAGE_FLUSH_SECONDS=0)
+    recorder = KeyUsageRecorder()
+    asyncio.run(recorder.start())
+    assert not recorder.enabled and recorder._task is None
@@ -0,0 +1,44 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+
+from app.core.security.credential_cache import _CREDENTIALS_SQL, load_credentials
+from app.tests.conftest import FakeResult, FakeSession
+
+_FUTURE = datetime.now(UTC) + timedelta(days=1)
+
+
+def _row(expires=(None, _FUTURE)):
+    return (
+        7, 120, 10,
+        ["10.0.0.0/8", "192.168.1.5/32"],
+        [70, 71], ["k1", "k2"], ["s1", "s2"], list(expires),
+    )
+
+
+def test_one_statement_loads_client_cidrs_and_keys():
+    session = FakeSession(lambda sql, params: FakeResult([_row()]))
+    creds = asyncio.run(load_credentials(session, "c1"))
+
+    assert len(session.executed) == 1
+    assert session.executed[0] == (_CREDENTIALS_SQL.text, {"cid": "c1"})
+    assert (creds.cod, creds.rate_per_minute, creds.rate_burst) == (7, 120, 10)
+    assert creds.ip_rules.match("10.1.2.3") == "10.0.0.0/8"
+    assert creds.ip_rules.match("172.16.0.1") is None
+    assert creds.active_key("k1").secret == "s1"
+    assert creds.active_key("k2").cod == 71
+    assert creds.verifier.verify("k1", "msg", creds.verifier.sign("k1", "msg"))
+
+
+def test_unknown_or_inactive_client_is_none():
+    session = FakeSession()
+    assert asyncio.run(load_credentials(session, "ghost")) is None
+    assert len(session.executed) == 1
+
+
+def test_key_expiring_after_load_is_rejected_in_memory():
+    # la consulta filtra expires_at al cargar; el cache vuelve a mirarlo en cada uso
+    just_expired = datetime.now(UTC) - timedelta(seconds=1)
+    session = FakeSession(lambda sql, params: FakeResult([_row(expires=(just_expired, None))]))
+    creds = asyncio.run(load_credentials(session, "c1"))
+    assert creds.active_key("k1") is None
+    assert creds.active_key("k2") is not None
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, UTC
+
+import pytest
+from sqlalchemy import exc as sa_exc
+
+from app.core.database.bootstrap_app_scheme import nonce_partitions as module
+from app.core.database.bootstrap_app_scheme.nonce_partitions import NoncePartitionManager
+from app.tests.conftest import FakeResult, FakeSession
+
+_NOW = datetime(2026, 10, 18, 12, tzinfo=UTC)
+
+
+class LockTimeout(Exception):
+    sqlstate = "55P03"
+
+
+class Catalog:
+    """Particiones existentes; DETACH falla por lock_timeout las primeras `busy` veces."""
+
+    def __init__(self, busy: int) -> None:
+        self.busy = busy
+        self.detach_attempts = 0
+
+    def __call__(self, sql, params):
+        if "pg_try_advisory_lock" in sql:
+            return FakeResult([(True,)])
+        if "pg_inherits" in sql:
+            return FakeResult([
+                ("security_nonces_default",),
+                ("security_nonces_p20261010",),
+                ("security_nonces_p20261018",),
+                ("security_nonces_p20261019",),
+                ("security_nonces_p20261020",),
+            ])
+        if "DETACH PARTITION" in sql:
+            self.detach_attempts += 1
+            if self.busy:
+                self.busy -= 1
+                raise sa_exc.OperationalError(sql, params, LockTimeout("canceling statement due to lock timeout"))
+        return None
+
+
+@pytest.fixture
+def run(monkeypatch, security):
+    security(NONCE_PARTITION_LOCK_TIMEOUT_MS=1, NONCE_PARTITION_DDL_ATTEMPTS=3, NONCE_PARTITION_INTERVAL="day")
+
+    def _run(catalog: Catalog):
+        conn = FakeSession(catalog)
+        monkeypatch.setattr(module, "engine", type("E", (), {"connect": staticmethod(lambda: conn)}))
+        result = asyncio.run(NoncePartitionManager().maintain(_NOW))
+        return result, conn
+
+    return _run
+
+
+def test_detach_runs_under_lock_timeout_and_retries(run):
+    catalog = Catalog(busy=2)
+    (created, dropped), conn = run(catalog)
+    assert (created, dropped) == (0, 1)
+    assert catalog.detach_attempts == 3
+    assert conn.rollbacks == 2
+    statements = [sql for sql, _ in conn.executed]
+    detach = max(i for i, sql in enumerate(statements) if "DETACH" in sql)
+    assert "lock_timeout = '1ms'" in statements[detach - 1]
+    assert "DROP TABLE" in statements[detach + 1]
+    assert "pg_advisory_unlock" in statements[-1]
+
+
+def test_detach_gives_up_for_this_cycle(run):
+    catalog = Catalog(busy=10)
+    (created, dropped), conn = run(catalog)
+    assert dropped == 0
+    assert catalog.detach_attempts == 3
+    assert not conn.statements("DROP TABLE")
+    assert "pg_advisory_unlock" in conn.executed[-1][0]
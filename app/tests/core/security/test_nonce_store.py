@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.core.security import nonce_store
+from app.core.security.nonce_store import MemoryNonceStore, NonceStore, RedisNonceStore
+
+
+def _register(store: NonceStore, nonce: str, client_id: str = "c1") -> bool:
+    return asyncio.run(
+        store.register(None, integration_client_cod=1, client_id=client_id, nonce=nonce, request_ts=0)
+    )
+
+
+def test_nonce_store_is_abstract():
+    with pytest.raises(TypeError):
+        NonceStore()
+
+
+def test_redis_set_nx_rejects_replay(fake_redis):
+    redis = fake_redis
+    store = RedisNonceStore("redis://unused", ttl_seconds=60, client=redis)
+    assert _register(store, "n1")
+    assert not _register(store, "n1")
+    # mismo nonce de otro cliente es otra clave
+    assert _register(store, "n1", client_id="c2")
+    assert redis.ttl("nonce:c1:n1") == 60
+
+
+def test_redis_nonce_expires_after_ttl(fake_redis):
+    redis = fake_redis
+    store = RedisNonceStore("redis://unused", ttl_seconds=60, client=redis)
+    assert _register(store, "n1")
+    redis.advance(59)
+    assert not _register(store, "n1")
+    redis.advance(1)
+    assert _register(store, "n1")
+
+
+def test_redis_close(fake_redis):
+    redis = fake_redis
+    asyncio.run(RedisNonceStore("redis://unused", ttl_seconds=60, client=redis).close())
+    assert redis.closed
+
+
+def test_memory_store_replay_and_expiry(monkeypatch):
+    now = [5000.0]
+    monkeypatch.setattr(nonce_store.time, "monotonic", lambda: now[0])
+    store = MemoryNonceStore(ttl_seconds=60, shards=2, buckets=4)
+    assert _register(store, "n1")
+    assert not _register(store, "n1")
+    now[0] += 60
+    assert not _register(store, "n1")  # buckets enteros: se olvida un poco después del TTL
+    now[0] += 15
+    assert _register(store, "n1")
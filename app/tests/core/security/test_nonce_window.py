@@ -0,0 +1,26 @@
+import pytest
+from pydantic import ValidationError
+
+from app.core.config.security_settings import SecuritySettings
+from app.core.security.nonce_store import nonce_ttl_seconds
+
+
+def test_nonce_without_timestamp_warns():
+    with pytest.warns(UserWarning, match="ENABLE_TIMESTAMP"):
+        sec = SecuritySettings(ENABLE_NONCE=True, ENABLE_TIMESTAMP=False)
+    assert sec.ENABLE_NONCE and not sec.ENABLE_TIMESTAMP
+
+
+def test_nonce_without_timestamp_is_rejected_when_required():
+    with pytest.raises(ValidationError, match="ENABLE_TIMESTAMP"):
+        SecuritySettings(ENABLE_NONCE=True, ENABLE_TIMESTAMP=False, REQUIRE_TIMESTAMP_WITH_NONCE=True)
+
+
+def test_nonce_with_timestamp_is_accepted():
+    sec = SecuritySettings(ENABLE_NONCE=True, ENABLE_TIMESTAMP=True)
+    assert sec.ENABLE_NONCE and sec.ENABLE_TIMESTAMP
+
+
+def test_nonce_ttl_covers_timestamp_acceptance_window():
+    # un timestamp `skew` en el futuro se acepta hasta window + skew después de él
+    assert nonce_ttl_seconds() >= 300 + 2 * 60
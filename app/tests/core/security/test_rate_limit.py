@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from app.core.security.rate_limit import SharedTokenBucket, _key_hash
+
+SLOTS = 16
+
+
+def _colliding_keys(n: int) -> list[str]:
+    """n claves con el mismo slot base (misma cadena de sondeo)."""
+    by_home: dict[int, list[str]] = {}
+    i = 0
+    while True:
+        key = f"client:c{i}"
+        keys = by_home.setdefault(_key_hash(key) % SLOTS, [])
+        keys.append(key)
+        if len(keys) == n:
+            return keys
+        i += 1
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    b = SharedTokenBucket(str(tmp_path / "rl.bin"), SLOTS)
+    yield b
+    b.close()
+
+
+def test_drained_key_denied(bucket):
+    assert bucket.take("client:a", per_minute=1, burst=2).allowed
+    assert bucket.take("client:a", per_minute=1, burst=2).allowed
+    denied = bucket.take("client:a", per_minute=1, burst=2)
+    assert not denied.allowed
+    assert denied.retry_after >= 1
+    assert denied.headers()["Retry-After"] == str(denied.retry_after)
+
+
+def test_collision_chain_keeps_own_slot_after_earlier_slot_frees(bucket):
+    a, b = _colliding_keys(2)
+    # a ocupa el slot base con un bucket que se rellena casi al instante
+    assert bucket.take(a, per_minute=60_000, burst=1).allowed
+    # b cae en el siguiente slot de la cadena y se agota
+    assert bucket.take(b, per_minute=1, burst=2).allowed
+    assert bucket.take(b, per_minute=1, burst=2).allowed
+    assert not bucket.take(b, per_minute=1, burst=2).allowed
+
+    time.sleep(0.05)  # el slot base de a ya está lleno (reutilizable)
+
+    # b sigue en su propio slot: no recibe un bucket nuevo
+    assert not bucket.take(b, per_minute=1, burst=2).allowed
+    assert not bucket.take(b, per_minute=1, burst=2).allowed
+
+
+def test_expired_slot_reused_by_new_key(bucket):
+    a, b = _colliding_keys(2)
+    assert bucket.take(a, per_minute=60_000, burst=1).allowed
+    time.sleep(0.05)
+    # b reutiliza el slot base ya rellenado y a vuelve con bucket nuevo
+    assert bucket.take(b, per_minute=1, burst=1).allowed
+    assert not bucket.take(b, per_minute=1, burst=1).allowed
+    assert bucket.take(a, per_minute=60_000, burst=1).allowed
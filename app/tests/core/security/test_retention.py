@@ -0,0 +1,79 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from app.core.database.bootstrap_app_scheme import retention as module
+from app.core.database.bootstrap_app_scheme.retention import RetentionSweeper
+from app.tests.conftest import FakeResult, FakeSession
+
+_BASE = datetime(2026, 1, 1, tzinfo=UTC)
+
+
+class Table:
+    """Filas (fecha, cod) viejas; cada DELETE devuelve el siguiente lote por keyset."""
+
+    def __init__(self, n: int) -> None:
+        self.rows = [(_BASE + timedelta(minutes=i // 2), i) for i in range(1, n + 1)]
+
+    def delete(self, params):
+        after = (params["last_ts"], params["last_cod"])
+        batch = [r for r in self.rows if r[0] < params["cutoff"] and r > after][: params["n"]]
+        self.rows = [r for r in self.rows if r not in batch]
+        return FakeResult(batch)
+
+
+@pytest.fixture
+def sweep(monkeypatch, security):
+    security(RETENTION_BATCH_SIZE=3, RETENTION_BATCH_PAUSE_MS=0, IDEMPOTENCY_TTL_DAYS=14)
+
+    def _sweep(keys: Table, nonces: Table, locked: bool = True):
+        def respond(sql, params):
+            if "pg_try_advisory_lock" in sql:
+                return FakeResult([(locked,)])
+            if "idempotency_keys" in sql:
+                return keys.delete(params)
+            if "security_nonces" in sql:
+                return nonces.delete(params)
+            return None
+
+        conn = FakeSession(respond)
+        monkeypatch.setattr(module, "engine", type("E", (), {"connect": staticmethod(lambda: conn)}))
+        return asyncio.run(RetentionSweeper().sweep()), conn
+
+    return _sweep
+
+
+def test_expired_rows_are_deleted_in_keyset_batches(sweep):
+    keys, nonces = Table(7), Table(2)
+    report, conn = sweep(keys, nonces)
+
+    assert report.deleted == {"idempotency_keys": 7, "security_nonces": 2}
+    assert keys.rows == [] and nonces.rows == []
+    batches = conn.statements("DELETE FROM")
+    # 3 + 3 + 1 (lote corto => fin) para idempotency_keys, 2 para nonces
+    assert len(batches) == 4
+    # cada lote arranca después del último (fecha, cod) del anterior
+    assert [(b["last_ts"], b["last_cod"]) for b in batches[:3]] == [
+        (module._EPOCH, 0), (_BASE + timedelta(minutes=1), 3), (_BASE + timedelta(minutes=3), 6),
+    ]
+    assert all(b["n"] == 3 for b in batches)
+    # una transacción corta por lote, y el lock se suelta al final
+    assert conn.commits >= len(batches)
+    assert "pg_advisory_unlock" in conn.executed[-1][0]
+
+
+def test_cutoff_honors_idempotency_ttl_days(sweep):
+    keys = Table(1)
+    _, conn = sweep(keys, Table(0))
+    [first, *_] = conn.statements("idempotency_keys")
+    age = datetime.now(UTC) - first["cutoff"]
+    assert timedelta(days=14) <= age < timedelta(days=14, minutes=1)
+
+
+def test_other_worker_holding_the_lock_skips_the_run(sweep):
+    keys = Table(5)
+    report, conn = sweep(keys, Table(5), locked=False)
+    assert report.skipped and report.deleted == {}
+    assert conn.statements("DELETE FROM") == []
+    assert len(keys.rows) == 5
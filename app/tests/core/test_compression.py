@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from app.core import compression
+from app.core.compression import GZIP, IDENTITY, ZSTD, compress, decompress, pack_json, unpack_json
+from app.core.config import settings
+from app.core.security.idempotency import _finalize_params, begin_idempotency, finalize_idempotency
+
+_BIG = {"lines": [{"sku": f"SKU-{i}", "qty": i, "desc": "widget " * 4} for i in range(200)]}
+
+
+@pytest.fixture
+def codec(monkeypatch):
+    def _set(name: str, min_bytes: int = 256) -> None:
+        monkeypatch.setattr(settings.db, "PAYLOAD_COMPRESSION", name)
+        monkeypatch.setattr(settings.db, "PAYLOAD_COMPRESSION_MIN_BYTES", min_bytes)
+
+    return _set
+
+
+def test_compression_is_opt_in():
+    assert settings.db.PAYLOAD_COMPRESSION == "none"
+    assert compression.configured_codec() == IDENTITY
+    assert pack_json(_BIG) is _BIG
+
+
+@pytest.mark.parametrize("name", [GZIP, ZSTD])
+def test_round_trip(codec, name):
+    if name == ZSTD:
+        pytest.importorskip("zstandard")
+    codec(name)
+    data = compression.dumps_json(_BIG)
+    used, out = compress(data)
+    assert used == name and len(out) < len(data)
+    assert decompress(used, out) == data
+    packed = pack_json(_BIG)
+    assert packed["__compressed__"] == name
+    assert unpack_json(packed) == _BIG
+
+
+def test_below_threshold_is_stored_as_is(codec):
+    codec(GZIP, min_bytes=10_000)
+    small = {"ok": True}
+    assert compress(b"x" * 9_999) == (IDENTITY, b"x" * 9_999)
+    assert pack_json(small) is small
+    assert unpack_json(small) == small
+
+
+def test_incompressible_data_is_stored_as_is(codec):
+    codec(GZIP, min_bytes=1)
+    noise = bytes(range(256))
+    assert compress(noise) == (IDENTITY, noise)
+
+
+@pytest.mark.parametrize("name", ["none", GZIP])
+def test_user_value_shaped_like_envelope_round_trips(codec, name):
+    codec(name)
+    lookalike = {"__compressed__": "gzip", "data": "bm90IGd6aXA="}
+    stored = pack_json(lookalike)
+    assert stored != lookalike
+    assert unpack_json(stored) == lookalike
+    assert unpack_json(compression.dumps_json(stored).decode()) == lookalike
+
+
+def test_idempotency_json_goes_to_bytea_with_codec(codec):
+    codec(GZIP)
+    params = _finalize_params(
+        record_id=1, http_status=201, response_obj=_BIG, response_body=None,
+        media_type=None, headers=None, lease_owner=None, omitted=False,
+    )
+    assert params["data"] is None
+    assert params["codec"] == GZIP and params["mt"] == "application/json"
+    assert decompress(params["codec"], params["body"]) == compression.dumps_json(_BIG)
+
+
+def test_idempotency_json_uncompressed_stays_queryable(codec):
+    codec("none")
+    params = _finalize_params(
+        record_id=1, http_status=201, response_obj={"ok": True}, response_body=None,
+        media_type=None, headers=None, lease_owner=None, omitted=False,
+    )
+    assert params["data"] == '{"ok": true}'
+    assert params["body"] is None and params["codec"] is None
+
+
+def test_compressed_json_replays_byte_for_byte(codec, memory_db):
+    codec(GZIP)
+
+    async def run():
+        async with memory_db.session() as session:
+            idem = await begin_idempotency(session, client_id="c1", key="k", request_fingerprint="fp")
+            await finalize_idempotency(
+                session, record_id=idem["record_id"], http_status=201, response_obj=_BIG,
+                lease_owner=idem["lease_owner"],
+            )
+            return await begin_idempotency(session, client_id="c1", key="k", request_fingerprint="fp")
+
+    replay = asyncio.run(run())
+    assert replay["cached_status"] == 201
+    assert replay["cached_raw"] == compression.dumps_json(_BIG)
+    assert replay["cached_media_type"] == "application/json"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.util import greenlet_spawn
+
+from app.core.config import settings
+from app.core.database import db_async
+from app.core.database.pool import POOL_CHECKOUT_SECONDS, POOL_TIMEOUTS, InstrumentedAsyncPool
+from app.core.metrics import registry
+
+
+class _Conn:
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _gauges() -> dict:
+    names = ("db_pool_size", "db_pool_max_connections", "db_pool_checked_out", "db_pool_idle", "db_pool_overflow")
+    values = {}
+    for line in registry.render().splitlines():
+        name, _, value = line.partition(" ")
+        if name in names:
+            values[name] = float(value)
+    return values
+
+
+def _checkouts() -> float:
+    counts = [s for s in POOL_CHECKOUT_SECONDS.samples() if s.startswith("db_pool_checkout_seconds_count")]
+    return float(counts[0].rsplit(" ", 1)[1]) if counts else 0.0
+
+
+def test_engine_pool_follows_database_settings():
+    pool = db_async.engine.sync_engine.pool
+    assert isinstance(pool, InstrumentedAsyncPool)
+    db = settings.db
+    assert (pool.size(), pool._max_overflow, pool._timeout) == (db.POOL_SIZE, db.POOL_MAX_OVERFLOW, db.POOL_TIMEOUT_SECONDS)
+    assert pool._recycle == db.POOL_RECYCLE_SECONDS and pool._pool.use_lifo == db.POOL_USE_LIFO
+    assert db_async._connect_args == {"statement_cache_size": db.STATEMENT_CACHE_SIZE}
+
+
+def test_checkouts_timeouts_and_occupancy_are_exported(monkeypatch):
+    pool = InstrumentedAsyncPool(_Conn, pool_size=1, max_overflow=1, timeout=0.05, reset_on_return=None)
+    monkeypatch.setattr(db_async.engine.sync_engine, "pool", pool)
+    timeouts, checkouts = POOL_TIMEOUTS.value(), _checkouts()
+
+    def work():
+        first, second = pool.connect(), pool.connect()
+        busy = _gauges()
+        with pytest.raises(exc.TimeoutError):
+            pool.connect()
+        first.close()
+        second.close()
+        return busy
+
+    busy = asyncio.run(greenlet_spawn(work))
+    assert busy == {
+        "db_pool_size": 1, "db_pool_max_connections": 2,
+        "db_pool_checked_out": 2, "db_pool_idle": 0, "db_pool_overflow": 1,
+    }
+    assert POOL_TIMEOUTS.value() == timeouts + 1
+    assert _checkouts() == checkouts + 3
+    assert _gauges()["db_pool_checked_out"] == 0
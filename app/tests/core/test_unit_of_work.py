@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from app.core.database import unit_of_work as module
+from app.core.database.unit_of_work import UnitOfWork, get_session
+from app.tests.conftest import FakeSession
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    opened: list = []
+
+    def _factory():
+        opened.append(FakeSession())
+        return opened[-1]
+
+    monkeypatch.setattr(module, "AsyncSessionLocal", _factory)
+    return opened
+
+
+def test_session_is_opened_lazily_and_shared(sessions):
+    uow = UnitOfWork()
+    asyncio.run(uow.close())
+    assert sessions == []
+    assert uow.session is uow.session and len(sessions) == 1
+    assert uow.owns(sessions[0]) and not uow.owns(FakeSession())
+
+
+def test_deferred_writes_are_committed_on_close(sessions):
+    uow = UnitOfWork()
+
+    async def run():
+        await uow.session.execute("UPDATE client_keys ...")
+        uow.defer()
+        await uow.close()
+
+    asyncio.run(run())
+    [session] = sessions
+    assert (session.commits, session.closed) == (1, True)
+
+
+def test_handler_commit_carries_the_deferred_writes(sessions):
+    uow = UnitOfWork()
+
+    async def run():
+        await uow.session.execute("INSERT INTO idempotency_keys ...")
+        uow.defer()
+        await uow.session.execute("INSERT INTO invoices ...")
+        await uow.commit()
+        await uow.close()
+
+    asyncio.run(run())
+    # un solo commit: el claim y el handler salen juntos
+    assert sessions[0].commits == 1
+
+
+def test_get_session_rolls_back_a_failed_request(sessions):
+    request = Request({"type": "http", "headers": []})
+
+    async def run():
+        deps = get_session(request)
+        session = await deps.__anext__()
+        await session.execute("UPDATE client_keys ...")
+        request.state.uow.defer()
+        with pytest.raises(RuntimeError):
+            await deps.athrow(RuntimeError("handler failed"))
+        return session
+
+    session = asyncio.run(run())
+    assert (session.rollbacks, session.commits, session.closed) == (1, 0, True)
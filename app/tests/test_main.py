@@ -0,0 +1,42 @@
+import asyncio
+import importlib
+
+import httpx
+import pytest
+from starlette.middleware.cors import CORSMiddleware
+
+from app.core.config import settings
+from app.core.security.credential_cache import credential_cache
+
+_ORIGIN = "http://front.test"
+
+
+@pytest.fixture
+def cors_app(monkeypatch):
+    import app.main as main
+
+    monkeypatch.setattr(settings.cors, "BACKEND_CORS_ORIGINS", [_ORIGIN])
+    yield importlib.reload(main).app
+    monkeypatch.undo()
+    importlib.reload(main)
+    credential_cache.clear()
+
+
+def test_cors_is_the_outermost_middleware(cors_app):
+    assert cors_app.user_middleware[0].cls is CORSMiddleware
+
+
+def test_early_auth_rejection_carries_cors_headers(cors_app):
+    credential_cache.negative.add("ghost")
+
+    async def run():
+        transport = httpx.ASGITransport(app=cors_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                f"{settings.app.API_V1_STR}/invoices",
+                headers={"Origin": _ORIGIN, "X-Client-Id": "ghost"},
+            )
+
+    resp = asyncio.run(run())
+    assert resp.status_code == 401
+    assert resp.headers["access-control-allow-origin"] == _ORIGIN